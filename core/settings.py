@@ -58,6 +58,65 @@ ROOT_URLCONF = 'core.urls'
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = config("GOOGLE_APPLICATION_CREDENTIALS")
 GOOGLE_CLOUD_PATH = os.getenv("GOOGLE_CLOUD_PATH")
+# Invoice pipeline: 'live' calls Vision/OpenAI/GCS, 'record' also saves fixtures, 'replay' serves them offline
+INVOICE_REPLAY_MODE = os.getenv("INVOICE_REPLAY_MODE", "live")
+INVOICE_REPLAY_DIR = os.getenv("INVOICE_REPLAY_DIR", str(BASE_DIR / 'invoices' / 'fixtures'))
+# Chunked invoice uploads are staged here until finalized and handed to the ingestion workers
+INVOICE_UPLOAD_STAGING_DIR = os.getenv("INVOICE_UPLOAD_STAGING_DIR", str(BASE_DIR / 'invoices' / 'staging'))
+INVOICE_UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+INVOICE_UPLOAD_MAX_SIZE = 200 * 1024 * 1024
+INVOICE_INGEST_WORKERS = int(os.getenv("INVOICE_INGEST_WORKERS", "2"))
+# Uploads failing on timeouts/outages are retried with exponential backoff, then dead-lettered
+INVOICE_INGEST_MAX_ATTEMPTS = int(os.getenv("INVOICE_INGEST_MAX_ATTEMPTS", "5"))
+INVOICE_INGEST_RETRY_BASE_SECONDS = int(os.getenv("INVOICE_INGEST_RETRY_BASE_SECONDS", "30"))
+INVOICE_INGEST_RETRY_MAX_SECONDS = int(os.getenv("INVOICE_INGEST_RETRY_MAX_SECONDS", "3600"))
+# Drop folders watched by `manage.py watch_invoices` (separated by os.pathsep)
+INVOICE_WATCH_DIRS = [path for path in os.getenv("INVOICE_WATCH_DIRS", "").split(os.pathsep) if path]
+# Threads for per-page network calls, and processes for CPU-bound image work (0 runs it inline)
+INVOICE_NETWORK_WORKERS = int(os.getenv("INVOICE_NETWORK_WORKERS", "4"))
+INVOICE_IMAGE_WORKERS = int(os.getenv("INVOICE_IMAGE_WORKERS", str(os.cpu_count() or 1)))
+# Vision OCR: pages arriving within this window share one batch request; the endpoint override points at a stub
+INVOICE_OCR_BATCH_WAIT_MS = int(os.getenv("INVOICE_OCR_BATCH_WAIT_MS", "50"))
+INVOICE_OCR_ENDPOINT = os.getenv("INVOICE_OCR_ENDPOINT")
+# Page images are re-encoded to fit this budget before OCR (format: JPEG or WEBP)
+INVOICE_OCR_MAX_SIDE = int(os.getenv("INVOICE_OCR_MAX_SIDE", "2048"))
+INVOICE_OCR_FORMAT = os.getenv("INVOICE_OCR_FORMAT", "JPEG")
+INVOICE_OCR_QUALITY = int(os.getenv("INVOICE_OCR_QUALITY", "80"))
+INVOICE_OCR_MAX_BYTES = int(os.getenv("INVOICE_OCR_MAX_BYTES", str(1024 * 1024)))
+# Extracted text longer than this is cut down to anchor lines and table rows before the LLM sees it
+INVOICE_LLM_REDUCE_MIN_CHARS = int(os.getenv("INVOICE_LLM_REDUCE_MIN_CHARS", "2000"))
+# Per-service budgets shared by all workers on this host (None = unlimited); Vision "tokens" are images
+INVOICE_RATE_LIMIT_DIR = os.getenv("INVOICE_RATE_LIMIT_DIR", str(BASE_DIR / 'invoices' / 'ratelimit'))
+INVOICE_RATE_LIMITS = {
+    'openai': {'requests_per_minute': 500, 'tokens_per_minute': 30000, 'max_concurrency': 8, 'latency_target': 30.0},
+    'vision': {'requests_per_minute': None, 'tokens_per_minute': 1800, 'max_concurrency': 8},
+    'gcs': {'requests_per_minute': 1000, 'max_concurrency': 16},
+}
+# Scanned pages whose perceptual hash is within this many bits (of 64) of a stored page are skipped as re-scans
+# when their QR codes also match, and otherwise saved as suspected duplicates of it;
+# up to 7 the lookup probes one flipped bit per 16-bit band, above that it gets much slower
+INVOICE_DUPLICATE_MAX_DISTANCE = int(os.getenv("INVOICE_DUPLICATE_MAX_DISTANCE", "7"))
+# First-page WebP thumbnails made at ingestion, stored by content hash in the "invoice_previews" storage
+INVOICE_PREVIEW_MAX_SIDE = int(os.getenv("INVOICE_PREVIEW_MAX_SIDE", "320"))
+INVOICE_PREVIEW_QUALITY = int(os.getenv("INVOICE_PREVIEW_QUALITY", "70"))
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    "invoice_previews": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        "OPTIONS": {"location": os.getenv("INVOICE_PREVIEW_DIR", str(BASE_DIR / 'invoices' / 'previews'))},
+    },
+}
+# Journal entry numbers each process reserves at a time (finance.sequences); unused ones become gaps on restart,
+# and so do numbers of postings that roll back
+JOURNAL_NUMBER_BLOCK_SIZE = int(os.getenv("JOURNAL_NUMBER_BLOCK_SIZE", "50"))
+# Bulk CSV/XLSX imports (finance.imports): rows written per transaction, and where error reports go
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "2000"))
+IMPORT_REPORT_DIR = os.getenv("IMPORT_REPORT_DIR", str(BASE_DIR / 'imports' / 'reports'))
+# Month fiscal years start in (4 = April to March, named like "2025-2026"); see finance.periods
+FISCAL_YEAR_START_MONTH = int(os.getenv("FISCAL_YEAR_START_MONTH", "4"))
+# Rows per page in the list views (finance.pagination)
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", "50"))
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -1,11 +1,77 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 
-from finance.models import Account, AccountingDimension, Budget, Company, CostCenter, CostCenterAllocation, Customer, Invoice, JournalEntry, Supplier
+from finance.models import Account, AccountingDimension, Budget, Company, CostCenter, CostCenterAllocation, Customer, FiscalYear, Invoice, InvoiceDeadLetter, InvoiceLineItem, InvoicePageHash, InvoiceUpload, JournalEntry, NumberSequence, OpeningBalance, RowCount, Supplier
+
+admin.site.register(InvoiceUpload)
+admin.site.register(InvoiceLineItem)
+admin.site.register(InvoicePageHash)
+
+
+@admin.register(Invoice)
+class InvoiceAdmin(admin.ModelAdmin):
+    list_display = ('invoice_number', 'date', 'supplier', 'total_amount', 'status', 'duplicate_of', 'duplicate_distance')
+    list_select_related = ('supplier', 'duplicate_of')
+    # "Not empty" lists the scans saved as suspected duplicates (finance.duplicates) for review
+    list_filter = ('status', ('duplicate_of', admin.EmptyFieldListFilter))
+    search_fields = ('invoice_id', 'invoice_number')
+    raw_id_fields = ('duplicate_of',)
+
+
+@admin.register(InvoiceDeadLetter)
+class InvoiceDeadLetterAdmin(admin.ModelAdmin):
+    list_display = ('upload', 'attempts', 'transient', 'created_at')
+    list_filter = ('transient',)
+    search_fields = ('upload__filename', 'error')
+    actions = ['requeue']
+
+    @admin.action(description="Requeue selected uploads")
+    def requeue(self, request, queryset):
+        from finance.views import requeue_dead_letters
+
+        requeued = requeue_dead_letters(queryset)
+        self.message_user(request, f"{len(requeued)} upload(s) requeued for ingestion.")
+
+
+@admin.register(FiscalYear)
+class FiscalYearAdmin(admin.ModelAdmin):
+    list_display = ('name', 'start_date', 'end_date', 'is_closed', 'closed_at', 'closed_by')
+    readonly_fields = ('is_closed', 'closed_at', 'closed_by')
+    actions = ['close']
+
+    @admin.action(description="Close selected fiscal years and carry balances forward")
+    def close(self, request, queryset):
+        from finance.periods import close_fiscal_year
+
+        for year in queryset.filter(is_closed=False).order_by('start_date'):
+            try:
+                following = close_fiscal_year(year, user=request.user)
+            except ValueError as e:
+                self.message_user(request, str(e), level=messages.ERROR)
+                return
+            self.message_user(request, f"{year} closed; opening balances written to {following}.")
+
+
+@admin.register(OpeningBalance)
+class OpeningBalanceAdmin(admin.ModelAdmin):
+    list_display = ('fiscal_year', 'account', 'debit_amount', 'credit_amount')
+    list_filter = ('fiscal_year',)
+
+    def has_change_permission(self, request, obj=None):
+        return False  # written by closing a fiscal year
+
+
+@admin.register(RowCount)
+class RowCountAdmin(admin.ModelAdmin):
+    list_display = ('table_name', 'company_id', 'slot', 'row_count')
+    list_filter = ('table_name',)
+
+    def has_change_permission(self, request, obj=None):
+        return False  # kept by database triggers; fix drift with reconcile_row_counts
 
-admin.site.register(Invoice)
 admin.site.register(Company)
 admin.site.register(Account)
 admin.site.register(JournalEntry)
+admin.site.register(NumberSequence)
 admin.site.register(Supplier)
 admin.site.register(Customer)
 admin.site.register(Budget)
@@ -1,5 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate, pre_migrate
 
 
 class FinanceConfig(AppConfig):
     name = 'finance'
+
+    def ready(self):
+        from . import triggers
+
+        # The search index's and row counters' triggers are dropped around schema changes
+        pre_migrate.connect(triggers.drop, sender=self, dispatch_uid='finance-drop-triggers')
+        post_migrate.connect(triggers.install, sender=self, dispatch_uid='finance-install-triggers')
@@ -0,0 +1,207 @@
+from django.db import connection as default_connection, transaction
+from django.db.models import Sum
+
+from .models import (
+    Account, AccountingDimension, BankAccount, BankAccountSubtype, BankAccountType, BankGuarantee, Budget,
+    Company, CostCenter, CostCenterAllocation, Customer, DeductionCertificate, Dunning, DunningType, Invoice,
+    JournalEntry, ProcessPaymentReconciliation, RowCount, Supplier, TaxCategory, TaxItemTemplate, TaxRule,
+    TaxWithholdingCategory, UnreconcilePayment,
+)
+
+# Row counts of the listed tables, per company, in finance_rowcount (RowCount),
+# so list pages can show "50 of 1,204,331" without a COUNT(*) over the table.
+# The database keeps the counters, like the search index, through triggers on
+# insert, delete and a change of company, so bulk_create, queryset.delete(),
+# imports and raw SQL are all counted:
+#   - SQLite: row triggers upserting into finance_rowcount;
+#   - PostgreSQL: statement triggers over the transition tables, one upsert per
+#     statement and company, so a bulk insert does not update the row per line.
+#     Each counter is spread over SLOTS rows (picked by backend pid) and summed
+#     on read, so concurrent postings for one company do not serialize on it.
+# Other databases have no triggers and count() falls back to COUNT(*).
+# TRUNCATE is not counted; `manage.py reconcile_row_counts` recounts
+# everything and reports any drift.
+
+COUNTED = (
+    Account, AccountingDimension, BankAccount, BankAccountSubtype, BankAccountType, BankGuarantee, Budget,
+    Company, CostCenter, CostCenterAllocation, Customer, DeductionCertificate, Dunning, DunningType, Invoice,
+    JournalEntry, ProcessPaymentReconciliation, Supplier, TaxCategory, TaxItemTemplate, TaxRule,
+    TaxWithholdingCategory, UnreconcilePayment,
+)
+COUNTER_TABLE = RowCount._meta.db_table
+# Counter rows per table and company on PostgreSQL; a counter is the sum of its slots
+SLOTS = 16
+
+
+def _company_column(model):
+    """Column holding the row's company, or None for tables that are not per company."""
+    for field in model._meta.concrete_fields:
+        if field.is_relation and field.related_model is Company and field.name == 'company':
+            return field.column
+    return None
+
+
+def _upsert(values):
+    """INSERT ... SELECT/VALUES adding `values` (table, company, slot, delta) onto the matching counter row."""
+    return (
+        f"INSERT INTO {COUNTER_TABLE} (table_name, company_id, slot, row_count) {values} "
+        f"ON CONFLICT (table_name, company_id, slot) "
+        f"DO UPDATE SET row_count = {COUNTER_TABLE}.row_count + excluded.row_count"
+    )
+
+
+def _sqlite_triggers(model):
+    # SQLite has one writer at a time anyway, so everything goes to slot 0
+    table, column = model._meta.db_table, _company_column(model)
+    new_key = f"coalesce(NEW.{column}, 0)" if column else "0"
+    old_key = f"coalesce(OLD.{column}, 0)" if column else "0"
+    add = _upsert(f"VALUES ('{table}', {new_key}, 0, 1)") + ";"
+    remove = _upsert(f"VALUES ('{table}', {old_key}, 0, -1)") + ";"
+    statements = [
+        f"CREATE TRIGGER IF NOT EXISTS finance_count_{table}_insert AFTER INSERT ON {table} BEGIN {add} END",
+        f"CREATE TRIGGER IF NOT EXISTS finance_count_{table}_delete AFTER DELETE ON {table} BEGIN {remove} END",
+    ]
+    if column:
+        statements.append(
+            f"CREATE TRIGGER IF NOT EXISTS finance_count_{table}_move AFTER UPDATE OF {column} ON {table} "
+            f"WHEN OLD.{column} IS NOT NEW.{column} BEGIN {remove} {add} END"
+        )
+    return statements
+
+
+def _postgresql_triggers(model):
+    table, column = model._meta.db_table, _company_column(model)
+    key = f"coalesce({column}, 0)" if column else "0"
+    # Each backend adds to its own slot row, so concurrent transactions posting to
+    # the same table and company do not queue on one counter row until commit
+    slot = f"pg_backend_pid() % {SLOTS}"
+    bodies = {
+        'insert': (
+            _upsert(f"SELECT '{table}', {key}, {slot}, count(*) FROM new_rows GROUP BY 2"),
+            "REFERENCING NEW TABLE AS new_rows",
+        ),
+        'delete': (
+            _upsert(f"SELECT '{table}', {key}, {slot}, -count(*) FROM old_rows GROUP BY 2"),
+            "REFERENCING OLD TABLE AS old_rows",
+        ),
+    }
+    if column:
+        # Transition tables rule out UPDATE OF <column>, so every update nets out the moves between companies
+        bodies['update'] = (
+            _upsert(
+                f"SELECT '{table}', company_id, {slot}, sum(change) FROM ("
+                f"SELECT {key} AS company_id, 1 AS change FROM new_rows "
+                f"UNION ALL SELECT {key}, -1 FROM old_rows) moved "
+                f"GROUP BY company_id HAVING sum(change) <> 0"
+            ),
+            "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+        )
+    statements = []
+    for event, (body, referencing) in bodies.items():
+        function = f"finance_count_{table}_{event}"
+        statements += [
+            f"CREATE OR REPLACE FUNCTION {function}() RETURNS trigger LANGUAGE plpgsql AS $$ "
+            f"BEGIN {body}; RETURN NULL; END $$",
+            f"DROP TRIGGER IF EXISTS finance_count_{event} ON {table}",
+            f"CREATE TRIGGER finance_count_{event} AFTER {event.upper()} ON {table} {referencing} "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION {function}()",
+        ]
+    return statements
+
+
+def _drop_statements(model, connection):
+    table = model._meta.db_table
+    if connection.vendor == 'sqlite':
+        return [f"DROP TRIGGER IF EXISTS finance_count_{table}_{event}" for event in ('insert', 'delete', 'move')]
+    statements = []
+    for event in ('insert', 'delete', 'update'):
+        statements += [
+            f"DROP TRIGGER IF EXISTS finance_count_{event} ON {table}",
+            f"DROP FUNCTION IF EXISTS finance_count_{table}_{event}()",
+        ]
+    return statements
+
+
+def _run(connection, statements):
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def supported(connection=default_connection):
+    return connection.vendor in ('sqlite', 'postgresql')
+
+
+def installed(connection=default_connection):
+    """Whether the counter table exists (migration 0048 creates it)."""
+    return supported(connection) and COUNTER_TABLE in connection.introspection.table_names()
+
+
+def install(connection=default_connection):
+    """Create the counting triggers (idempotent) and count every table from scratch; returns reconcile()'s drift."""
+    if not supported(connection):
+        return []
+    triggers = _sqlite_triggers if connection.vendor == 'sqlite' else _postgresql_triggers
+    with transaction.atomic(using=connection.alias):
+        _run(connection, [statement for model in COUNTED for statement in triggers(model)])
+        return reconcile(connection)
+
+
+def uninstall(connection=default_connection):
+    if supported(connection):
+        _run(connection, [statement for model in COUNTED for statement in _drop_statements(model, connection)])
+
+
+def reconcile(connection=default_connection):
+    """
+    Recount every counted table and overwrite its counters, folding the slots back into slot 0.
+
+    Returns:
+        list: (table, company_id, counter value, actual rows) for every counter that was wrong.
+    """
+    drift = []
+    for model in COUNTED:
+        table, column = model._meta.db_table, _company_column(model)
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Writers wait until the count is in; readers carry on
+                cursor.execute(f"LOCK TABLE {table} IN SHARE MODE")
+            cursor.execute(
+                f"SELECT company_id, sum(row_count) FROM {COUNTER_TABLE} WHERE table_name = %s GROUP BY company_id",
+                [table],
+            )
+            stored = {company_id: int(rows) for company_id, rows in cursor.fetchall()}
+            # Deleting first takes SQLite's write lock, so no insert lands between the count and the rewrite
+            cursor.execute(f"DELETE FROM {COUNTER_TABLE} WHERE table_name = %s", [table])
+            key = f"coalesce({column}, 0)" if column else "0"
+            cursor.execute(f"SELECT {key}, count(*) FROM {table} GROUP BY 1")
+            actual = dict(cursor.fetchall())
+            for company_id, rows in actual.items():
+                cursor.execute(
+                    f"INSERT INTO {COUNTER_TABLE} (table_name, company_id, slot, row_count) VALUES (%s, %s, 0, %s)",
+                    [table, company_id, rows],
+                )
+        for company_id in sorted(set(stored) | set(actual)):
+            if stored.get(company_id, 0) != actual.get(company_id, 0):
+                drift.append((table, company_id, stored.get(company_id, 0), actual.get(company_id, 0)))
+    return drift
+
+
+def count(model, company=None):
+    """
+    Rows of `model` (only `company`'s rows if given, a Company or its id) without counting the table.
+
+    Falls back to COUNT(*) for models that are not counted and on databases without the triggers.
+    """
+    company_id = getattr(company, 'pk', company)
+    if model not in COUNTED or not supported():
+        queryset = model.objects.all()
+        if company_id is not None:
+            queryset = queryset.filter(company_id=company_id)
+        return queryset.count()
+    counters = RowCount.objects.filter(table_name=model._meta.db_table)
+    if company_id is not None:
+        if _company_column(model) is None:
+            raise ValueError(f"{model.__name__} rows are not counted per company")
+        counters = counters.filter(company_id=company_id)
+    return counters.aggregate(rows=Sum('row_count'))['rows'] or 0
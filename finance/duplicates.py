@@ -0,0 +1,171 @@
+import hashlib
+import threading
+from array import array
+from functools import lru_cache
+from itertools import combinations
+
+import numpy as np
+from django.conf import settings
+
+from .models import Invoice, InvoicePageHash
+
+# Near-duplicate lookup for scanned pages, run before OCR/LLM so a re-scan of
+# an invoice we already hold costs no API calls even if the LLM would misread
+# its number. A close hash alone does not prove a re-scan (invoices printed on
+# one template sit a few bits apart), so only a page whose QR payload also
+# matches the stored page is skipped; other matches are saved and flagged as
+# suspected duplicates (Invoice.duplicate_of) for review.
+#
+# Page pHashes live in InvoicePageHash; each process keeps an in-memory
+# multi-index over them (the 64 bits split into four 16-bit bands, one hash
+# table per band). Two hashes within distance d share at least one
+# band within d // 4 bits, so probing every band at that radius finds every
+# match while only touching a few buckets, even with millions of pages.
+# New rows are pulled in incrementally by primary key before each lookup.
+
+HASH_BITS = 64
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+
+def to_db(page_hash):
+    """Unsigned 64-bit hash -> signed value for a BigIntegerField."""
+    return page_hash - (1 << HASH_BITS) if page_hash >= 1 << (HASH_BITS - 1) else page_hash
+
+
+def from_db(value):
+    return value & ((1 << HASH_BITS) - 1)
+
+
+def qr_digest(payload):
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest() if payload else ''
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def _bands(page_hash):
+    return [(page_hash >> (band * BAND_BITS)) & BAND_MASK for band in range(BANDS)]
+
+
+@lru_cache(maxsize=None)
+def _flip_masks(radius):
+    """XOR masks for every way of flipping up to `radius` bits of one band."""
+    return tuple(
+        sum(1 << bit for bit in bits)
+        for flips in range(radius + 1)
+        for bits in combinations(range(BAND_BITS), flips)
+    )
+
+
+class PageHashIndex:
+    """Append-only multi-index hash table: page hash -> invoice id (and QR digest prefix)."""
+
+    def __init__(self):
+        self.hashes = array('Q')
+        self.invoices = array('q')
+        self.qr = array('Q')  # first 8 bytes of the QR digest, 0 when the page had no QR code
+        self._tables = [{} for _ in range(BANDS)]
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, page_hash, invoice_id, qr=0):
+        position = len(self.hashes)
+        self.hashes.append(page_hash)
+        self.invoices.append(invoice_id)
+        self.qr.append(qr)
+        for table, value in zip(self._tables, _bands(page_hash)):
+            bucket = table.get(value)
+            if bucket is None:
+                bucket = table[value] = array('I')
+            bucket.append(position)
+
+    def search(self, page_hash, max_distance):
+        """Positions of stored hashes within `max_distance` bits, with their distances."""
+        masks = _flip_masks(max_distance // BANDS)
+        buckets = []
+        for table, value in zip(self._tables, _bands(page_hash)):
+            for mask in masks:
+                bucket = table.get(value ^ mask)
+                if bucket is not None:
+                    buckets.append(bucket)
+        if not buckets:
+            return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint8)
+        positions = np.unique(np.concatenate([np.frombuffer(bucket, dtype=np.uint32) for bucket in buckets]))
+        hashes = np.frombuffer(self.hashes, dtype=np.uint64)[positions]
+        distances = np.bitwise_count(hashes ^ np.uint64(page_hash))
+        close = distances <= max_distance
+        return positions[close], distances[close]
+
+
+def _qr_key(digest):
+    return int(digest[:16], 16) if digest else 0
+
+
+_index = PageHashIndex()
+_last_id = 0
+_lock = threading.Lock()
+
+
+def _sync():
+    """Add page hashes stored (by any process) since the last lookup."""
+    global _last_id
+    rows = (
+        InvoicePageHash.objects.filter(id__gt=_last_id)
+        .order_by('id')
+        .values_list('id', 'phash', 'invoice_id', 'qr_digest')
+    )
+    for row_id, phash, invoice_id, digest in rows.iterator(chunk_size=10000):
+        _index.add(from_db(phash), invoice_id, _qr_key(digest))
+        _last_id = row_id
+
+
+def find_duplicate(page_hash, qr_payload=None, max_distance=None):
+    """
+    Stored invoice that a scanned page is a near-duplicate of.
+
+    A page matches when its hash is within `max_distance` bits of a stored page.
+    When both pages carry a QR code the payloads must also agree, which keeps
+    different invoices printed on the same template apart; such a match is
+    confirmed, any other is only suspected.
+
+    Returns:
+        tuple: (Invoice, distance, confirmed) for the best match (confirmed first,
+               then the closest), or None.
+    """
+    if page_hash is None:
+        return None
+    if max_distance is None:
+        max_distance = settings.INVOICE_DUPLICATE_MAX_DISTANCE
+    qr = _qr_key(qr_digest(qr_payload))
+
+    with _lock:
+        _sync()
+        positions, distances = _index.search(page_hash, max_distance)
+        matches = []
+        for position, distance in zip(positions.tolist(), distances.tolist()):
+            stored_qr = _index.qr[position]
+            if qr and stored_qr and qr != stored_qr:
+                continue
+            matches.append((bool(qr and stored_qr), distance, _index.invoices[position]))
+
+    if not matches:
+        return None
+    # The index is append-only; skip invoices deleted since their hashes were loaded
+    invoices = Invoice.objects.in_bulk({invoice_id for _, _, invoice_id in matches})
+    for confirmed, distance, invoice_id in sorted(matches, key=lambda match: (not match[0], match[1])):
+        if invoice_id in invoices:
+            return invoices[invoice_id], distance, confirmed
+    return None
+
+
+def page_hash_rows(invoice, fingerprints):
+    """Unsaved InvoicePageHash rows for (page_hash, qr_payload) pairs, in page order."""
+    return [
+        InvoicePageHash(invoice=invoice, page_number=page_number, phash=to_db(page_hash), qr_digest=qr_digest(qr_payload))
+        for page_number, (page_hash, qr_payload) in enumerate(fingerprints or [], start=1)
+        if page_hash is not None
+    ]
@@ -0,0 +1,117 @@
+import re
+import unicodedata
+from collections import namedtuple
+
+import fitz
+
+# Decides which pages of an uploaded PDF belong to the same invoice, so each
+# logical invoice goes through OCR/LLM exactly once instead of relying on the
+# user to say "split" or "merge". Only cheap local signals are used, all taken
+# before any external call:
+#   - page-number footers ("Page 2 of 3", "صفحة 2 من 3") tie pages together,
+#     and "Page 1" / a page k of k marks a boundary;
+#   - invoice-number anchors ("Invoice No: INV-1042", "رقم الفاتورة") from the
+#     text layer: a different number starts a new invoice;
+#   - per-page QR codes (e-invoices carry one per invoice): a different payload
+#     starts a new invoice. Whether the QR opens or closes an invoice is read
+#     off the first page.
+# Pages without any signal stay with the invoice before them, which is the
+# old merge behaviour.
+
+ARABIC_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩", "0123456789")
+INVOICE_NUMBER = (
+    re.compile(
+        r"\b(?:tax\s+)?(?:invoice|inv|bill|folio|receipt)\s*\.?\s*(?:no|number|num|#)\b\.?[\s:#.\-]*"
+        r"([A-Z0-9][A-Z0-9/_\-]*\d[A-Z0-9/_\-]*)",
+        re.IGNORECASE,
+    ),
+    re.compile(r"(?:رقم\s+الفاتورة|فاتورة\s+رقم)[\s:#.\-]*([A-Za-z0-9/_\-]*\d[A-Za-z0-9/_\-]*)"),
+)
+# "Page 2 of 3", "Page No. : 1 of 1", "page: 2/3", "صفحة 2 من 3"
+PAGE_FOOTER = re.compile(
+    r"(?:\bpage|الصفحة|صفحة)[\s:.]*(?:no\b[\s:.]*)?(\d{1,3})\s*(?:of|/|من)\s*(\d{1,3})", re.IGNORECASE,
+)
+
+PageSignals = namedtuple('PageSignals', ['invoice_number', 'page', 'page_count', 'qr'])
+
+
+def _fold(text):
+    return unicodedata.normalize("NFKC", text or "").translate(ARABIC_DIGITS)
+
+
+def page_signals(text=None, qr_payload=None):
+    """Grouping signals of one page from its text layer (may be empty) and QR payload."""
+    text = _fold(text)
+    invoice_number = None
+    for pattern in INVOICE_NUMBER:
+        match = pattern.search(text)
+        if match:
+            invoice_number = match.group(1).upper().strip("-/_.")
+            break
+    page = page_count = None
+    footer = PAGE_FOOTER.search(text)
+    if footer:
+        page, page_count = int(footer.group(1)), int(footer.group(2))
+        if not 1 <= page <= page_count:
+            page = page_count = None
+    return PageSignals(invoice_number, page, page_count, qr_payload or None)
+
+
+def group_pages(signals):
+    """
+    Split a document's pages into invoices.
+
+    Args:
+        signals: PageSignals per page, in page order.
+
+    Returns:
+        list[list[int]]: 1-based page numbers of each invoice, in order.
+    """
+    if not signals:
+        return []
+    qr_opens = signals[0].qr is not None
+    groups = []
+    group_number = group_qr = None
+    previous = None
+    for number, page in enumerate(signals, start=1):
+        if previous is None:
+            new = True
+        elif page.page is not None and page.page > 1:
+            new = False  # "Page 2 of 3" continues whatever came before
+        elif page.page == 1:
+            new = True
+        elif previous.page is not None and previous.page == previous.page_count:
+            new = True
+        elif page.invoice_number and group_number:
+            new = page.invoice_number != group_number
+        elif page.qr and group_qr and page.qr != group_qr:
+            new = True
+        elif page.qr and group_qr:
+            new = False
+        else:
+            # A QR printed at the foot of an invoice closes it
+            new = not qr_opens and previous.qr is not None and not page.invoice_number
+
+        if new:
+            groups.append([])
+            group_number = group_qr = None
+        groups[-1].append(number)
+        group_number = group_number or page.invoice_number
+        group_qr = group_qr or page.qr
+        previous = page
+    return groups
+
+
+def page_texts(pdf_bytes):
+    """Text layer of every page (empty strings for a scan without one)."""
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        # Reading order keeps a label and its value together ("Page No." ... "1 of 1")
+        return [page.get_text(sort=True) for page in doc]
+
+
+def extract_pages(pdf_bytes, page_numbers):
+    """A new PDF holding only the given 1-based pages."""
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as source, fitz.open() as target:
+        for number in page_numbers:
+            target.insert_pdf(source, from_page=number - 1, to_page=number - 1)
+        return target.tobytes()
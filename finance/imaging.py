@@ -0,0 +1,361 @@
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import cv2
+import fitz
+import numpy as np
+from PIL import Image
+
+# CPU-bound image work (PDF rasterizing, PNG encode/decode, merging, rotation,
+# QR decoding, perceptual hashing, preview thumbnails) runs here in a process
+# pool, so it scales with cores instead of serializing on the GIL next to the
+# network-bound pipeline threads. Workers only ever receive raw bytes or a shared-memory
+# reference, never PIL objects. Nothing in this module may need Django inside
+# a worker process.
+
+PDF_RENDER_ZOOM = 2  # same resolution as the old fitz.Matrix(2, 2) rendering
+HASH_SIZE = 8  # 8x8 low-frequency DCT terms -> 64-bit perceptual hash
+HASH_SAMPLE = HASH_SIZE * 4
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _worker_count():
+    from django.conf import settings
+    return getattr(settings, 'INVOICE_IMAGE_WORKERS', os.cpu_count() or 1)
+
+
+def _get_pool():
+    """Process pool shared by the whole process; None when INVOICE_IMAGE_WORKERS is 0 (run inline)."""
+    global _pool
+    workers = _worker_count()
+    if workers <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+def _run(fn, *args):
+    pool = _get_pool()
+    if pool is None:
+        return fn(*args)
+    try:
+        return pool.submit(fn, *args).result()
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM on a huge scan); start a fresh pool for the next call
+        _reset_pool()
+        raise
+
+
+class _SharedBytes:
+    """Copies a byte string into shared memory once so several workers can read it without pickling."""
+
+    def __init__(self, data):
+        self.size = len(data)
+        self._shm = shared_memory.SharedMemory(create=True, size=max(self.size, 1))
+        self._shm.buf[:self.size] = data
+        self.ref = ('shm', self._shm.name, self.size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._shm.close()
+        self._shm.unlink()
+
+
+def _load_source(source):
+    """Worker side: bytes passed directly, or a ('shm', name, size) reference."""
+    if isinstance(source, (bytes, bytearray)):
+        return source
+    _, name, size = source
+    # Spawned workers share the parent's resource tracker, which unlinks the segment
+    # only when the parent does; the worker just attaches, copies and detaches
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(shm.buf[:size])
+    finally:
+        shm.close()
+
+
+def _encode_png(image):
+    buf = io.BytesIO()
+    image.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def _stack_vertically(images):
+    max_width = max(img.width for img in images)
+    total_height = sum(
+        int(img.height * (max_width / img.width)) if img.width < max_width else img.height
+        for img in images
+    )
+    merged_image = Image.new("RGB", (max_width, total_height), "white")
+
+    y_offset = 0
+    for img in images:
+        img = img.resize((max_width, int(img.height * (max_width / img.width)))) if img.width < max_width else img
+        merged_image.paste(img, (0, y_offset))
+        y_offset += img.height
+    return merged_image
+
+
+def _render_pages_worker(source, page_numbers, merge):
+    doc = fitz.open(stream=_load_source(source), filetype="pdf")
+    if page_numbers is None:
+        page_numbers = range(len(doc))
+    images = []
+    for page_number in page_numbers:
+        pix = doc[page_number].get_pixmap(matrix=fitz.Matrix(PDF_RENDER_ZOOM, PDF_RENDER_ZOOM))
+        images.append(Image.frombytes("RGB", [pix.width, pix.height], pix.samples))
+    if not images:
+        return []
+    if merge:
+        return [_encode_png(_stack_vertically(images))]
+    return [_encode_png(img) for img in images]
+
+
+def _merge_encoded_worker(image_list):
+    return _encode_png(_stack_vertically([Image.open(io.BytesIO(img)) for img in image_list]))
+
+
+def _rotate_worker(source_path, output_path, angle):
+    with Image.open(source_path) as img:
+        rotated_img = img.rotate(angle, expand=True)
+        if output_path.lower().endswith(('.jpg', '.jpeg')) and rotated_img.mode not in ('RGB', 'L'):
+            rotated_img = rotated_img.convert('RGB')
+        rotated_img.save(output_path)
+    return output_path
+
+
+def _profile_sharpness(binary):
+    """How sharply the row profile alternates between ink and gaps; high when text lines run horizontally."""
+    profile = binary.mean(axis=1)
+    return float(np.square(np.diff(profile)).mean())
+
+
+def _baseline_lean(binary, strip_width=32):
+    """
+    Positive when text lines stand upright: letters and digits share a sharp bottom
+    edge (the baseline) while their tops are ragged, so each line's row profile drops
+    more steeply at its foot than it rises at its head. Narrow strips keep a few
+    degrees of skew and side-by-side columns from blurring the edges.
+    """
+    lean = 0.0
+    for left in range(0, binary.shape[1], strip_width):
+        profile = binary[:, left:left + strip_width].mean(axis=1)
+        steps = np.diff(np.concatenate([[0.0], profile, [0.0]]))
+        ink = np.flatnonzero(profile)
+        # Split the strip's inked rows into lines at the blank rows between them
+        for line in np.split(ink, np.flatnonzero(np.diff(ink) > 1) + 1):
+            if len(line) >= 4:
+                rise, fall = steps[line[0]:line[-1] + 2], -steps[line[0]:line[-1] + 2]
+                lean += fall.max() - rise.max()
+    return lean
+
+
+def _text_angle_worker(image_path, max_side, sideways_ratio):
+    gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        return 0
+    height, width = gray.shape
+    scale = max_side / max(height, width)
+    if scale < 1:
+        gray = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+    _, binary = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    binary = binary.astype(np.float32)
+    rows, columns = _profile_sharpness(binary), _profile_sharpness(binary.T)
+    if columns <= rows * sideways_ratio:
+        return 0
+    # Sideways: try turning it clockwise; if its lines then stand upright it was turned 90 counter-clockwise
+    return 90 if _baseline_lean(np.rot90(binary, -1)) > 0 else 270
+
+
+def _encode_within_budget(image, fmt, quality, max_bytes, min_quality=40):
+    """Re-encode, stepping quality down (then size) until the bytes fit the budget."""
+    while True:
+        buf = io.BytesIO()
+        image.save(buf, format=fmt, quality=quality)
+        data = buf.getvalue()
+        if len(data) <= max_bytes:
+            return image, data
+        if quality > min_quality:
+            quality = max(min_quality, quality - 10)
+        elif max(image.size) > 800:
+            image = image.resize((int(image.width * 0.8), int(image.height * 0.8)), Image.LANCZOS)
+        else:
+            return image, data
+
+
+def _prepare_for_ocr_worker(content, max_side, fmt, quality, max_bytes):
+    with Image.open(io.BytesIO(content)) as original:
+        original_size = original.size
+        image = original.convert('L')
+    scale = max_side / max(original_size)
+    if scale < 1:
+        image = image.resize((round(original_size[0] * scale), round(original_size[1] * scale)), Image.LANCZOS)
+    image, data = _encode_within_budget(image, fmt, quality, max_bytes)
+    if len(data) >= len(content) and image.size == original_size:
+        # Already compact (small PNG, tight JPEG); re-encoding gains nothing
+        return content, 1.0, 1.0
+    return data, original_size[0] / image.width, original_size[1] / image.height
+
+
+def _preview_worker(content, max_side, quality):
+    if content[:5] == b'%PDF-':
+        with fitz.open(stream=content, filetype="pdf") as doc:
+            if not len(doc):
+                return None
+            page = doc[0]
+            # Render the first page straight at thumbnail size instead of full resolution
+            zoom = max_side / max(page.rect.width, page.rect.height)
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    else:
+        with Image.open(io.BytesIO(content)) as original:
+            original.draft('RGB', (max_side, max_side))  # JPEG: decode at reduced scale
+            image = original.convert('RGB')
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    buf = io.BytesIO()
+    image.save(buf, format='WEBP', quality=quality, method=6)
+    return buf.getvalue()
+
+
+def _detect_qr(image):
+    detector = cv2.QRCodeDetector()
+    data, bbox, _ = detector.detectAndDecode(image)
+    if bbox is not None and data:
+        return data
+    return None
+
+
+def _decode_qr_worker(image_data):
+    nparr = np.frombuffer(image_data, np.uint8)
+    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    return _detect_qr(image)
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(HASH_SAMPLE)
+
+
+def _perceptual_hash(gray):
+    """pHash: the 8x8 lowest DCT frequencies of a 32x32 thumbnail, one bit each for above/below their median."""
+    thumbnail = cv2.resize(gray, (HASH_SAMPLE, HASH_SAMPLE), interpolation=cv2.INTER_AREA).astype(np.float64)
+    low = (_DCT @ thumbnail @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+    return int.from_bytes(np.packbits(low > np.median(low)).tobytes(), 'big')
+
+
+def _fingerprint_worker(image_data):
+    nparr = np.frombuffer(image_data, np.uint8)
+    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if image is None:
+        return None, None
+    return _perceptual_hash(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)), _detect_qr(image)
+
+
+def count_pdf_pages(pdf_bytes):
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return len(doc)
+
+
+def render_pdf_pages_png(pdf_bytes):
+    """
+    Rasterize every PDF page to PNG bytes, one worker per page.
+
+    The PDF is placed in shared memory once and each worker renders its own page.
+    """
+    page_count = count_pdf_pages(pdf_bytes)
+    pool = _get_pool()
+    if page_count <= 1 or pool is None:
+        return _run(_render_pages_worker, pdf_bytes, None, False)
+
+    with _SharedBytes(pdf_bytes) as shared:
+        futures = [pool.submit(_render_pages_worker, shared.ref, [n], False) for n in range(page_count)]
+        try:
+            return [future.result()[0] for future in futures]
+        except BrokenProcessPool:
+            _reset_pool()
+            raise
+
+
+def render_pdf_merged_png(pdf_bytes):
+    """Rasterize all PDF pages and stack them into a single PNG, without a decode/re-encode per page."""
+    pages = _run(_render_pages_worker, pdf_bytes, None, True)
+    return pages[0] if pages else None
+
+
+def merge_images_vertically(image_list):
+    """Merges encoded page images (PNG/JPEG bytes) into one PNG."""
+    return _run(_merge_encoded_worker, list(image_list))
+
+
+def rotate_image_file(source_path, output_path, angle):
+    return _run(_rotate_worker, source_path, output_path, angle)
+
+
+def estimate_text_angle(image_path, max_side=1024, sideways_ratio=2.0):
+    """
+    How far a page image is turned, counter-clockwise: 0, 90 or 270 degrees (rotate by minus that to fix it).
+
+    Projection profiles on a thumbnail decide whether text runs sideways (the column
+    profile clearly sharper than the row profile); the side the baselines face then
+    tells 90 from 270. Upside-down pages are not detected and come back as 0.
+    """
+    return _run(_text_angle_worker, image_path, max_side, sideways_ratio)
+
+
+def prepare_for_ocr(content, max_side=2048, fmt='JPEG', quality=80, max_bytes=1024 * 1024):
+    """
+    Shrink a page image before it is sent to OCR: grayscale, long side capped, compact JPEG/WebP.
+
+    Returns:
+        tuple: (encoded bytes, scale_x, scale_y), where multiplying OCR coordinates
+        by the scales maps them back onto the original image.
+    """
+    return _run(_prepare_for_ocr_worker, bytes(content), max_side, fmt, quality, max_bytes)
+
+
+def render_preview(content, max_side=320, quality=70):
+    """WebP thumbnail of a PDF's first page or of an image, long side capped at `max_side`; None for an empty PDF."""
+    return _run(_preview_worker, bytes(content), max_side, quality)
+
+
+def decode_qr(image_data):
+    """QR payload string from encoded image bytes, or None."""
+    return _run(_decode_qr_worker, bytes(image_data))
+
+
+def fingerprint_page(image_data):
+    """
+    Local identity of a page image, computed before any external call.
+
+    Returns:
+        tuple: (64-bit perceptual hash as an unsigned int, QR payload or None);
+        (None, None) if the bytes are not a decodable image.
+    """
+    return _run(_fingerprint_worker, bytes(image_data))
@@ -0,0 +1,506 @@
+import csv
+import io
+import os
+from abc import ABC, abstractmethod
+from datetime import date, datetime, time
+
+import openpyxl
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, models, transaction
+from django.utils import timezone
+
+from . import posting
+from .models import Account, Company, Customer, Invoice, Supplier
+
+# Bulk import of accounts, suppliers, customers, invoices and journal lines
+# from CSV or XLSX, for migrating from another system. Rows are streamed (the
+# CSV reader and openpyxl's read-only mode never hold the whole file) and
+# handled in chunks: each chunk's foreign keys are resolved with one query per
+# related table into lookup maps, then the valid rows are written with
+# bulk_create (new) and bulk_update (matched by their natural key) in one
+# transaction. Rows that fail are written with the reason to an error report
+# CSV and the rest of the file carries on.
+#
+# Headers are matched case-insensitively with spaces as underscores and name
+# model fields ("account_number", "gst_category", ...). Foreign keys:
+#   company                    - id or company name
+#   parent_account (accounts)  - account number in the same company
+#   supplier, customer         - id or name (within the invoice's company)
+# Journal lines go through finance.posting: consecutive rows with the same
+# "voucher" form one balanced voucher, and "account" (id) or "account_number"
+# names the account. Empty cells keep the current value of an updated row.
+
+BOOLEAN_WORDS = {'yes': True, 'y': True, 'true': True, '1': True, 'no': False, 'n': False, 'false': False, '0': False}
+
+
+def _header(name):
+    return str(name or '').strip().lower().replace(' ', '_').replace('-', '_')
+
+
+def _cell(value):
+    """XLSX cell value as the text a CSV would hold."""
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.date().isoformat() if value.time() == time() else value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def read_rows(fp, filename):
+    """
+    Stream the rows of a CSV or XLSX file.
+
+    Yields:
+        tuple: (row number as shown in a spreadsheet, {header: text}); the header row is row 1.
+    """
+    if os.path.splitext(filename)[1].lower() in ('.xlsx', '.xlsm'):
+        workbook = openpyxl.load_workbook(fp, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            headers = [_header(name) for name in next(rows, ())]
+            for number, values in enumerate(rows, start=2):
+                cells = [_cell(value) for value in values]
+                if any(cells):
+                    yield number, dict(zip(headers, cells))
+        finally:
+            workbook.close()
+        return
+    text = io.TextIOWrapper(fp, encoding='utf-8-sig', newline='')
+    reader = csv.reader(text)
+    headers = [_header(name) for name in next(reader, [])]
+    # Records, not lines: a quoted cell may hold line breaks but is still one spreadsheet row
+    for number, values in enumerate(reader, start=2):
+        if any(value.strip() for value in values):
+            yield number, dict(zip(headers, (value.strip() for value in values)))
+
+
+class ErrorReport:
+    """Failed rows and why, written to a CSV as they come; the file is only created for the first failure."""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.sample = []
+        self._file = self._writer = None
+        self._columns = []
+
+    def add(self, row_number, row, error):
+        self.count += 1
+        if len(self.sample) < 100:
+            self.sample.append({'row': row_number, 'error': error})
+        if self._writer is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._file = open(self.path, 'w', encoding='utf-8', newline='')
+            self._writer = csv.writer(self._file)
+            self._columns = list(row)
+            self._writer.writerow(['row', 'error'] + self._columns)
+        self._writer.writerow([row_number, error] + [row.get(column, '') for column in self._columns])
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+class Companies:
+    """Company ids by id or (case-insensitive) name, read once per import."""
+
+    def __init__(self):
+        self.ids = {}
+        for pk, name in Company.objects.values_list('pk', 'name'):
+            self.ids[str(pk)] = pk
+            self.ids.setdefault(name.strip().lower(), pk)
+
+    def id_of(self, row, required=False):
+        """Id of the row's "company" column, None if it is empty."""
+        value = row.get('company', '')
+        if not value:
+            if required:
+                raise ValueError("company is required")
+            return None
+        company_id = self.ids.get(value.strip().lower())
+        if company_id is None:
+            raise ValueError(f"company {value!r} does not exist")
+        return company_id
+
+
+class ModelImporter(ABC):
+    """Rows of one model, matched on `key` to update existing records instead of duplicating them."""
+    model = None
+    key = ()
+    columns = ()  # plain fields set from the column of the same name
+    required = ()
+
+    def __init__(self, user=None, chunk_size=2000):
+        self.user = user
+        self.chunk_size = chunk_size
+        self.companies = Companies()
+
+    def company_id(self, row, required=False):
+        return self.companies.id_of(row, required)
+
+    def clean(self, name, raw):
+        field = self.model._meta.get_field(name)
+        if isinstance(field, models.BooleanField):
+            raw = BOOLEAN_WORDS.get(raw.lower(), raw)
+        elif field.choices:
+            by_word = {}
+            for value, label in field.choices:
+                by_word[str(label).lower()] = value
+                by_word[str(value).lower()] = value
+            raw = by_word.get(raw.lower(), raw)
+        try:
+            return field.clean(raw, None)
+        except ValidationError as e:
+            raise ValueError(f"{name}: {' '.join(e.messages)}")
+
+    @abstractmethod
+    def prefetch(self, rows):
+        """Lookup maps for a chunk: at least {"existing": {key: instance}}."""
+
+    @abstractmethod
+    def key_of(self, row):
+        """The row's natural key (the values of `key`)."""
+
+    def resolve(self, instance, row, lookups):
+        """Set foreign keys and derived fields; returns the names of the fields it set."""
+        return set()
+
+    def build(self, row, lookups):
+        for name in self.required:
+            if not row.get(name):
+                raise ValueError(f"{name} is required")
+        key = self.key_of(row)
+        instance = lookups['existing'].get(key)
+        created = instance is None
+        if created:
+            instance = self.model()
+            if hasattr(instance, 'created_by_id'):
+                instance.created_by = self.user
+        assigned = set()
+        for name in self.columns:
+            if row.get(name):
+                setattr(instance, name, self.clean(name, row[name]))
+                assigned.add(name)
+        assigned |= self.resolve(instance, row, lookups)
+        return key, instance, created, assigned
+
+    def write(self, new, changed, fields):
+        self.model.objects.bulk_create(new, batch_size=self.chunk_size)
+        if changed:
+            now = timezone.now()
+            for instance in changed:
+                instance.updated_at = now
+            self.model.objects.bulk_update(changed, sorted(fields | {'updated_at'}), batch_size=self.chunk_size)
+
+    def import_rows(self, rows, report):
+        counts = {'rows': 0, 'created': 0, 'updated': 0, 'failed': 0}
+        chunk = []
+        for number, row in rows:
+            counts['rows'] += 1
+            chunk.append((number, row))
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk, report, counts)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk, report, counts)
+        return counts
+
+    def import_chunk(self, chunk, report, counts):
+        lookups = self.prefetch([row for _, row in chunk])
+        new, changed, fields, written, seen = [], [], set(), [], {}
+        for number, row in chunk:
+            try:
+                key, instance, created, assigned = self.build(row, lookups)
+                if key in seen:
+                    raise ValueError(f"same {', '.join(self.key)} as row {seen[key]}")
+                if created:
+                    # Relations come from the lookup maps; validating them here would cost a query per row
+                    instance.clean_fields(exclude=[field.name for field in self.model._meta.fields if field.is_relation])
+            except ValueError as e:
+                report.add(number, row, str(e))
+                counts['failed'] += 1
+                continue
+            except ValidationError as e:
+                report.add(number, row, '; '.join(f"{name}: {' '.join(messages)}" for name, messages in e.message_dict.items()))
+                counts['failed'] += 1
+                continue
+            seen[key] = number
+            (new if created else changed).append(instance)
+            fields |= assigned
+            written.append((number, row))
+        try:
+            with transaction.atomic():
+                self.write(new, changed, fields)
+        except DatabaseError as e:
+            for number, row in written:
+                report.add(number, row, f"chunk not written: {e}")
+            counts['failed'] += len(written)
+            return
+        counts['created'] += len(new)
+        counts['updated'] += len(changed)
+
+
+class AccountImporter(ModelImporter):
+    model = Account
+    key = ('company', 'account_number')
+    columns = ('name', 'account_number', 'account_type', 'currency', 'tax_rate', 'balance_must_be', 'is_group', 'is_disabled')
+    required = ('name', 'account_number', 'company')
+
+    def key_of(self, row):
+        return self.company_id(row, required=True), row['account_number']
+
+    def prefetch(self, rows):
+        numbers = {row.get('account_number') for row in rows} | {row.get('parent_account') for row in rows}
+        existing = {
+            (account.company_id, account.account_number): account
+            for account in Account.objects.filter(account_number__in=numbers - {'', None})
+        }
+        return {'existing': existing, 'parents': dict(existing)}
+
+    def resolve(self, instance, row, lookups):
+        company_id = self.company_id(row, required=True)
+        assigned = set()
+        if instance.pk is None:
+            instance.company_id = company_id
+            assigned.add('company')
+        instance.import_parent = None
+        if row.get('parent_account'):
+            parent = lookups['parents'].get((company_id, row['parent_account']))
+            if parent is None or parent is instance:
+                raise ValueError(f"parent account {row['parent_account']} does not exist in this company")
+            if parent.pk:
+                instance.parent_account_id = parent.pk
+                assigned.add('parent_account')
+            else:
+                instance.import_parent = parent  # created in this chunk; linked once it has a key
+        # Later rows of the chunk may name this account as their parent
+        lookups['parents'][(company_id, row['account_number'])] = instance
+        return assigned
+
+    def write(self, new, changed, fields):
+        super().write(new, changed, fields)
+        children = [account for account in new + changed if account.import_parent is not None]
+        for account in children:
+            account.parent_account_id = account.import_parent.pk
+        Account.objects.bulk_update(children, ['parent_account'], batch_size=self.chunk_size)
+        if changed and 'account_type' in fields:
+            Account.sync_journal_entries([account.pk for account in changed])
+
+
+class PartyImporter(ModelImporter):
+    key = ('company', 'name')
+    columns = (
+        'name', 'gstin_uin', 'gst_category', 'contact_first_name', 'contact_last_name', 'contact_email',
+        'contact_mobile', 'preferred_billing', 'preferred_shipping', 'postal_code', 'city', 'address_line1',
+        'address_line2', 'state', 'country',
+    )
+    required = ('name',)
+
+    def key_of(self, row):
+        return self.company_id(row), row['name']
+
+    def prefetch(self, rows):
+        names = {row.get('name') for row in rows} - {'', None}
+        return {'existing': {(party.company_id, party.name): party for party in self.model.objects.filter(name__in=names)}}
+
+    def resolve(self, instance, row, lookups):
+        if instance.pk is None:
+            instance.company_id = self.company_id(row)
+            return {'company'}
+        return set()
+
+
+class SupplierImporter(PartyImporter):
+    model = Supplier
+    columns = PartyImporter.columns + ('supplier_type',)
+
+
+class CustomerImporter(PartyImporter):
+    model = Customer
+    columns = PartyImporter.columns + ('customer_type',)
+
+
+class InvoiceImporter(ModelImporter):
+    model = Invoice
+    key = ('invoice_id',)
+    columns = (
+        'invoice_id', 'invoice_number', 'date', 'supplier_vat', 'customer_vat', 'amount_before_vat', 'total_vat',
+        'total_amount', 'qr_code_data', 'status',
+    )
+    required = ('invoice_id',)
+
+    def key_of(self, row):
+        return row['invoice_id']
+
+    def prefetch(self, rows):
+        ids = {row.get('invoice_id') for row in rows} - {'', None}
+        lookups = {'existing': {invoice.invoice_id: invoice for invoice in Invoice.objects.filter(invoice_id__in=ids)}}
+        for name, model in (('supplier', Supplier), ('customer', Customer)):
+            values = {row.get(name) for row in rows} - {'', None}
+            by_id, by_name = {}, {}
+            parties = model.objects.filter(
+                models.Q(name__in=values) | models.Q(pk__in=[value for value in values if value.isdigit()])
+            ).only('id', 'name', 'company_id', 'gstin_uin')
+            for party in parties:
+                by_id[str(party.pk)] = party
+                by_name.setdefault(party.name, []).append(party)
+            lookups[name] = (by_id, by_name)
+        return lookups
+
+    def party(self, name, row, company_id, lookups):
+        value = row.get(name)
+        by_id, by_name = lookups[name]
+        candidates = by_name.get(value, [])
+        if company_id is not None:
+            candidates = [party for party in candidates if party.company_id in (company_id, None)]
+        if len(candidates) > 1:
+            raise ValueError(f"{name} {value!r} exists in several companies; give the invoice a company")
+        party = candidates[0] if candidates else by_id.get(value)
+        if party is None:
+            raise ValueError(f"{name} {value!r} does not exist")
+        return party
+
+    def resolve(self, instance, row, lookups):
+        assigned = set()
+        if row.get('company') or instance.pk is None:
+            instance.company_id = self.company_id(row)
+            assigned.add('company')
+        for name in ('supplier', 'customer'):
+            if row.get(name):
+                party = self.party(name, row, instance.company_id, lookups)
+                setattr(instance, name, party)
+                assigned.add(name)
+                # What Invoice.save() would fill in
+                vat_field = f"{name}_vat"
+                if not getattr(instance, vat_field) and party.gstin_uin:
+                    setattr(instance, vat_field, party.gstin_uin)
+                    assigned.add(vat_field)
+        if not instance.total_amount and instance.amount_before_vat is not None:
+            instance.total_amount = instance.amount_before_vat + (instance.total_vat or 0)
+            assigned.add('total_amount')
+        return assigned
+
+
+class JournalImporter:
+    """Journal lines, grouped into vouchers and posted with finance.posting (each voucher must balance)."""
+
+    def __init__(self, user=None, chunk_size=2000):
+        self.user = user
+        self.chunk_size = chunk_size
+        self.companies = Companies()
+
+    def vouchers(self, rows, report, counts):
+        """Consecutive rows sharing a voucher reference, as (voucher dict, [(row number, row)])."""
+        voucher = lines = None
+        for number, row in rows:
+            counts['rows'] += 1
+            reference = row.get('voucher', '')
+            if not reference:
+                report.add(number, row, "voucher is required (rows of one voucher share it)")
+                counts['failed'] += 1
+                continue
+            if voucher is None or reference != voucher['voucher']:
+                if voucher is not None:
+                    yield voucher, lines
+                voucher, lines = {'voucher': reference, 'date': row.get('date', ''), 'lines': []}, []
+                try:
+                    voucher['company'] = self.companies.id_of(row)
+                except ValueError as e:
+                    voucher['error'] = str(e)
+            line = {'debit': row.get('debit', ''), 'credit': row.get('credit', ''), 'description': row.get('description', '')}
+            if row.get('account'):
+                line['account'] = int(row['account']) if row['account'].isdigit() else row['account']
+            elif row.get('account_number'):
+                line['account_number'] = row['account_number']
+            if row.get('date', '') != voucher['date']:
+                voucher.setdefault('error', "rows of one voucher must share a date")
+            voucher['lines'].append(line)
+            lines.append((number, row))
+        if voucher is not None:
+            yield voucher, lines
+
+    def import_rows(self, rows, report):
+        counts = {'rows': 0, 'created': 0, 'updated': 0, 'failed': 0}
+        batch, line_count = [], 0
+        for voucher, lines in self.vouchers(rows, report, counts):
+            batch.append((voucher, lines))
+            line_count += len(lines)
+            if line_count >= self.chunk_size:
+                self.post(batch, report, counts)
+                batch, line_count = [], 0
+        if batch:
+            self.post(batch, report, counts)
+        return counts
+
+    def fail(self, lines, errors, report, counts):
+        for error in errors:
+            line = error.get('line')
+            number, row = lines[line - 1] if line else lines[0]
+            report.add(number, row, f"voucher {error['voucher']}: {error['error']}")
+        counts['failed'] += len(lines)
+
+    def post(self, batch, report, counts):
+        valid = []
+        for voucher, lines in batch:
+            if 'error' in voucher:
+                self.fail(lines, [{'voucher': voucher['voucher'], 'line': None, 'error': voucher.pop('error')}], report, counts)
+            else:
+                valid.append((voucher, lines))
+        for attempt in range(2):
+            if not valid:
+                return
+            try:
+                result = posting.post_vouchers([voucher for voucher, _ in valid], self.user, self.chunk_size)
+            except posting.PostingError:
+                if attempt:
+                    raise
+                # Find the failing vouchers one by one (only a batch with errors pays for this), then post the rest
+                checked = []
+                for voucher, lines in valid:
+                    try:
+                        posting.build_entries([voucher], self.user)
+                    except posting.PostingError as e:
+                        self.fail(lines, e.errors, report, counts)
+                    else:
+                        checked.append((voucher, lines))
+                valid = checked
+            except DatabaseError as e:
+                for voucher, lines in valid:
+                    self.fail(lines, [{'voucher': voucher['voucher'], 'line': None, 'error': f"not posted: {e}"}], report, counts)
+                return
+            else:
+                counts['created'] += result['lines']
+                return
+
+
+IMPORTERS = {
+    'accounts': AccountImporter,
+    'suppliers': SupplierImporter,
+    'customers': CustomerImporter,
+    'invoices': InvoiceImporter,
+    'journal': JournalImporter,
+}
+
+
+def import_file(kind, fp, filename, report_path, user=None, chunk_size=2000):
+    """
+    Import a CSV/XLSX file of one kind (see IMPORTERS).
+
+    Returns:
+        dict: {"rows", "created", "updated", "failed", "errors" (first 100 failures),
+               "report" (path of the error report CSV, or None)}
+    """
+    if kind not in IMPORTERS:
+        raise ValueError(f"Unknown import {kind!r}; expected one of {', '.join(IMPORTERS)}")
+    importer = IMPORTERS[kind](user=user, chunk_size=max(1, chunk_size))
+    report = ErrorReport(report_path)
+    try:
+        counts = importer.import_rows(read_rows(fp, filename), report)
+    finally:
+        report.close()
+    print(f"Imported {kind} from {filename}: {counts}")
+    return {**counts, 'errors': report.sample, 'report': report.path if report.count else None}
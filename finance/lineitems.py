@@ -0,0 +1,160 @@
+import re
+import unicodedata
+
+import pdfplumber
+
+# Deterministic line-item extraction for digital (text-layer) PDFs. Instead of
+# trusting pdfplumber's cell grid, which often lumps a whole item block into
+# one cell, we find the table's header line from word positions, take one
+# column anchor per header word, and assign every word below it to the nearest
+# anchor until a totals line ends the table. Works for ruled and unruled
+# tables and for right-to-left layouts, since nothing depends on column order.
+
+COLUMN_ROLES = (
+    ('name', re.compile(r"^(item|items|description|product|service|services|particulars|details)$", re.IGNORECASE),
+     re.compile(r"^(الصنف|البيان|الوصف|المنتج|الخدمة|الأصناف)$")),
+    ('quantity', re.compile(r"^(qty\.?|quantity|qnty)$", re.IGNORECASE),
+     re.compile(r"^(الكمية|العدد)$")),
+    ('unit_price', re.compile(r"^(price|rate|unit)$", re.IGNORECASE),
+     re.compile(r"^(السعر|سعر)$")),
+    ('total', re.compile(r"^(total|amount|debit|net)$", re.IGNORECASE),
+     re.compile(r"^(الإجمالي|الاجمالي|المبلغ|مدين|المجموع)$")),
+)
+TOTALS_LINE = re.compile(
+    r"^(sub\s*-?\s*total|total|grand\s+total|balance|net\s+amount|amount\s+due|المجموع|الإجمالي|الاجمالي)",
+    re.IGNORECASE,
+)
+NUMBER = re.compile(r"^-?\d{1,3}(?:,\d{3})*(?:\.\d+)?$|^-?\d+(?:\.\d+)?$")
+ARABIC_LETTER = re.compile(r"[\u0600-\u06ff]")
+ARABIC_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩٫٬", "0123456789.,")
+LINE_TOLERANCE = 3  # points; words whose tops are this close share a line
+
+
+def _fold(text):
+    return unicodedata.normalize("NFKC", text)
+
+
+def _logical(words):
+    """Restore reading order for Arabic runs that pdfplumber returns as visual-order glyphs."""
+    out, run = [], []
+    for word in (_fold(w) for w in words):
+        if ARABIC_LETTER.search(word):
+            run.append(word[::-1])
+        else:
+            out.extend(reversed(run))
+            run = []
+            out.append(word)
+    out.extend(reversed(run))
+    return " ".join(out)
+
+
+def _role(word):
+    folded = _fold(word)
+    for role, english, arabic in COLUMN_ROLES:
+        if english.match(folded) or arabic.match(folded) or arabic.match(folded[::-1]):
+            return role
+    return None
+
+
+def _number(word):
+    cleaned = _fold(word).translate(ARABIC_DIGITS).strip("%").replace("SAR", "").replace("SR", "")
+    if not NUMBER.match(cleaned):
+        return None
+    return float(cleaned.replace(",", ""))
+
+
+def _lines(words):
+    lines = []
+    for word in sorted(words, key=lambda w: (round(w['top']), w['x0'])):
+        if lines and abs(word['top'] - lines[-1][0]['top']) <= LINE_TOLERANCE:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    return [sorted(line, key=lambda w: w['x0']) for line in lines]
+
+
+def _header_anchors(line):
+    """Column anchors (x-centre, role) if this line looks like a line-item table header."""
+    anchors = []
+    for word in line:
+        role = _role(word['text'])
+        # "Unit Price": one column, not two
+        if role == 'unit_price' and anchors and anchors[-1][1] == 'unit_price' and word['x0'] - anchors[-1][2] < 15:
+            continue
+        anchors.append(((word['x0'] + word['x1']) / 2, role or 'other', word['x1']))
+    roles = {role for _, role, _ in anchors}
+    if 'name' in roles and roles & {'quantity', 'unit_price', 'total'}:
+        return [(x, role) for x, role, _ in anchors]
+    return None
+
+
+def _nearest(anchors, word):
+    centre = (word['x0'] + word['x1']) / 2
+    return min(anchors, key=lambda anchor: abs(anchor[0] - centre))[1]
+
+
+def _parse_row(anchors, line):
+    name_words, values = [], {}
+    for word in line:
+        role = _nearest(anchors, word)
+        number = _number(word['text'])
+        if number is not None and role in ('quantity', 'unit_price', 'total'):
+            values.setdefault(role, number)
+        elif role != 'other':
+            name_words.append(word['text'])
+    return _logical(name_words), values
+
+
+def _finish(name, values):
+    quantity, unit_price, total = values.get('quantity'), values.get('unit_price'), values.get('total')
+    if total is None and quantity is not None and unit_price is not None:
+        total = quantity * unit_price
+    if total is None:
+        return None
+    if quantity is None:
+        quantity = 1 if unit_price is None else round(total / unit_price, 3) if unit_price else 1
+    if unit_price is None:
+        unit_price = total / quantity if quantity else total
+    return {
+        "Item Name": name,
+        "Item Description": None,
+        "Quantity": int(quantity) if float(quantity).is_integer() else quantity,
+        "Unit Price": round(unit_price, 2),
+        "Total Price": round(total, 2),
+    }
+
+
+def extract_page_items(page):
+    items = []
+    anchors = None
+    for line in _lines(page.extract_words()):
+        if anchors is None:
+            anchors = _header_anchors(line)
+            continue
+        name, values = _parse_row(anchors, line)
+        if TOTALS_LINE.match(name) or (not name and 'total' in values and len(values) == 1 and items):
+            break
+        item = _finish(name, values) if name else None
+        if item:
+            items.append(item)
+        elif items and name:
+            # Description wrapped onto its own line (any stray number belongs to the text)
+            previous = items[-1]
+            wrapped = _logical([word['text'] for word in line])
+            previous["Item Description"] = f"{previous['Item Description'] or ''} {wrapped}".strip()
+    return items
+
+
+def extract_line_items(pdf_path):
+    """
+    Line items from a digital PDF's text layer.
+
+    Returns:
+        list[dict] with the same keys the LLM prompt asks for, or None when no
+        line-item table was recognised (the caller then asks the LLM instead).
+    """
+    items = []
+    with pdfplumber.open(pdf_path) as pdf:
+        for page in pdf.pages:
+            items.extend(extract_page_items(page))
+    return items or None
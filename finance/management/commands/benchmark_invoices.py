@@ -0,0 +1,219 @@
+import json
+import os
+import resource
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.test.utils import override_settings
+
+from finance import ratelimit, replay
+from finance.models import Invoice
+from finance.views import upload_invoice_for_project
+
+CORPUS_EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg')
+
+
+class Command(BaseCommand):
+    help = "Replay the invoice pipeline over a corpus and report throughput, per-stage latency and peak memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', default=os.path.join(settings.BASE_DIR, 'invoices'),
+                            help="Directory of invoice files (PDF/PNG/JPG)")
+        parser.add_argument('--fixtures', default=settings.INVOICE_REPLAY_DIR,
+                            help="Directory holding recorded Vision/OpenAI/GCS responses")
+        parser.add_argument('--mode', choices=replay.REPLAY_MODES, default='replay',
+                            help="'record' runs live once and saves fixtures; 'replay' needs no network")
+        parser.add_argument('--concurrency', default='1,2,4',
+                            help="Comma separated worker counts to benchmark")
+        parser.add_argument('--repeat', type=int, default=1,
+                            help="How many times each corpus file is submitted per level; "
+                                 "copies after the first are caught as duplicates and reported separately")
+        parser.add_argument('--split', dest='split', action='store_const', const=True, default=None,
+                            help="Force one invoice per page instead of grouping pages automatically")
+        parser.add_argument('--merge', dest='split', action='store_const', const=False,
+                            help="Force one invoice per file instead of grouping pages automatically")
+        parser.add_argument('--keepdb', action='store_true',
+                            help="Keep the benchmark database between runs instead of creating it each time")
+        parser.add_argument('--json', dest='json_path',
+                            help="Also write the report as JSON to this path")
+
+    def handle(self, *args, **options):
+        corpus = options['corpus']
+        if not os.path.isdir(corpus):
+            raise CommandError(f"Corpus directory not found: {corpus}")
+        files = sorted(
+            os.path.join(corpus, name) for name in os.listdir(corpus)
+            if name.lower().endswith(CORPUS_EXTENSIONS) and os.path.isfile(os.path.join(corpus, name))
+        )
+        if not files:
+            raise CommandError(f"No invoice files in {corpus}")
+
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',') if level.strip()]
+        except ValueError:
+            raise CommandError("--concurrency must be a comma separated list of integers")
+        if options['mode'] == 'record':
+            # Record each request once; parallel runs would only race on the same fixtures
+            levels = [1]
+
+        replay.configure(mode=options['mode'], fixtures_dir=options['fixtures'])
+        self.stdout.write(f"Corpus: {len(files)} file(s) from {corpus} | mode={options['mode']} | fixtures={options['fixtures']}")
+
+        # The pipeline writes its working files under MEDIA_ROOT; keep them out of the corpus
+        workdir = tempfile.mkdtemp(prefix='invoice-bench-')
+        old_name = self.setup_database(options['keepdb'])
+        report = []
+        try:
+            with override_settings(MEDIA_ROOT=workdir):
+                for level in levels:
+                    report.append(self.run_level(files, level, options))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        if options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as fp:
+                json.dump(report, fp, indent=2)
+            self.stdout.write(f"Report written to {options['json_path']}")
+
+    def setup_database(self, keepdb):
+        """Point the run at a throwaway copy of the schema (the test database), never the real data."""
+        if connection.vendor == 'sqlite' and not connection.settings_dict['TEST']['NAME']:
+            # The in-memory test database takes one writer at a time; concurrent jobs need a file
+            root, _ = os.path.splitext(str(connection.settings_dict['NAME']))
+            connection.settings_dict['TEST']['NAME'] = f"{root}_bench.sqlite3"
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=keepdb)
+        self.stdout.write(f"Benchmark database: {connection.settings_dict['NAME']}")
+        return old_name
+
+    def run_level(self, files, concurrency, options):
+        jobs = [(n, path) for n, path in enumerate(files * max(options['repeat'], 1))]
+        # Jobs upload with idempotency keys starting with run_key, so their invoices are "SCAN-<run_key>..."
+        # (views._scan_invoice_id) and cleaning up never touches invoices other users save meanwhile
+        run_key = uuid.uuid4().hex[:16]
+        replay.reset_stage_timings()
+        tracemalloc.start()
+
+        def run_one(job):
+            n, path = job
+            # Unique working names keep concurrent jobs from clobbering each other's files
+            with open(path, 'rb') as fp:
+                invoice_file = File(fp, name=f"bench{concurrency}-{n}-{os.path.basename(path)}")
+                job_start = time.perf_counter()
+                try:
+                    result = upload_invoice_for_project(invoice_file, options['split'], f"{run_key}{n:016x}")
+                    return time.perf_counter() - job_start, result, None
+                except Exception as e:
+                    return time.perf_counter() - job_start, None, f"{os.path.basename(path)}: {e}"
+                finally:
+                    close_old_connections()
+
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(run_one, jobs))
+        wall = time.perf_counter() - wall_start
+
+        _, peak_traced = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # Each level starts from the same state, so its first copy of a file is never a duplicate
+        Invoice.objects.filter(invoice_id__startswith=f"SCAN-{run_key}").delete()
+
+        # Files skipped as duplicates never reach OCR/LLM; their timings are kept apart
+        skipped = [
+            (elapsed, result) for elapsed, result, _ in outcomes
+            if result and result.get('duplicates') and not result.get('created')
+        ]
+        processed = [
+            (elapsed, result) for elapsed, result, _ in outcomes
+            if result and (result.get('created') or not result.get('duplicates'))
+        ]
+        latencies = [elapsed for elapsed, _ in processed]
+        errors = [error for _, _, error in outcomes if error]
+        pages = sum(result.get('pages', 0) for _, result in processed)
+        stages = {
+            name: {
+                'count': len(values),
+                'total_s': round(sum(values), 4),
+                'mean_ms': round(statistics.mean(values) * 1000, 2),
+                'p95_ms': round(_percentile(values, 95) * 1000, 2),
+            }
+            for name, values in sorted(replay.stage_timings().items())
+        }
+        level_report = {
+            'concurrency': concurrency,
+            'files': len(jobs),
+            'processed': len(processed),
+            'skipped_duplicates': len(skipped),
+            'skipped_latency_p50_ms': round(_percentile([elapsed for elapsed, _ in skipped], 50) * 1000, 2),
+            'pages': pages,
+            'errors': errors,
+            'wall_s': round(wall, 4),
+            'files_per_s': round(len(processed) / wall, 3) if wall else None,
+            'latency_p50_ms': round(_percentile(latencies, 50) * 1000, 2),
+            'latency_p95_ms': round(_percentile(latencies, 95) * 1000, 2),
+            'peak_traced_mb': round(peak_traced / (1024 * 1024), 2),
+            'max_rss_mb': round(max_rss_kb / 1024, 2),
+            'stages': stages,
+            'rate_limits': ratelimit.metrics(),
+            'observations': {
+                name: {'count': len(values), 'total': sum(values), 'mean': round(statistics.mean(values), 1)}
+                for name, values in sorted(replay.observations().items())
+            },
+        }
+        self.print_level(level_report)
+        return level_report
+
+    def print_level(self, level):
+        self.stdout.write("")
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Concurrency {level['concurrency']}"))
+        self.stdout.write(
+            f"  {level['processed']} of {level['files']} file(s), {level['pages']} page(s) in {level['wall_s']}s "
+            f"-> {level['files_per_s']} files/s | latency p50 {level['latency_p50_ms']}ms p95 {level['latency_p95_ms']}ms"
+        )
+        if level['skipped_duplicates']:
+            self.stdout.write(
+                f"  {level['skipped_duplicates']} file(s) skipped as duplicates (not in files/s), "
+                f"p50 {level['skipped_latency_p50_ms']}ms"
+            )
+        self.stdout.write(f"  peak traced memory {level['peak_traced_mb']} MB | max RSS {level['max_rss_mb']} MB")
+        self.stdout.write(f"  {'stage':<12}{'count':>7}{'total s':>10}{'mean ms':>10}{'p95 ms':>10}")
+        for name, stats in level['stages'].items():
+            self.stdout.write(
+                f"  {name:<12}{stats['count']:>7}{stats['total_s']:>10}{stats['mean_ms']:>10}{stats['p95_ms']:>10}"
+            )
+        observed = level['observations']
+        before = observed.get('llm_text_tokens_before', {}).get('total', 0)
+        after = observed.get('llm_text_tokens_after', {}).get('total', 0)
+        if before:
+            self.stdout.write(
+                f"  LLM invoice text: {before} -> {after} tokens ({100 - after * 100 // before}% less)"
+                + (f" | prompt tokens billed {observed['llm_prompt_tokens']['total']}"
+                   if 'llm_prompt_tokens' in observed else "")
+            )
+        for service, stats in level['rate_limits'].items():
+            self.stdout.write(
+                f"  {service}: {stats['calls']} call(s), {stats['retries']} retr(ies), {stats['rate_limited']} 429(s), "
+                f"throttled {stats['throttle_seconds']}s, concurrency limit {stats['concurrency_limit']}"
+            )
+        for error in level['errors']:
+            self.stdout.write(self.style.ERROR(f"  error: {error}"))
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
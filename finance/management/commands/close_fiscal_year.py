@@ -0,0 +1,34 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from finance.models import FiscalYear
+from finance.periods import close_fiscal_year
+
+
+class Command(BaseCommand):
+    help = (
+        "Close a fiscal year: freeze its journal lines and write every account's balance as the "
+        "next year's opening balance. Years are closed in order."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('year', help="Fiscal year name, e.g. 2025-2026")
+        parser.add_argument('--user', help="Username recorded as closing the year")
+
+    def handle(self, *args, **options):
+        try:
+            year = FiscalYear.objects.get(name=options['year'])
+        except FiscalYear.DoesNotExist:
+            raise CommandError(f"No fiscal year named {options['year']}")
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"No user named {options['user']}")
+        try:
+            following = close_fiscal_year(year, user=user)
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"{year} closed; {following.opening_balances.count()} opening balance(s) in {following}"
+        ))
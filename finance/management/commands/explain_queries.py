@@ -0,0 +1,110 @@
+import re
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+# Views whose queries grow with the ledger and invoice tables
+DEFAULT_VIEWS = (
+    'finance-dashboard', 'finance-journal', 'finance-ledger', 'finance-trial', 'finance-reports',
+    'finance-invoices', 'finance-scan', 'finance-invoice-spend', 'finance-payables', 'finance-receivables',
+)
+SQLITE_TABLE_SCAN = re.compile(r"^SCAN (\w+)(?: AS \w+)?$")
+
+
+class Command(BaseCommand):
+    help = (
+        "Render report and list views, EXPLAIN every query they run, and flag full table scans and "
+        "sorts without an index. Run it against a database with realistic data volumes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Username to render the views as (default: the first superuser)")
+        parser.add_argument('--url', dest='urls', action='append',
+                            help="Path to check instead of the default views (repeatable)")
+        parser.add_argument('--plans', action='store_true', help="Print the plan of every query, not only flagged ones")
+        parser.add_argument('--fail-on-scan', action='store_true', help="Exit with an error if anything is flagged")
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+        client = Client(HTTP_HOST=host)
+        client.force_login(user)
+
+        flagged_total = 0
+        for path in options['urls'] or [reverse(name) for name in DEFAULT_VIEWS]:
+            with CaptureQueriesContext(connection) as captured:
+                response = client.get(path)
+            statements = list(dict.fromkeys(
+                query['sql'] for query in captured.captured_queries if query['sql'].lstrip().upper().startswith('SELECT')
+            ))
+            findings = []
+            for sql in statements:
+                plan = self.explain(sql)
+                problems = self.problems(plan)
+                if problems or options['plans']:
+                    findings.append((sql, plan, problems))
+            flagged = sum(1 for _, _, problems in findings if problems)
+            flagged_total += flagged
+
+            style = self.style.WARNING if flagged else self.style.SUCCESS
+            self.stdout.write(style(
+                f"{path} [{response.status_code}]: {len(captured.captured_queries)} queries, "
+                f"{len(statements)} distinct SELECTs, {flagged} flagged"
+            ))
+            for sql, plan, problems in findings:
+                for problem in problems:
+                    self.stdout.write(self.style.ERROR(f"  ! {problem}"))
+                self.stdout.write(f"    {sql[:300]}")
+                if options['plans']:
+                    for line in plan:
+                        self.stdout.write(f"      {line}")
+
+        if flagged_total and options['fail_on_scan']:
+            raise CommandError(f"{flagged_total} quer(ies) need a full scan or an unindexed sort")
+
+    def get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f"No user named {username}")
+        user = User.objects.filter(is_superuser=True).first() or User.objects.filter(is_active=True).first()
+        if user is None:
+            raise CommandError("No user to render the views as; create one or pass --user")
+        return user
+
+    def explain(self, sql):
+        """Plan lines for one statement, in the database's own wording."""
+        with connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}")
+            rows = cursor.fetchall()
+            columns = [column[0] for column in cursor.description]
+        if connection.vendor == 'sqlite':
+            return [row[columns.index('detail')] for row in rows]
+        if connection.vendor == 'mysql':
+            return [", ".join(f"{name}={value}" for name, value in zip(columns, row) if value is not None) for row in rows]
+        return [row[0] for row in rows]
+
+    def problems(self, plan):
+        found = []
+        for line in plan:
+            if connection.vendor == 'sqlite':
+                match = SQLITE_TABLE_SCAN.match(line.strip())
+                if match:
+                    found.append(f"full scan of {match.group(1)}")
+                elif 'USE TEMP B-TREE FOR ORDER BY' in line:
+                    found.append("sort without an index (ORDER BY)")
+            elif connection.vendor == 'postgresql':
+                match = re.search(r"Seq Scan on (\w+)", line)
+                if match:
+                    found.append(f"full scan of {match.group(1)}")
+            elif connection.vendor == 'mysql':
+                if 'type=ALL' in line:
+                    match = re.search(r"table=(\w+)", line)
+                    found.append(f"full scan of {match.group(1) if match else 'a table'}")
+        return list(dict.fromkeys(found))
@@ -0,0 +1,49 @@
+import os
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from finance.imports import IMPORTERS, import_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream a CSV or XLSX file of accounts, suppliers, customers, invoices or journal lines into the database "
+        "in chunks. Failed rows are listed with the reason in an error report CSV; the rest is imported."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS))
+        parser.add_argument('path', help="CSV or XLSX file")
+        parser.add_argument('--chunk-size', type=int, default=settings.IMPORT_CHUNK_SIZE,
+                            help="Rows written per transaction")
+        parser.add_argument('--errors', help="Error report path (default: <file>.errors.csv)")
+        parser.add_argument('--user', help="Username recorded as creator of the imported rows")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isfile(path):
+            raise CommandError(f"No such file: {path}")
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"No user named {options['user']}")
+        report_path = options['errors'] or f"{os.path.splitext(path)[0]}.errors.csv"
+        if os.path.exists(report_path):
+            os.remove(report_path)  # a stale report would look like this run's
+
+        with open(path, 'rb') as fp:
+            try:
+                result = import_file(options['kind'], fp, path, report_path, user=user, chunk_size=options['chunk_size'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        self.stdout.write(
+            f"{result['rows']} row(s): {result['created']} created, {result['updated']} updated, {result['failed']} failed"
+        )
+        if result['report']:
+            self.stdout.write(self.style.WARNING(f"Failed rows and reasons: {result['report']}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("No errors"))
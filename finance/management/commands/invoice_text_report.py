@@ -0,0 +1,53 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from finance import textreduce
+from finance.views import INVOICE_EXTRACTION_PROMPT, extract_text_from_pdf
+
+
+class Command(BaseCommand):
+    help = "Report how much the pre-LLM text reducer shrinks the prompt for each text-layer PDF in a corpus (no API calls)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', default=os.path.join(settings.BASE_DIR, 'invoices'),
+                            help="Directory of invoice PDFs")
+        parser.add_argument('--min-chars', type=int, default=settings.INVOICE_LLM_REDUCE_MIN_CHARS,
+                            help="Reducer threshold to evaluate")
+        parser.add_argument('--show', action='store_true', help="Print the reduced text of each file")
+
+    def handle(self, *args, **options):
+        corpus = options['corpus']
+        if not os.path.isdir(corpus):
+            raise CommandError(f"Corpus directory not found: {corpus}")
+        files = sorted(name for name in os.listdir(corpus) if name.lower().endswith('.pdf'))
+
+        prompt_tokens = textreduce.count_tokens(INVOICE_EXTRACTION_PROMPT)
+        counter = "tiktoken" if textreduce.tiktoken else "chars/4 estimate"
+        self.stdout.write(f"System prompt: {prompt_tokens} tokens (billed with every request) | counting with {counter}")
+        self.stdout.write(f"  {'file':<40}{'before':>9}{'after':>9}{'saved':>8}")
+
+        total_before = total_after = 0
+        for name in files:
+            try:
+                text = extract_text_from_pdf(os.path.join(corpus, name))
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"  {name}: {e}"))
+                continue
+            if not text.strip():
+                continue  # scanned; its text only exists after OCR
+            reduced = textreduce.reduce_invoice_text(text, min_chars=options['min_chars'])
+            before, after = textreduce.count_tokens(text), textreduce.count_tokens(reduced)
+            total_before += before
+            total_after += after
+            saved = f"{100 - after * 100 // before}%" if before else "-"
+            self.stdout.write(f"  {name[:39]:<40}{before:>9}{after:>9}{saved:>8}")
+            if options['show']:
+                self.stdout.write(reduced)
+
+        if total_before:
+            self.stdout.write(
+                f"Invoice text {total_before} -> {total_after} tokens; per-request prompt "
+                f"{total_before + prompt_tokens} -> {total_after + prompt_tokens} including the system prompt"
+            )
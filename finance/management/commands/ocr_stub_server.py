@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from finance.ocr_stub import StubVisionServer
+
+
+class Command(BaseCommand):
+    help = "Serve a local stub of the Vision images:annotate API for exercising the OCR batching offline."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--fixtures', help="Replay fixtures directory; recorded Vision responses are served when they match")
+        parser.add_argument('--latency-ms', type=int, default=0, help="Simulated round-trip time per request")
+
+    def handle(self, *args, **options):
+        server = StubVisionServer(
+            (options['host'], options['port']),
+            fixtures_dir=options['fixtures'],
+            latency=options['latency_ms'] / 1000,
+        )
+        self.stdout.write(f"Vision stub listening; run the app with INVOICE_OCR_ENDPOINT={server.endpoint}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stats = server.stats()
+            server.server_close()
+            self.stdout.write(f"Served {stats['requests']} request(s) covering {stats['images']} image(s)")
@@ -0,0 +1,72 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from finance.models import InvoiceDeadLetter, InvoiceUpload
+from finance.views import due_uploads, process_staged_upload, requeue_dead_letters
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued and due-for-retry invoice uploads (e.g. after a restart lost the in-process retry timers), "
+        "list the dead-letter queue, or requeue it in bulk."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Process what is due now and exit")
+        parser.add_argument('--interval', type=float, default=15.0, help="Seconds between polls when looping")
+        parser.add_argument('--workers', type=int, default=settings.INVOICE_INGEST_WORKERS,
+                            help="Uploads processed in parallel")
+        parser.add_argument('--stale-minutes', type=int, default=60,
+                            help="Uploads stuck in 'processing' this long (a crashed worker) are retried")
+        parser.add_argument('--list-dead', action='store_true', help="Print the dead-letter queue and exit")
+        parser.add_argument('--requeue-dead', action='store_true',
+                            help="Move dead-lettered uploads back to the queue before processing")
+        parser.add_argument('--error-contains', default='',
+                            help="With --requeue-dead, only requeue uploads whose error contains this text")
+
+    def handle(self, *args, **options):
+        if options['list_dead']:
+            for letter in InvoiceDeadLetter.objects.select_related('upload'):
+                kind = "retries exhausted" if letter.transient else "permanent"
+                self.stdout.write(
+                    f"{letter.upload.upload_id}  {letter.upload.filename}  "
+                    f"[{kind}, {letter.attempts} attempt(s), {letter.created_at:%Y-%m-%d %H:%M}]  {letter.error[:120]}"
+                )
+            return
+
+        if options['requeue_dead']:
+            dead_letters = InvoiceDeadLetter.objects.all()
+            if options['error_contains']:
+                dead_letters = dead_letters.filter(error__icontains=options['error_contains'])
+            requeued = requeue_dead_letters(dead_letters, schedule=False)
+            self.stdout.write(f"Requeued {len(requeued)} dead-lettered upload(s)")
+
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            while True:
+                self.recover_stale(options['stale_minutes'])
+                due = list(due_uploads().order_by('created_at').values_list('pk', flat=True))
+                if due:
+                    self.stdout.write(f"Processing {len(due)} upload(s)")
+                    list(executor.map(process_staged_upload, due))
+                    self.report(due)
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+
+    def recover_stale(self, minutes):
+        stale = InvoiceUpload.objects.filter(
+            status='processing', updated_at__lt=timezone.now() - timedelta(minutes=minutes)
+        ).update(status='retrying', next_attempt_at=timezone.now(), updated_at=timezone.now())
+        if stale:
+            self.stdout.write(self.style.WARNING(f"Recovered {stale} upload(s) stuck in processing"))
+
+    def report(self, upload_pks):
+        for upload in InvoiceUpload.objects.filter(pk__in=upload_pks).order_by('created_at'):
+            style = {'done': self.style.SUCCESS, 'dead': self.style.ERROR}.get(upload.status, self.style.WARNING)
+            detail = upload.result if upload.status == 'done' else upload.error[:120]
+            self.stdout.write(style(f"  {upload.filename}: {upload.status} ({upload.attempts} attempt(s)) {detail}"))
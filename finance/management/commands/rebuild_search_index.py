@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from finance import search
+
+
+class Command(BaseCommand):
+    help = (
+        "Recreate the full-text search tables and triggers for journal entries and invoices "
+        "and index every row again (they are normally kept current by the triggers)."
+    )
+
+    def handle(self, *args, **options):
+        if not search.supported(connection):
+            raise CommandError(f"No full-text index on {connection.vendor}; search uses icontains filters there")
+        search.install(connection)
+        with connection.cursor() as cursor:
+            for index in search.INDEXES.values():
+                cursor.execute(f"SELECT COUNT(*) FROM {index.table}")
+                self.stdout.write(f"{index.table}: {cursor.fetchone()[0]} row(s) indexed")
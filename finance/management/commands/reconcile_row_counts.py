@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from finance import counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the tables behind the list pages and overwrite the maintained row counters "
+        "(normally kept current by triggers), reporting every counter that had drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reinstall', action='store_true', help="Recreate the counting triggers first")
+
+    def handle(self, *args, **options):
+        if not counters.supported(connection):
+            raise CommandError(f"No row counters on {connection.vendor}; list pages use COUNT(*) there")
+        drift = counters.install(connection) if options['reinstall'] else counters.reconcile(connection)
+        for table, company_id, stored, actual in drift:
+            self.stdout.write(self.style.WARNING(f"{table} (company {company_id}): counter {stored}, actual {actual}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(counters.COUNTED)} table(s) recounted, {len(drift)} counter(s) corrected"
+        ))
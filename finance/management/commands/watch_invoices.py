@@ -0,0 +1,184 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from finance import watchfolder
+from finance.models import InvoiceUpload
+from finance.views import UPLOAD_EXTENSIONS, due_uploads, process_staged_upload, stage_upload_file
+
+SUBFOLDERS = ('processing', 'done', 'failed')
+
+
+class Command(BaseCommand):
+    help = (
+        "Watch drop folders for invoice files (inotify, or polling as a fallback) and feed them into ingestion. "
+        "Files move to processing/ while their upload runs, then to done/ or failed/."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', dest='dirs', action='append',
+                            help="Directory to watch (repeatable); defaults to INVOICE_WATCH_DIRS")
+        parser.add_argument('--workers', type=int, default=settings.INVOICE_INGEST_WORKERS,
+                            help="Files ingested in parallel")
+        parser.add_argument('--split', dest='split', action='store_const', const=True, default=None,
+                            help="Force one invoice per page instead of grouping pages automatically")
+        parser.add_argument('--merge', dest='split', action='store_const', const=False,
+                            help="Force one invoice per file instead of grouping pages automatically")
+        parser.add_argument('--poll', action='store_true', help="Poll instead of using inotify")
+        parser.add_argument('--settle', type=float, default=2.0,
+                            help="Seconds a file must stay unchanged before polling picks it up")
+        parser.add_argument('--once', action='store_true',
+                            help="Ingest the files already in the folders, wait for them to finish, and exit")
+
+    def handle(self, *args, **options):
+        directories = [os.path.abspath(path) for path in (options['dirs'] or settings.INVOICE_WATCH_DIRS)]
+        if not directories:
+            raise CommandError("No directories to watch; pass --dir or set INVOICE_WATCH_DIRS")
+        for directory in directories:
+            if not os.path.isdir(directory):
+                raise CommandError(f"Not a directory: {directory}")
+            for name in SUBFOLDERS:
+                os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+        self.split = options['split']
+        self.extensions = tuple(f".{extension}" for extension in UPLOAD_EXTENSIONS)
+        self.pending = {}  # upload pk -> file path under processing/
+        self.running = set()
+        self.lock = threading.Lock()
+        workers = max(1, options['workers'])
+        # Bounds the files read into memory/staging ahead of the pipeline
+        self.slots = threading.BoundedSemaphore(workers * 2)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='invoice-watch')
+
+        watcher = None
+        try:
+            self.recover(directories)
+            backlog = [
+                path for directory in directories
+                for path in watchfolder.list_files(directory, self.extensions, settle_seconds=options['settle'])
+            ]
+            if backlog:
+                self.stdout.write(f"{len(backlog)} file(s) already waiting")
+            if not options['once']:
+                watcher = watchfolder.make_watcher(
+                    directories, self.extensions, use_inotify=not options['poll'], settle_seconds=options['settle'],
+                )
+                self.stdout.write(f"Watching {', '.join(directories)} with {type(watcher).__name__}")
+            for path in backlog:
+                self.submit(path)
+
+            while True:
+                # Checked before settling, so the last file to finish is still moved out of processing/
+                with self.lock:
+                    idle = not self.running
+                self.settle()
+                if options['once']:
+                    if idle:
+                        with self.lock:
+                            waiting = len(self.pending)
+                        if waiting:
+                            self.stdout.write(f"{waiting} upload(s) waiting to retry stay in processing/ for the next run")
+                        return
+                    time.sleep(1.0)
+                    continue
+                for path in watcher.poll(1.0):
+                    self.submit(path)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping; uploads in flight finish first")
+        finally:
+            if watcher:
+                watcher.close()
+            self.executor.shutdown(wait=True)
+
+    def submit(self, path):
+        self.slots.acquire()
+        with self.lock:
+            self.running.add(path)
+        future = self.executor.submit(self.ingest, path)
+        future.add_done_callback(lambda _: self.finished(path))
+
+    def finished(self, path):
+        with self.lock:
+            self.running.discard(path)
+        self.slots.release()
+
+    def ingest(self, path):
+        """Move a dropped file into processing/, stage it as an upload and run its first attempt."""
+        close_old_connections()
+        try:
+            if not os.path.exists(path):
+                return  # seen twice, or removed by the sender
+            processing = _move(path, os.path.join(os.path.dirname(path), 'processing'))
+            with open(processing, 'rb') as fp:
+                upload = stage_upload_file(File(fp, name=os.path.basename(path)), self.split)
+            self.stdout.write(f"Queued {os.path.basename(path)} as upload {upload.upload_id}")
+            if upload.status == 'queued':
+                process_staged_upload(upload.pk)
+            with self.lock:
+                self.pending[upload.pk] = processing
+        except Exception as e:
+            self.stderr.write(f"Could not ingest {path}: {e}")
+        finally:
+            close_old_connections()
+
+    def run_upload(self, upload_pk):
+        try:
+            process_staged_upload(upload_pk)
+        finally:
+            self.slots.release()
+
+    def settle(self):
+        """Move files whose upload finished; rerun retries that came due (their in-process timers die with us)."""
+        with self.lock:
+            pending = dict(self.pending)
+        if not pending:
+            return
+        for upload in InvoiceUpload.objects.filter(pk__in=pending, status__in=['done', 'dead', 'failed']):
+            outcome = 'done' if upload.status == 'done' else 'failed'
+            watch_dir = os.path.dirname(os.path.dirname(pending[upload.pk]))
+            _move(pending[upload.pk], os.path.join(watch_dir, outcome))
+            with self.lock:
+                self.pending.pop(upload.pk, None)
+            self.stdout.write(f"{upload.filename}: {upload.status} {upload.result if upload.status == 'done' else upload.error[:120]}")
+        for upload_pk in due_uploads().filter(pk__in=pending).values_list('pk', flat=True):
+            if self.slots.acquire(blocking=False):
+                self.executor.submit(self.run_upload, upload_pk)
+
+    def recover(self, directories):
+        """Re-attach files left in processing/ by a previous run to their uploads, or ingest them again."""
+        for directory in directories:
+            for path in watchfolder.list_files(os.path.join(directory, 'processing'), self.extensions):
+                upload = InvoiceUpload.objects.filter(sha256=_sha256(path)).exclude(
+                    result__has_key='duplicate_of'
+                ).order_by('-created_at').first()
+                if upload:
+                    self.pending[upload.pk] = path
+                else:
+                    self.submit(_move(path, directory))
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _move(path, directory):
+    """Rename `path` into `directory`, adding a counter if the name is taken; returns the new path."""
+    stem, extension = os.path.splitext(os.path.basename(path))
+    target = os.path.join(directory, stem + extension)
+    counter = 1
+    while os.path.exists(target):
+        target = os.path.join(directory, f"{stem}-{counter}{extension}")
+        counter += 1
+    os.replace(path, target)
+    return target
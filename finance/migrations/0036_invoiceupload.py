@@ -0,0 +1,40 @@
+# Generated by Django 6.0 on 2026-10-19 09:12
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0035_dunningtype'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('upload_id', models.UUIDField(default=uuid.uuid4, editable=False, unique=True, verbose_name='Upload ID')),
+                ('filename', models.CharField(max_length=255, verbose_name='File Name')),
+                ('total_size', models.BigIntegerField(verbose_name='Total Size (bytes)')),
+                ('received_bytes', models.BigIntegerField(default=0, verbose_name='Received (bytes)')),
+                ('sha256', models.CharField(blank=True, db_index=True, max_length=64, verbose_name='SHA-256')),
+                ('split_invoice', models.BooleanField(default=False, verbose_name='Split Pages Into Invoices')),
+                ('status', models.CharField(choices=[('uploading', 'Uploading'), ('queued', 'Queued'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='uploading', max_length=20, verbose_name='Status')),
+                ('chunk_started_at', models.DateTimeField(blank=True, null=True)),
+                ('result', models.JSONField(blank=True, default=dict, verbose_name='Ingestion Result')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('created_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Invoice Uploads',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
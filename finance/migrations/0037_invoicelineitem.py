@@ -0,0 +1,36 @@
+# Generated by Django 6.0 on 2026-10-19 10:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0036_invoiceupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceLineItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Invoice Date')),
+                ('line_number', models.PositiveIntegerField(default=1, verbose_name='Line')),
+                ('item_name', models.CharField(max_length=255, verbose_name='Item Name')),
+                ('item_description', models.TextField(blank=True, verbose_name='Item Description')),
+                ('quantity', models.DecimalField(decimal_places=3, default=1, max_digits=15, verbose_name='Quantity')),
+                ('unit_price', models.DecimalField(decimal_places=2, default=0, max_digits=15, verbose_name='Unit Price')),
+                ('total_price', models.DecimalField(decimal_places=2, default=0, max_digits=15, verbose_name='Total Price')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('company', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='invoice_line_items', to='finance.company', verbose_name='Company')),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='line_items', to='finance.invoice', verbose_name='Invoice')),
+                ('supplier', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='invoice_line_items', to='finance.supplier', verbose_name='Supplier')),
+            ],
+            options={
+                'verbose_name_plural': 'Invoice Line Items',
+                'ordering': ['invoice', 'line_number'],
+                'indexes': [models.Index(fields=['company', 'item_name', 'date'], name='lineitem_company_item_date'), models.Index(fields=['company', 'supplier', 'date'], name='lineitem_company_supplier_date')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-19 11:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0037_invoicelineitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoicePageHash',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_number', models.PositiveIntegerField(default=1, verbose_name='Page')),
+                ('phash', models.BigIntegerField(verbose_name='Perceptual Hash')),
+                ('qr_digest', models.CharField(blank=True, max_length=64, verbose_name='QR Payload Digest')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='page_hashes', to='finance.invoice', verbose_name='Invoice')),
+            ],
+            options={
+                'verbose_name_plural': 'Invoice Page Hashes',
+                'ordering': ['invoice', 'page_number'],
+            },
+        ),
+    ]
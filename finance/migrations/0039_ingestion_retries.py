@@ -0,0 +1,60 @@
+# Generated by Django 6.0 on 2026-10-19 11:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0038_invoicepagehash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceDeadLetter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('error', models.TextField(verbose_name='Error')),
+                ('traceback', models.TextField(blank=True, verbose_name='Traceback')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Attempts')),
+                ('transient', models.BooleanField(default=False, verbose_name='Ran Out Of Retries')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Invoice Dead Letters',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='invoiceupload',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0, verbose_name='Attempts'),
+        ),
+        migrations.AddField(
+            model_name='invoiceupload',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True, verbose_name='Idempotency Key'),
+        ),
+        migrations.AddField(
+            model_name='invoiceupload',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Next Attempt'),
+        ),
+        migrations.AlterField(
+            model_name='invoiceupload',
+            name='status',
+            field=models.CharField(choices=[('uploading', 'Uploading'), ('queued', 'Queued'), ('processing', 'Processing'), ('retrying', 'Waiting To Retry'), ('done', 'Done'), ('failed', 'Failed'), ('dead', 'Dead-lettered')], default='uploading', max_length=20, verbose_name='Status'),
+        ),
+        migrations.AddIndex(
+            model_name='invoiceupload',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='upload_status_next_attempt'),
+        ),
+        migrations.AddField(
+            model_name='invoicedeadletter',
+            name='upload',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='dead_letter', to='finance.invoiceupload', verbose_name='Upload'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0039_ingestion_retries'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invoiceupload',
+            name='split_invoice',
+            field=models.BooleanField(blank=True, default=None, null=True, verbose_name='Split Pages Into Invoices'),
+        ),
+    ]
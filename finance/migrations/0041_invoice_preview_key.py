@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0040_invoiceupload_split_auto'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='preview_key',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Preview Key'),
+        ),
+    ]
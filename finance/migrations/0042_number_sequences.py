@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-19 16:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0041_invoice_preview_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NumberSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('series', models.CharField(default='JE', max_length=20, verbose_name='Series')),
+                ('next_value', models.BigIntegerField(default=1, verbose_name='Next Unreserved Number')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('company', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='number_sequences', to='finance.company', verbose_name='Company')),
+            ],
+            options={
+                'verbose_name_plural': 'Number Sequences',
+                'constraints': [models.UniqueConstraint(condition=models.Q(('company__isnull', False)), fields=('company', 'series'), name='number_sequence_company_series'), models.UniqueConstraint(condition=models.Q(('company__isnull', True)), fields=('series',), name='number_sequence_global_series')],
+            },
+        ),
+    ]
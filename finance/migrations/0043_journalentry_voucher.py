@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 16:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0042_number_sequences'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='journalentry',
+            name='voucher',
+            field=models.CharField(blank=True, db_index=True, max_length=50, verbose_name='Voucher'),
+        ),
+    ]
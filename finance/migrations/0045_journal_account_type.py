@@ -0,0 +1,40 @@
+# Generated by Django 6.0 on 2026-10-19 17:50
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_from_accounts(apps, schema_editor):
+    Account = apps.get_model('finance', 'Account')
+    JournalEntry = apps.get_model('finance', 'JournalEntry')
+    account = Account.objects.filter(pk=OuterRef('account_id'))
+    JournalEntry.objects.update(
+        account_type=Subquery(account.values('account_type')[:1]),
+        company_id=Subquery(account.values('company_id')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0044_ledger_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='journalentry',
+            name='account_type',
+            field=models.CharField(blank=True, choices=[('asset', 'Asset'), ('liability', 'Liability'), ('equity', 'Equity'), ('income', 'Income'), ('expense', 'Expense')], editable=False, max_length=20, verbose_name='Account Type'),
+        ),
+        migrations.RunPython(copy_from_accounts, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='journalentry',
+            index=models.Index(fields=['account_type', 'date', 'debit_amount', 'credit_amount'], name='journal_type_date_amounts'),
+        ),
+        migrations.AddIndex(
+            model_name='journalentry',
+            index=models.Index(fields=['company', 'account_type', 'date'], name='journal_company_type_date'),
+        ),
+    ]
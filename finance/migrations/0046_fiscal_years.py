@@ -0,0 +1,84 @@
+# Generated by Django 6.0 on 2026-10-19 18:20
+
+import re
+from datetime import date, timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_used_years(apps, schema_editor):
+    # Budgets and deduction certificates stored the year as text; each value becomes a FiscalYear row
+    FiscalYear = apps.get_model('finance', 'FiscalYear')
+    Budget = apps.get_model('finance', 'Budget')
+    DeductionCertificate = apps.get_model('finance', 'DeductionCertificate')
+    names = {'2025-2026'}
+    names.update(Budget.objects.values_list('fiscal_year_from', flat=True))
+    names.update(Budget.objects.values_list('fiscal_year_to', flat=True))
+    names.update(DeductionCertificate.objects.values_list('fiscal_year', flat=True))
+    month = settings.FISCAL_YEAR_START_MONTH
+    for name in sorted(names):
+        match = re.fullmatch(r"(\d{4})(?:-(\d{4}))?", name or '')
+        if not match:
+            continue
+        start = date(int(match.group(1)) - (1 if month > 1 and not match.group(2) else 0), month, 1)
+        end = date(start.year + 1, month, 1) - timedelta(days=1)
+        FiscalYear.objects.get_or_create(name=name, defaults={'start_date': start, 'end_date': end})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0045_journal_account_type'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FiscalYear',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=20, unique=True, verbose_name='Fiscal Year')),
+                ('start_date', models.DateField(unique=True, verbose_name='Start Date')),
+                ('end_date', models.DateField(verbose_name='End Date')),
+                ('is_closed', models.BooleanField(default=False, verbose_name='Closed')),
+                ('closed_at', models.DateTimeField(blank=True, null=True)),
+                ('closed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Fiscal Years',
+                'ordering': ['start_date'],
+            },
+        ),
+        migrations.RunPython(create_used_years, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='budget',
+            name='fiscal_year_from',
+            field=models.ForeignKey(db_column='fiscal_year_from', on_delete=django.db.models.deletion.PROTECT, related_name='budgets_from', to='finance.fiscalyear', to_field='name', verbose_name='Fiscal Year From'),
+        ),
+        migrations.AlterField(
+            model_name='budget',
+            name='fiscal_year_to',
+            field=models.ForeignKey(db_column='fiscal_year_to', on_delete=django.db.models.deletion.PROTECT, related_name='budgets_to', to='finance.fiscalyear', to_field='name', verbose_name='Fiscal Year To'),
+        ),
+        migrations.AlterField(
+            model_name='deductioncertificate',
+            name='fiscal_year',
+            field=models.ForeignKey(db_column='fiscal_year', on_delete=django.db.models.deletion.PROTECT, related_name='deduction_certificates', to='finance.fiscalyear', to_field='name', verbose_name='Fiscal Year'),
+        ),
+        migrations.CreateModel(
+            name='OpeningBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('debit_amount', models.DecimalField(decimal_places=2, default=0.0, max_digits=18, verbose_name='Debit Total')),
+                ('credit_amount', models.DecimalField(decimal_places=2, default=0.0, max_digits=18, verbose_name='Credit Total')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='opening_balances', to='finance.account')),
+                ('fiscal_year', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='opening_balances', to='finance.fiscalyear')),
+            ],
+            options={
+                'verbose_name_plural': 'Opening Balances',
+                'unique_together': {('fiscal_year', 'account')},
+            },
+        ),
+    ]
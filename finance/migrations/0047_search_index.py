@@ -0,0 +1,45 @@
+# Generated by Django 6.0 on 2026-10-19 19:05
+
+from django.db import migrations
+
+# The full-text tables as of this migration; their triggers are installed after every migrate run (finance.triggers)
+SQLITE_TABLES = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS finance_journal_search USING fts5(entry_number, account_name, description, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS finance_invoice_search USING fts5(invoice_number, supplier_name, customer_name, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+]
+POSTGRESQL_TABLES = [
+    "CREATE TABLE IF NOT EXISTS finance_journal_search (id bigint PRIMARY KEY, document tsvector NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS finance_journal_search_document ON finance_journal_search USING gin (document)",
+    "CREATE TABLE IF NOT EXISTS finance_invoice_search (id bigint PRIMARY KEY, document tsvector NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS finance_invoice_search_document ON finance_invoice_search USING gin (document)",
+]
+DROP_TABLES = [
+    "DROP TABLE IF EXISTS finance_journal_search",
+    "DROP TABLE IF EXISTS finance_invoice_search",
+]
+
+
+def create_tables(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for statement in {'sqlite': SQLITE_TABLES, 'postgresql': POSTGRESQL_TABLES}.get(vendor, []):
+        schema_editor.execute(statement)
+
+
+def drop_tables(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        for statement in DROP_TABLES:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0046_fiscal_years'),
+    ]
+
+    operations = [
+        # Full-text tables maintained by finance.search; not Django models
+        migrations.RunPython(create_tables, drop_tables),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 6.0 on 2026-10-19 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0047_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RowCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table_name', models.CharField(max_length=100, verbose_name='Table')),
+                ('company_id', models.BigIntegerField(default=0, verbose_name='Company ID')),
+                ('row_count', models.BigIntegerField(default=0, verbose_name='Rows')),
+            ],
+            options={
+                'verbose_name_plural': 'Row Counts',
+                'unique_together': {('table_name', 'company_id')},
+            },
+        ),
+    ]
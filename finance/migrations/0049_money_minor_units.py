@@ -0,0 +1,126 @@
+# Generated by Django 6.0 on 2026-10-19 21:02
+
+import finance.money
+from django.db import migrations
+
+# model -> amount columns turning from DECIMAL into integer minor units (all with 2 decimal places)
+MONEY_COLUMNS = {
+    'bankguarantee': ['amount'],
+    'budget': ['budget_amount'],
+    'deductioncertificate': ['certificate_limit'],
+    'invoice': ['amount_before_vat', 'total_amount', 'total_vat'],
+    'invoicelineitem': ['total_price', 'unit_price'],
+    'journalentry': ['credit_amount', 'debit_amount'],
+    'openingbalance': ['credit_amount', 'debit_amount'],
+    'taxwithholdingrate': ['cumulative_threshold', 'transaction_threshold'],
+}
+SCALE = 100
+
+
+def _columns(apps, schema_editor):
+    quote = schema_editor.quote_name
+    for model_name, names in MONEY_COLUMNS.items():
+        model = apps.get_model('finance', model_name)
+        yield quote(model._meta.db_table), [quote(model._meta.get_field(name).column) for name in names]
+
+
+def to_minor_units(apps, schema_editor):
+    """Scale the amounts while the columns are still decimal; AlterField then only changes the type."""
+    for table, columns in _columns(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            # Unconstrained numeric first, so amounts near max_digits still fit once scaled
+            schema_editor.execute(f"ALTER TABLE {table} " + ", ".join(
+                f"ALTER COLUMN {column} TYPE numeric USING round({column} * {SCALE})" for column in columns
+            ))
+        else:
+            schema_editor.execute(f"UPDATE {table} SET " + ", ".join(
+                f"{column} = round({column} * {SCALE})" for column in columns
+            ))
+
+
+def from_minor_units(apps, schema_editor):
+    for table, columns in _columns(apps, schema_editor):
+        schema_editor.execute(f"UPDATE {table} SET " + ", ".join(
+            f"{column} = {column} / {SCALE}.0" for column in columns
+        ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0048_row_counts'),
+    ]
+
+    operations = [
+        migrations.RunPython(to_minor_units, from_minor_units),
+        migrations.AlterField(
+            model_name='bankguarantee',
+            name='amount',
+            field=finance.money.MoneyField(decimal_places=2, max_digits=15, verbose_name='Amount'),
+        ),
+        migrations.AlterField(
+            model_name='budget',
+            name='budget_amount',
+            field=finance.money.MoneyField(decimal_places=2, max_digits=15, verbose_name='Total Budget Amount'),
+        ),
+        migrations.AlterField(
+            model_name='deductioncertificate',
+            name='certificate_limit',
+            field=finance.money.MoneyField(decimal_places=2, default=0.0, max_digits=12, verbose_name='Certificate Limit'),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='amount_before_vat',
+            field=finance.money.MoneyField(decimal_places=2, max_digits=15, verbose_name='Amount Before VAT'),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='total_amount',
+            field=finance.money.MoneyField(decimal_places=2, max_digits=15, verbose_name='Total Amount'),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='total_vat',
+            field=finance.money.MoneyField(decimal_places=2, max_digits=15, verbose_name='Total VAT'),
+        ),
+        migrations.AlterField(
+            model_name='invoicelineitem',
+            name='total_price',
+            field=finance.money.MoneyField(decimal_places=2, default=0, max_digits=15, verbose_name='Total Price'),
+        ),
+        migrations.AlterField(
+            model_name='invoicelineitem',
+            name='unit_price',
+            field=finance.money.MoneyField(decimal_places=2, default=0, max_digits=15, verbose_name='Unit Price'),
+        ),
+        migrations.AlterField(
+            model_name='journalentry',
+            name='credit_amount',
+            field=finance.money.MoneyField(decimal_places=2, default=0.0, max_digits=15, verbose_name='Credit Amount'),
+        ),
+        migrations.AlterField(
+            model_name='journalentry',
+            name='debit_amount',
+            field=finance.money.MoneyField(decimal_places=2, default=0.0, max_digits=15, verbose_name='Debit Amount'),
+        ),
+        migrations.AlterField(
+            model_name='openingbalance',
+            name='credit_amount',
+            field=finance.money.MoneyField(decimal_places=2, default=0.0, max_digits=18, verbose_name='Credit Total'),
+        ),
+        migrations.AlterField(
+            model_name='openingbalance',
+            name='debit_amount',
+            field=finance.money.MoneyField(decimal_places=2, default=0.0, max_digits=18, verbose_name='Debit Total'),
+        ),
+        migrations.AlterField(
+            model_name='taxwithholdingrate',
+            name='cumulative_threshold',
+            field=finance.money.MoneyField(decimal_places=2, default=0.0, max_digits=12, verbose_name='Cumulative Threshold'),
+        ),
+        migrations.AlterField(
+            model_name='taxwithholdingrate',
+            name='transaction_threshold',
+            field=finance.money.MoneyField(decimal_places=2, default=0.0, max_digits=12, verbose_name='Transaction Threshold'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 6.0 on 2026-10-19 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0049_money_minor_units'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='rowcount',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='rowcount',
+            name='slot',
+            field=models.SmallIntegerField(default=0, verbose_name='Slot'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='rowcount',
+            unique_together={('table_name', 'company_id', 'slot')},
+        ),
+    ]
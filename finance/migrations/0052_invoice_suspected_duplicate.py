@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-19 22:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0051_protect_journal_account'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='duplicate_distance',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Page Hash Distance'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='suspected_duplicates', to='finance.invoice', verbose_name='Suspected Duplicate Of'),
+        ),
+    ]
@@ -1,5 +1,10 @@
-from django.db import models
+import uuid
+
+from django.db import connection, models, transaction
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+
+from .money import MoneyField
 
 # Remove the Login and Signup models - they're not needed! 
 # Django's built-in User model handles this already
@@ -177,11 +182,31 @@ class Account(models.Model):
         verbose_name_plural = "Accounts"
         ordering = ['-created_at']
         unique_together = ['company', 'account_number']  # Prevent duplicate account numbers per company
+        indexes = [
+            # Reports select accounts by type, then read their journal lines through the journal index
+            models.Index(fields=['account_type'], name='account_type_idx'),
+        ]
     
     def __str__(self):
         if self.account_number:
             return f"{self.account_number} - {self.name}"
         return self.name
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Journal lines keep a copy of the type and company (see JournalEntry.account_type); move them in one update
+        JournalEntry.open_lines(self.journal_entries.all()).exclude(
+            account_type=self.account_type, company_id=self.company_id
+        ).update(account_type=self.account_type, company_id=self.company_id)
+
+    @classmethod
+    def sync_journal_entries(cls, account_ids):
+        """Copy the type and company of accounts changed in bulk (no save()) onto their open-period journal lines."""
+        account = cls.objects.filter(pk=models.OuterRef('account_id'))
+        JournalEntry.open_lines(JournalEntry.objects.filter(account_id__in=account_ids)).update(
+            account_type=models.Subquery(account.values('account_type')[:1]),
+            company_id=models.Subquery(account.values('company_id')[:1]),
+        )
     
 class CostCenter(models.Model):
     name = models.CharField(
@@ -241,8 +266,22 @@ class Budget(models.Model):
     # Basic Information
     series = models.CharField(max_length=200, verbose_name="Budget Series")
     budget_against = models.CharField(max_length=200,choices=[('cost_center', 'Cost Center'), ('project', 'Project')], verbose_name="Budget Against")
-    fiscal_year_from = models.CharField(max_length=20, choices=[('2025-2026', '2025-2026')], verbose_name="Fiscal Year From")
-    fiscal_year_to = models.CharField(max_length=20, choices=[('2025-2026', '2025-2026')], verbose_name="Fiscal Year To")
+    fiscal_year_from = models.ForeignKey(
+        'FiscalYear',
+        on_delete=models.PROTECT,
+        to_field='name',
+        db_column='fiscal_year_from',
+        related_name='budgets_from',
+        verbose_name="Fiscal Year From"
+    )
+    fiscal_year_to = models.ForeignKey(
+        'FiscalYear',
+        on_delete=models.PROTECT,
+        to_field='name',
+        db_column='fiscal_year_to',
+        related_name='budgets_to',
+        verbose_name="Fiscal Year To"
+    )
     # Company Relationship
     company = models.ForeignKey(
         Company,
@@ -263,7 +302,7 @@ class Budget(models.Model):
         verbose_name="Account"
     )
     # Amount
-    budget_amount = models.DecimalField(
+    budget_amount = MoneyField(
         max_digits=15,
         decimal_places=2,
         verbose_name="Total Budget Amount"
@@ -314,17 +353,17 @@ class Invoice(models.Model):
     customer_vat = models.CharField(max_length=50, blank=True, verbose_name="Customer VAT")
     
     # Financial Information
-    amount_before_vat = models.DecimalField(
+    amount_before_vat = MoneyField(
         max_digits=15,
         decimal_places=2,
         verbose_name="Amount Before VAT"
     )
-    total_vat = models.DecimalField(
+    total_vat = MoneyField(
         max_digits=15,
         decimal_places=2,
         verbose_name="Total VAT"
     )
-    total_amount = models.DecimalField(
+    total_amount = MoneyField(
         max_digits=15,
         decimal_places=2,
         verbose_name="Total Amount"
@@ -333,6 +372,18 @@ class Invoice(models.Model):
     # QR Code
     qr_code_present = models.BooleanField(default=False, verbose_name="QR Code Present")
     qr_code_data = models.TextField(blank=True, verbose_name="QR Code Data")
+    # Key of the first-page thumbnail in finance.previews ('' if none was made)
+    preview_key = models.CharField(max_length=64, blank=True, verbose_name="Preview Key")
+    # Stored invoice whose scanned pages this one's look like (finance.duplicates), left for a person to review
+    duplicate_of = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        related_name='suspected_duplicates',
+        null=True,
+        blank=True,
+        verbose_name="Suspected Duplicate Of"
+    )
+    duplicate_distance = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Page Hash Distance")
     
     # Status
     status = models.CharField(
@@ -360,6 +411,11 @@ class Invoice(models.Model):
     class Meta:
         verbose_name_plural = "Invoices"
         ordering = ['-date', '-created_at']
+        indexes = [
+            models.Index(fields=['status', 'date'], name='invoice_status_date'),  # payables/receivables
+            models.Index(fields=['date', 'created_at'], name='invoice_date_created'),  # default ordering
+            models.Index(fields=['invoice_number'], name='invoice_number_idx'),  # duplicate check on ingestion
+        ]
     
     def __str__(self):
         return f"{self.invoice_number} - {self.supplier.name if self.supplier else 'Unknown Supplier'}"
@@ -383,6 +439,124 @@ class Invoice(models.Model):
 
         super().save(*args, **kwargs)
 
+class InvoiceLineItem(models.Model):
+    """One extracted line of an invoice; company, supplier and date are copied from the invoice for spend queries."""
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='line_items', verbose_name="Invoice")
+    company = models.ForeignKey(
+        Company,
+        on_delete=models.CASCADE,
+        related_name='invoice_line_items',
+        null=True,
+        blank=True,
+        verbose_name="Company"
+    )
+    supplier = models.ForeignKey(
+        'Supplier',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='invoice_line_items',
+        verbose_name="Supplier",
+    )
+    date = models.DateField(verbose_name="Invoice Date")
+    line_number = models.PositiveIntegerField(default=1, verbose_name="Line")
+    item_name = models.CharField(max_length=255, verbose_name="Item Name")
+    item_description = models.TextField(blank=True, verbose_name="Item Description")
+    quantity = models.DecimalField(max_digits=15, decimal_places=3, default=1, verbose_name="Quantity")
+    unit_price = MoneyField(max_digits=15, decimal_places=2, default=0, verbose_name="Unit Price")
+    total_price = MoneyField(max_digits=15, decimal_places=2, default=0, verbose_name="Total Price")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "Invoice Line Items"
+        ordering = ['invoice', 'line_number']
+        indexes = [
+            models.Index(fields=['company', 'item_name', 'date'], name='lineitem_company_item_date'),
+            models.Index(fields=['company', 'supplier', 'date'], name='lineitem_company_supplier_date'),
+        ]
+
+    def __str__(self):
+        return f"{self.invoice.invoice_number} #{self.line_number}: {self.item_name}"
+
+class InvoicePageHash(models.Model):
+    """Perceptual hash of one scanned invoice page, used to catch re-scans before any OCR/LLM call."""
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='page_hashes', verbose_name="Invoice")
+    page_number = models.PositiveIntegerField(default=1, verbose_name="Page")
+    # 64-bit pHash, stored as a signed integer (see finance.duplicates.to_db)
+    phash = models.BigIntegerField(verbose_name="Perceptual Hash")
+    qr_digest = models.CharField(max_length=64, blank=True, verbose_name="QR Payload Digest")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "Invoice Page Hashes"
+        ordering = ['invoice', 'page_number']
+
+    def __str__(self):
+        return f"{self.invoice.invoice_number} p{self.page_number}: {self.phash & 0xFFFFFFFFFFFFFFFF:016x}"
+
+class InvoiceUpload(models.Model):
+    """Staged chunked upload of one invoice file, resumable until finalized."""
+    STATUS_CHOICES = [
+        ('uploading', 'Uploading'),
+        ('queued', 'Queued'),
+        ('processing', 'Processing'),
+        ('retrying', 'Waiting To Retry'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+        ('dead', 'Dead-lettered'),
+    ]
+
+    upload_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False, verbose_name="Upload ID")
+    # Client-supplied key: repeating a start request with the same key returns the same upload
+    idempotency_key = models.CharField(max_length=100, unique=True, null=True, blank=True, verbose_name="Idempotency Key")
+    filename = models.CharField(max_length=255, verbose_name="File Name")
+    total_size = models.BigIntegerField(verbose_name="Total Size (bytes)")
+    received_bytes = models.BigIntegerField(default=0, verbose_name="Received (bytes)")
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True, verbose_name="SHA-256")
+    # None lets ingestion group the pages into invoices itself; True/False force one invoice per page / per file
+    split_invoice = models.BooleanField(null=True, blank=True, default=None, verbose_name="Split Pages Into Invoices")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading', verbose_name="Status")
+    # Set while a chunk is being written; acts as a short-lived lock per upload
+    chunk_started_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(default=dict, blank=True, verbose_name="Ingestion Result")
+    error = models.TextField(blank=True, verbose_name="Error")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Attempts")
+    next_attempt_at = models.DateTimeField(null=True, blank=True, verbose_name="Next Attempt")
+
+    # Metadata
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+
+    class Meta:
+        verbose_name_plural = "Invoice Uploads"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='upload_status_next_attempt'),
+        ]
+
+    def __str__(self):
+        return f"{self.filename} ({self.status})"
+
+class InvoiceDeadLetter(models.Model):
+    """An upload that failed permanently or ran out of retries; its staged file is kept for requeueing."""
+    upload = models.OneToOneField(InvoiceUpload, on_delete=models.CASCADE, related_name='dead_letter', verbose_name="Upload")
+    error = models.TextField(verbose_name="Error")
+    traceback = models.TextField(blank=True, verbose_name="Traceback")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Attempts")
+    transient = models.BooleanField(default=False, verbose_name="Ran Out Of Retries")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "Invoice Dead Letters"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.upload.filename}: {self.error[:80]}"
+
 class JournalEntry(models.Model):
     # Entry Number (auto-generated)
     entry_number = models.CharField(max_length=50, unique=True, verbose_name="Entry Number")
@@ -390,31 +564,44 @@ class JournalEntry(models.Model):
     # Date
     date = models.DateField(verbose_name="Posting Date")
     
-    # Account Relationship
+    # Account Relationship (an account with posted lines cannot be deleted, closed years included)
     account = models.ForeignKey(
         Account,
-        on_delete=models.CASCADE,
+        on_delete=models.PROTECT,
         related_name='journal_entries',
         verbose_name="Account"
     )
     
     # Amounts
-    debit_amount = models.DecimalField(
+    debit_amount = MoneyField(
         max_digits=15,
         decimal_places=2,
         default=0.00,
         verbose_name="Debit Amount"
     )
     
-    credit_amount = models.DecimalField(
+    credit_amount = MoneyField(
         max_digits=15,
         decimal_places=2,
         default=0.00,
         verbose_name="Credit Amount"
     )
     
+    # Copy of account.account_type, so totals by type and period are read from this table alone.
+    # Set in save() and kept in step by Account.save()
+    account_type = models.CharField(
+        max_length=20,
+        choices=Account.ACCOUNT_TYPE_CHOICES,
+        blank=True,
+        editable=False,
+        verbose_name="Account Type"
+    )
+    
     # Description
     description = models.TextField(blank=True, verbose_name="Description")
+
+    # Lines posted together as one balanced voucher share this reference (finance.posting)
+    voucher = models.CharField(max_length=50, blank=True, db_index=True, verbose_name="Voucher")
     
     # Company Relationship
     company = models.ForeignKey(
@@ -434,23 +621,166 @@ class JournalEntry(models.Model):
     class Meta:
         verbose_name_plural = "Journal Entries"
         ordering = ['-date', '-created_at']
+        indexes = [
+            # Ledger order per account, and date-range sums per account answered from the index alone
+            models.Index(fields=['account', 'date', 'created_at', 'debit_amount', 'credit_amount'],
+                         name='journal_account_date_amounts'),
+            models.Index(fields=['date', 'created_at'], name='journal_date_created'),  # default ordering
+            # Period totals by account type, overall and per company
+            models.Index(fields=['account_type', 'date', 'debit_amount', 'credit_amount'],
+                         name='journal_type_date_amounts'),
+            models.Index(fields=['company', 'account_type', 'date'], name='journal_company_type_date'),
+        ]
     
     def __str__(self):
         return f"{self.entry_number} - {self.account.name}"
     
     def save(self, *args, **kwargs):
-        # Auto-generate entry number if not provided
+        # The line's company and type always follow its account
+        self.company_id = self.account.company_id
+        self.account_type = self.account.account_type
+        # Auto-generate entry number if not provided (from this process's reserved block, see finance.sequences)
         if not self.entry_number:
-            last_entry = JournalEntry.objects.order_by('-id').first()
-            if last_entry and last_entry.entry_number.startswith('JE'):
-                try:
-                    last_number = int(last_entry.entry_number[2:])
-                    self.entry_number = f"JE{str(last_number + 1).zfill(5)}"
-                except ValueError:
-                    self.entry_number = "JE00001"
-            else:
-                self.entry_number = "JE00001"
-        super().save(*args, **kwargs)
+            from .sequences import next_entry_number
+            self.entry_number = next_entry_number(self.company_id)
+        # One transaction, so the period check holds until the line is written
+        with transaction.atomic():
+            self.check_period_open()
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            self.check_period_open()
+            return super().delete(*args, **kwargs)
+
+    def clean(self):
+        super().clean()
+        if self.date:
+            self.check_period_open()
+
+    def check_period_open(self):
+        """Lines of a closed fiscal year are frozen: refuse to add, move into, edit or delete them."""
+        dates = [self._meta.get_field('date').to_python(self.date)]
+        if self.pk:
+            dates += JournalEntry.objects.filter(pk=self.pk).values_list('date', flat=True)
+        FiscalYear.hold_open(dates)
+        closed_through = FiscalYear.closed_through()
+        if closed_through is None:
+            return
+        if any(day and day <= closed_through for day in dates):
+            raise ValidationError({'date': f"The books are closed through {closed_through}; this line cannot be changed."})
+
+    @staticmethod
+    def open_lines(lines):
+        """`lines` without those of closed fiscal years, for bulk updates that must not reach into them."""
+        closed_through = FiscalYear.closed_through()
+        return lines if closed_through is None else lines.filter(date__gt=closed_through)
+
+class NumberSequence(models.Model):
+    """Next free number of a document series (e.g. journal entries) per company; handed out in blocks."""
+    company = models.ForeignKey(
+        Company,
+        on_delete=models.CASCADE,
+        related_name='number_sequences',
+        null=True,
+        blank=True,
+        verbose_name="Company"
+    )
+    series = models.CharField(max_length=20, default='JE', verbose_name="Series")
+    next_value = models.BigIntegerField(default=1, verbose_name="Next Unreserved Number")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "Number Sequences"
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'series'], condition=models.Q(company__isnull=False),
+                                    name='number_sequence_company_series'),
+            models.UniqueConstraint(fields=['series'], condition=models.Q(company__isnull=True),
+                                    name='number_sequence_global_series'),
+        ]
+
+    def __str__(self):
+        return f"{self.series} ({self.company or 'no company'}): next {self.next_value}"
+
+class FiscalYear(models.Model):
+    """An accounting year (or other period); closing it freezes its lines and carries balances forward (finance.periods)."""
+    name = models.CharField(max_length=20, unique=True, verbose_name="Fiscal Year")
+    start_date = models.DateField(unique=True, verbose_name="Start Date")
+    end_date = models.DateField(verbose_name="End Date")
+    is_closed = models.BooleanField(default=False, verbose_name="Closed")
+    closed_at = models.DateTimeField(null=True, blank=True)
+    closed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        verbose_name_plural = "Fiscal Years"
+        ordering = ['start_date']
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def hold_open(cls, days):
+        """
+        Share-lock the fiscal years containing `days` until the transaction ends.
+
+        close_fiscal_year() locks its year FOR UPDATE, so a posting waits for a close in progress
+        (and then sees it) and a close waits for postings that checked the year was open.
+        SQLite allows one writer at a time, which has the same effect.
+        """
+        days = [day for day in days if day]
+        if not days or connection.vendor != 'postgresql' or not connection.in_atomic_block:
+            return
+        where = " OR ".join(["(start_date <= %s AND end_date >= %s)"] * len(days))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT id FROM {cls._meta.db_table} WHERE {where} FOR SHARE",
+                [value for day in days for value in (day, day)],
+            )
+
+    def clean(self):
+        super().clean()
+        if self.start_date and self.end_date:
+            if self.end_date < self.start_date:
+                raise ValidationError({'end_date': "The year must end after it starts."})
+            overlapping = FiscalYear.objects.filter(start_date__lte=self.end_date, end_date__gte=self.start_date)
+            if overlapping.exclude(pk=self.pk).exists():
+                raise ValidationError("Fiscal years cannot overlap.")
+
+    @classmethod
+    def closed_through(cls):
+        """End date of the last closed year (years are closed in order), or None."""
+        return cls.objects.filter(is_closed=True).aggregate(end=models.Max('end_date'))['end']
+
+class OpeningBalance(models.Model):
+    """An account's cumulative debit and credit totals up to the start of a fiscal year, written when the year before closes."""
+    fiscal_year = models.ForeignKey(FiscalYear, on_delete=models.CASCADE, related_name='opening_balances')
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='opening_balances')
+    debit_amount = MoneyField(max_digits=18, decimal_places=2, default=0.00, verbose_name="Debit Total")
+    credit_amount = MoneyField(max_digits=18, decimal_places=2, default=0.00, verbose_name="Credit Total")
+
+    class Meta:
+        verbose_name_plural = "Opening Balances"
+        unique_together = ['fiscal_year', 'account']
+
+    def __str__(self):
+        return f"{self.fiscal_year} {self.account}: {self.debit_amount - self.credit_amount}"
+
+
+class RowCount(models.Model):
+    """Rows of a table per company, kept current by database triggers; read through finance.counters."""
+    table_name = models.CharField(max_length=100, verbose_name="Table")
+    # A plain id rather than a foreign key (0: rows without a company), so the triggers can upsert on it
+    company_id = models.BigIntegerField(default=0, verbose_name="Company ID")
+    # One of counters.SLOTS rows making up the counter; a slot on its own may go negative
+    slot = models.SmallIntegerField(default=0, verbose_name="Slot")
+    row_count = models.BigIntegerField(default=0, verbose_name="Rows")
+
+    class Meta:
+        verbose_name_plural = "Row Counts"
+        unique_together = ['table_name', 'company_id', 'slot']
+
+    def __str__(self):
+        return f"{self.table_name} [{self.company_id}/{self.slot}]: {self.row_count}"
 
 class Supplier(models.Model):
     SUPPLIER_TYPE_CHOICES = [
@@ -777,14 +1107,14 @@ class TaxWithholdingRate(models.Model):
         default=0.000
     )
     
-    cumulative_threshold = models.DecimalField(
+    cumulative_threshold = MoneyField(
         max_digits=12, 
         decimal_places=2, 
         default=0.00, 
         verbose_name="Cumulative Threshold"
     )
     
-    transaction_threshold = models.DecimalField(
+    transaction_threshold = MoneyField(
         max_digits=12, 
         decimal_places=2, 
         default=0.00, 
@@ -829,7 +1159,14 @@ class DeductionCertificate(models.Model):
         on_delete=models.CASCADE,
         verbose_name="Company"
     )
-    fiscal_year = models.CharField(max_length=20,  choices=[('2025-2026', '2025-2026')],verbose_name="Fiscal Year")
+    fiscal_year = models.ForeignKey(
+        'FiscalYear',
+        on_delete=models.PROTECT,
+        to_field='name',
+        db_column='fiscal_year',
+        related_name='deduction_certificates',
+        verbose_name="Fiscal Year"
+    )
     certificate_number = models.CharField(max_length=100, verbose_name="Certificate Number")
     supplier = models.ForeignKey(
         'Supplier',
@@ -846,7 +1183,7 @@ class DeductionCertificate(models.Model):
         verbose_name="Rate of TDS",
         default=0.000
     )
-    certificate_limit = models.DecimalField(
+    certificate_limit = MoneyField(
         max_digits=12,
         decimal_places=2,
         verbose_name="Certificate Limit",
@@ -892,7 +1229,7 @@ class BankAccount(models.Model):
     
 class BankGuarantee(models.Model):
     type = models.CharField(max_length=100, verbose_name="Bank Guarantee Type", choices=[('receiving', 'Receiving'), ('providing', 'Providing')])
-    amount = models.DecimalField(max_digits=15, decimal_places=2, verbose_name="Amount")
+    amount = MoneyField(max_digits=15, decimal_places=2, verbose_name="Amount")
     start_date = models.DateField(verbose_name="Start Date")
 
     class Meta:
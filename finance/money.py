@@ -0,0 +1,112 @@
+from decimal import Decimal, InvalidOperation
+
+from django import forms
+from django.core import validators
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.db.models import Avg, ExpressionWrapper, F, Sum
+from django.utils.functional import cached_property
+
+# Money columns hold whole minor units (cents) in a BIGINT instead of a
+# DECIMAL: SQLite has no decimal type and summed those columns as floats,
+# while integer SUMs are exact and fast on every database. MoneyField reads
+# and writes Decimals, so models, forms and templates see the same values as
+# before; decimal_places is the column's fixed scale (2: cents, which covers
+# every currency the ledger held so far) and is recorded in the migrations,
+# as changing it means rescaling the stored integers.
+#
+# Sum/Min/Max over a MoneyField come back as Decimals too; Avg does not (it
+# averages integers into a float of minor units), so averages use MinorAvg.
+# Code that totals many rows in Python asks for the raw integers instead
+# (minor(), MinorSum) and converts once at the end with from_minor().
+
+
+def to_minor(amount, decimal_places=2):
+    """Decimal (or int/str) amount -> integer minor units, rounded half to even like DecimalField."""
+    return int(Decimal(amount).scaleb(decimal_places).to_integral_value())
+
+
+def from_minor(units, decimal_places=2):
+    """Integer minor units -> Decimal with exactly `decimal_places` places (1234 -> Decimal('12.34'))."""
+    return Decimal(units).to_integral_value().scaleb(-decimal_places)
+
+
+def minor(field_name):
+    """A money column's raw integer value, for values()/values_list() without a Decimal per row."""
+    return ExpressionWrapper(F(field_name), output_field=models.BigIntegerField())
+
+
+class MinorSum(Sum):
+    """Sum of a money column as integer minor units; 0 when no rows match."""
+
+    def __init__(self, expression, **extra):
+        extra.setdefault('default', 0)
+        super().__init__(expression, output_field=models.BigIntegerField(), **extra)
+
+
+class MinorAvg(Avg):
+    """
+    Average of a money column, as an amount with the column's decimal places.
+
+    A plain Avg over the BIGINT minor units comes back as a float count of cents.
+    """
+
+    def _resolve_output_field(self):
+        source = self.get_source_fields()[0]
+        if not isinstance(source, MoneyField):
+            raise TypeError(f"MinorAvg needs a money column, got {type(source).__name__}")
+        return MoneyField(max_digits=source.max_digits, decimal_places=source.decimal_places)
+
+
+class MoneyField(models.BigIntegerField):
+    """An amount stored as integer minor units and used as a Decimal with `decimal_places` places."""
+    description = "Amount (stored in integer minor units)"
+    default_error_messages = {'invalid': "“%(value)s” value must be a decimal number."}
+
+    def __init__(self, *args, max_digits=15, decimal_places=2, **kwargs):
+        self.max_digits, self.decimal_places = max_digits, decimal_places
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['max_digits'] = self.max_digits
+        kwargs['decimal_places'] = self.decimal_places
+        return name, path, args, kwargs
+
+    @cached_property
+    def validators(self):
+        # The amount's own digits, not the BIGINT range of the minor units
+        return [*self.default_validators, *self._validators,
+                validators.DecimalValidator(self.max_digits, self.decimal_places)]
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Decimal):
+            return value
+        try:
+            return Decimal(str(value) if isinstance(value, float) else value)
+        except (InvalidOperation, TypeError, ValueError):
+            raise ValidationError(self.error_messages['invalid'], code='invalid', params={'value': value})
+
+    def to_minor(self, value):
+        return to_minor(value, self.decimal_places)
+
+    def from_minor(self, units):
+        return from_minor(units, self.decimal_places)
+
+    def get_prep_value(self, value):
+        value = models.Field.get_prep_value(self, value)
+        if value is None:
+            return None
+        return self.to_minor(self.to_python(value))
+
+    def from_db_value(self, value, expression, connection):
+        # Averages arrive as floats or fractional numerics; amounts stop at the minor unit
+        return None if value is None else self.from_minor(value)
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, **{
+            'form_class': forms.DecimalField,
+            'max_digits': self.max_digits,
+            'decimal_places': self.decimal_places,
+            **kwargs,
+        })
@@ -0,0 +1,166 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from django.conf import settings
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import vision
+from google.cloud.vision_v1.services.image_annotator.transports.rest import ImageAnnotatorRestTransport
+
+from . import ratelimit
+
+logger = logging.getLogger(__name__)
+
+# Vision accepts at most 16 images per batch_annotate_images call and 10 MB per
+# JSON request; base64 inflates content by 4/3, so keep the raw bytes under 7 MB.
+MAX_IMAGES_PER_REQUEST = 16
+MAX_REQUEST_BYTES = 7 * 1024 * 1024
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    One ImageAnnotatorClient per process (re-created after a fork).
+
+    With INVOICE_OCR_ENDPOINT set, talks REST to that endpoint without credentials,
+    e.g. the stub from `manage.py ocr_stub_server`.
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            endpoint = getattr(settings, 'INVOICE_OCR_ENDPOINT', None)
+            if endpoint:
+                parsed = urlparse(endpoint if '://' in endpoint else f"http://{endpoint}")
+                transport = ImageAnnotatorRestTransport(
+                    host=parsed.netloc, url_scheme=parsed.scheme, credentials=AnonymousCredentials(),
+                )
+                _client = vision.ImageAnnotatorClient(transport=transport)
+            else:
+                _client = vision.ImageAnnotatorClient()
+            _client_pid = os.getpid()
+        return _client
+
+
+class OCRBatcher:
+    """
+    Coalesces concurrent page OCR requests into batch_annotate_images calls.
+
+    Callers block on their own page only; a dispatcher thread collects whatever is
+    pending for up to `max_wait` seconds (or until a batch is full), sends it as
+    one request, and fans the responses back out in order.
+    """
+
+    def __init__(self, max_wait=0.05, max_images=MAX_IMAGES_PER_REQUEST, max_bytes=MAX_REQUEST_BYTES, max_in_flight=4):
+        self.max_wait = max_wait
+        self.max_images = max_images
+        self.max_bytes = max_bytes
+        self._pending = []
+        self._cond = threading.Condition()
+        self._dispatcher = None
+        self._senders = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='ocr-batch')
+
+    def submit(self, content):
+        future = Future()
+        with self._cond:
+            self._pending.append((content, future))
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._run, name='ocr-dispatcher', daemon=True)
+                self._dispatcher.start()
+            self._cond.notify()
+        return future
+
+    def annotate(self, content):
+        """DOCUMENT_TEXT_DETECTION for one image; returns its AnnotateImageResponse."""
+        return self.submit(content).result()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.max_wait
+                while len(self._pending) < self.max_images:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take_batch()
+            self._senders.submit(self._send, batch)
+
+    def _take_batch(self):
+        batch, size = [], 0
+        while self._pending and len(batch) < self.max_images:
+            content = self._pending[0][0]
+            if batch and size + len(content) > self.max_bytes:
+                break
+            batch.append(self._pending.pop(0))
+            size += len(content)
+        return batch
+
+    def _send(self, batch):
+        feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+        requests = [vision.AnnotateImageRequest(image=vision.Image(content=content), features=[feature])
+                    for content, _ in batch]
+        try:
+            # Vision's quota counts images, so a batch spends one unit per page
+            response = ratelimit.call(
+                'vision', lambda: get_client().batch_annotate_images(requests=requests, retry=None), tokens=len(batch),
+            )
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        logger.debug("OCR batch: %d image(s) in one request", len(batch))
+        for (_, future), page_response in zip(batch, response.responses):
+            future.set_result(page_response)
+
+
+def _scale_vertices(bounding, scale_x, scale_y):
+    for vertex in bounding.vertices:
+        vertex.x = round(vertex.x * scale_x)
+        vertex.y = round(vertex.y * scale_y)
+
+
+def scale_response(response, scale_x, scale_y):
+    """Map an AnnotateImageResponse computed on a downscaled image back onto the original pixel grid."""
+    if scale_x == 1 and scale_y == 1:
+        return response
+    for annotation in response.text_annotations:
+        _scale_vertices(annotation.bounding_poly, scale_x, scale_y)
+    for page in response.full_text_annotation.pages:
+        page.width = round(page.width * scale_x)
+        page.height = round(page.height * scale_y)
+        for block in page.blocks:
+            _scale_vertices(block.bounding_box, scale_x, scale_y)
+            for paragraph in block.paragraphs:
+                _scale_vertices(paragraph.bounding_box, scale_x, scale_y)
+                for word in paragraph.words:
+                    _scale_vertices(word.bounding_box, scale_x, scale_y)
+                    for symbol in word.symbols:
+                        _scale_vertices(symbol.bounding_box, scale_x, scale_y)
+    return response
+
+
+_batcher = None
+_batcher_pid = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    global _batcher, _batcher_pid
+    with _batcher_lock:
+        if _batcher is None or _batcher_pid != os.getpid():
+            _batcher = OCRBatcher(max_wait=getattr(settings, 'INVOICE_OCR_BATCH_WAIT_MS', 50) / 1000)
+            _batcher_pid = os.getpid()
+        return _batcher
+
+
+def annotate(content):
+    """OCR one page image through the shared per-process batcher."""
+    return get_batcher().annotate(content)
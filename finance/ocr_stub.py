@@ -0,0 +1,121 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+from .ocr import MAX_IMAGES_PER_REQUEST
+from .replay import fixture_key
+
+# A local stand-in for the Vision REST API (POST /v1/images:annotate) so the
+# OCR batching can be exercised without credentials. Point the app at it with
+# INVOICE_OCR_ENDPOINT=http://127.0.0.1:<port>. GET /stats reports how many
+# requests and images it has served.
+
+
+class StubVisionServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fixtures_dir=None, latency=0.0):
+        super().__init__(address, StubVisionHandler)
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+        self.requests_served = 0
+        self.images_served = 0
+        self._stats_lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, image_count):
+        with self._stats_lock:
+            self.requests_served += 1
+            self.images_served += image_count
+
+    def stats(self):
+        with self._stats_lock:
+            return {'requests': self.requests_served, 'images': self.images_served}
+
+    def annotate(self, content):
+        """Recorded Vision response for these bytes if one exists, otherwise a synthetic single-word page."""
+        if self.fixtures_dir:
+            fixture_path = os.path.join(self.fixtures_dir, 'vision', f"{fixture_key('vision', content)}.json")
+            if os.path.exists(fixture_path):
+                with open(fixture_path, 'r', encoding='utf-8') as fp:
+                    return json.loads(json.load(fp)['response'])
+        try:
+            with Image.open(io.BytesIO(content)) as img:
+                width, height = img.size
+        except Exception:
+            return {'error': {'code': 3, 'message': 'Bad image data.'}}
+        return _synthetic_page(width, height, f"STUB-{hashlib.sha256(content).hexdigest()[:8]}")
+
+
+class StubVisionHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        if self.path.split('?')[0] != '/v1/images:annotate':
+            return self._json(404, {'error': {'code': 404, 'message': f"Unknown path {self.path}", 'status': 'NOT_FOUND'}})
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        requests = body.get('requests', [])
+        if len(requests) > MAX_IMAGES_PER_REQUEST:
+            return self._json(400, {'error': {
+                'code': 400,
+                'message': f"At most {MAX_IMAGES_PER_REQUEST} images allowed per request, got {len(requests)}.",
+                'status': 'INVALID_ARGUMENT',
+            }})
+
+        responses = [self.server.annotate(base64.b64decode(r.get('image', {}).get('content', ''))) for r in requests]
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.server.record(len(requests))
+        self._json(200, {'responses': responses})
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/stats':
+            return self._json(404, {'error': {'code': 404, 'message': f"Unknown path {self.path}", 'status': 'NOT_FOUND'}})
+        self._json(200, self.server.stats())
+
+    def _json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _synthetic_page(width, height, text):
+    box = {'vertices': [
+        {'x': 10, 'y': 10}, {'x': min(width, 10 + 12 * len(text)), 'y': 10},
+        {'x': min(width, 10 + 12 * len(text)), 'y': min(height, 30)}, {'x': 10, 'y': min(height, 30)},
+    ]}
+    word = {'boundingBox': box, 'symbols': [{'text': ch} for ch in text]}
+    return {
+        'textAnnotations': [{'description': text, 'boundingPoly': box}],
+        'fullTextAnnotation': {
+            'text': text,
+            'pages': [{
+                'width': width,
+                'height': height,
+                'blocks': [{'boundingBox': box, 'paragraphs': [{'boundingBox': box, 'words': [word]}]}],
+            }],
+        },
+    }
+
+
+def start_stub_server(host='127.0.0.1', port=0, fixtures_dir=None, latency=0.0):
+    """Start the stub on a background thread (port 0 picks a free one); call .shutdown() when done."""
+    server = StubVisionServer((host, port), fixtures_dir=fixtures_dir, latency=latency)
+    threading.Thread(target=server.serve_forever, name='ocr-stub', daemon=True).start()
+    return server
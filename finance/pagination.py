@@ -0,0 +1,180 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import F, Q
+
+# Keyset ("seek") pagination for the list views. A page is read with
+#     WHERE (sort key, id) after the cursor ORDER BY sort key, id LIMIT n + 1
+# so every page costs the same whatever its position, unlike OFFSET, and rows
+# inserted while someone pages through a list do not shift it.
+#
+# The sort key is the queryset's ordering (its order_by(), else the model's
+# Meta.ordering) with the primary key appended as a tie-breaker. Cursors are
+# the sort values of the first/last row on the page, base64-encoded into the
+# "after"/"before" query parameters; every other parameter (search, filters)
+# is carried over unchanged to the next/previous links.
+#
+# NULLs sort first ascending and last descending, on every database, so a
+# reversed ordering is exactly the reverse row order ("before" pages).
+
+AFTER, BEFORE = 'after', 'before'
+
+
+def _encode(values):
+    raw = json.dumps([None if value is None else str(value) for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _decode(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def page_query(query, name, cursor):
+    """Query string ("?...") for the page "after"/"before" `cursor`, keeping every other parameter of `query`."""
+    params = query.copy()
+    params.pop(AFTER, None)
+    params.pop(BEFORE, None)
+    params[name] = cursor
+    return f"?{params.urlencode()}"
+
+
+class KeysetPage:
+    """
+    One page of a list view.
+
+    Attributes:
+        object_list: the rows of this page, in display order.
+        has_next / has_previous: whether there is anything after/before it.
+        next_query / previous_query: query strings ("?...") for the neighbouring pages.
+    """
+
+    def __init__(self, object_list, has_next, has_previous, next_query, previous_query):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_query = next_query
+        self.previous_query = previous_query
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+class KeysetPaginator:
+    """Pages through `queryset` by its ordering plus the primary key."""
+
+    def __init__(self, queryset, ordering=None, per_page=None):
+        self.queryset = queryset
+        self.per_page = per_page or settings.LIST_PAGE_SIZE
+        ordering = ordering or [
+            term for term in (queryset.query.order_by or queryset.model._meta.ordering) if isinstance(term, str)
+        ]
+        self.keys = []  # (attribute, field, descending) per sort column
+        for term in ordering:
+            descending = term.startswith('-')
+            name = term.lstrip('-')
+            if name in ('pk', queryset.model._meta.pk.name):
+                break
+            self.keys.append((*self._resolve(name), descending))
+        pk = queryset.model._meta.pk
+        self.keys.append((pk.attname, pk, self.keys[0][2] if self.keys else True))
+
+    def _resolve(self, name):
+        """Column attribute and field for a sort term; foreign keys sort by their id."""
+        if name in self.queryset.query.annotations:
+            return name, self.queryset.query.annotations[name].output_field
+        try:
+            field = self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise ValueError(f"cannot page {self.queryset.model.__name__} by '{name}'")
+        if not field.concrete or field.many_to_many:
+            raise ValueError(f"cannot page {self.queryset.model.__name__} by '{name}'")
+        return field.attname, field
+
+    def _ordering(self, reverse):
+        terms = []
+        for attribute, field, descending in self.keys:
+            if descending != reverse:
+                terms.append(F(attribute).desc(nulls_last=True) if field.null else F(attribute).desc())
+            else:
+                terms.append(F(attribute).asc(nulls_first=True) if field.null else F(attribute).asc())
+        return terms
+
+    def _past(self, values, reverse):
+        """Rows strictly past `values` in the (possibly reversed) sort order."""
+        condition = Q(pk__in=[])
+        equal = Q()
+        for (attribute, field, descending), value in zip(self.keys, values):
+            descending = descending != reverse
+            if value is None:
+                beyond = Q() if descending else Q(**{f"{attribute}__isnull": False})
+                if not descending:
+                    condition |= equal & beyond
+                equal &= Q(**{f"{attribute}__isnull": True})
+                continue
+            beyond = Q(**{f"{attribute}__{'lt' if descending else 'gt'}": value})
+            if field.null and descending:
+                beyond |= Q(**{f"{attribute}__isnull": True})
+            condition |= equal & beyond
+            equal &= Q(**{attribute: value})
+        # Lets the database seek on an index over the leading column instead of testing every row
+        attribute, field, descending = self.keys[0]
+        if values[0] is not None and not field.null:
+            condition &= Q(**{f"{attribute}__{'lte' if descending != reverse else 'gte'}": values[0]})
+        return condition
+
+    def _values(self, cursor):
+        values = _decode(cursor) if cursor else None
+        if values is None or len(values) != len(self.keys):
+            return None
+        try:
+            return [None if value is None else field.to_python(value)
+                    for (_, field, _), value in zip(self.keys, values)]
+        except ValidationError:
+            return None
+
+    def _cursor(self, row):
+        return _encode(getattr(row, attribute) for attribute, _, _ in self.keys)
+
+    def page(self, query):
+        """The page named by the "after"/"before" cursor in `query` (request.GET); the first page without one."""
+        after, before = self._values(query.get(AFTER)), self._values(query.get(BEFORE))
+        reverse = before is not None and after is None
+        cursor = before if reverse else after
+        rows = self.queryset.order_by(*self._ordering(reverse))
+        if cursor is not None:
+            rows = rows.filter(self._past(cursor, reverse))
+        rows = list(rows[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = True, more
+        else:
+            has_next, has_previous = more, cursor is not None
+
+        return KeysetPage(
+            rows,
+            has_next,
+            has_previous,
+            page_query(query, AFTER, self._cursor(rows[-1])) if has_next and rows else None,
+            page_query(query, BEFORE, self._cursor(rows[0])) if has_previous and rows else None,
+        )
+
+
+def paginate(request, queryset, ordering=None, per_page=None):
+    """The requested page of `queryset` (see KeysetPaginator); ordering defaults to the queryset's."""
+    return KeysetPaginator(queryset, ordering, per_page).page(request.GET)
@@ -0,0 +1,180 @@
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import FiscalYear, JournalEntry, OpeningBalance
+from .money import MinorSum, minor
+
+# Fiscal years are closed in order with close_fiscal_year(). Closing freezes
+# every journal line dated up to the year's end (JournalEntry refuses to change
+# them) and writes each account's cumulative debit and credit totals as opening
+# balances of the following year, which is created if it does not exist yet.
+#
+# Balances are then read as those opening rows plus the lines of the open years
+# only (account_totals, type_totals), so report queries are bounded by the open
+# period instead of growing with every year of history in the journal table.
+#
+# Totals are added up in integer minor units (finance.money) and turned into
+# Decimals once per account or type at the end.
+
+AMOUNT = JournalEntry._meta.get_field('debit_amount')
+
+
+def year_bounds(day):
+    """First and last day of the fiscal year containing `day` (FISCAL_YEAR_START_MONTH)."""
+    month = settings.FISCAL_YEAR_START_MONTH
+    start = date(day.year if day.month >= month else day.year - 1, month, 1)
+    end = date(start.year + 1, month, 1) - timedelta(days=1)
+    return start, end
+
+
+def year_name(start, end):
+    return str(start.year) if start.year == end.year else f"{start.year}-{end.year}"
+
+
+def fiscal_year_for(day):
+    """The FiscalYear containing `day`, created from FISCAL_YEAR_START_MONTH if missing."""
+    year = FiscalYear.objects.filter(start_date__lte=day, end_date__gte=day).first()
+    if year:
+        return year
+    start, end = year_bounds(day)
+    # Shrink around neighbours that were set up with other boundaries
+    previous = FiscalYear.objects.filter(end_date__lt=day, end_date__gte=start).order_by('-end_date').first()
+    following = FiscalYear.objects.filter(start_date__gt=day, start_date__lte=end).order_by('start_date').first()
+    if previous:
+        start = previous.end_date + timedelta(days=1)
+    if following:
+        end = following.start_date - timedelta(days=1)
+    year, _ = FiscalYear.objects.get_or_create(
+        start_date=start, defaults={'name': year_name(start, end), 'end_date': end}
+    )
+    return year
+
+
+def open_period():
+    """
+    Where open-period figures start.
+
+    Returns:
+        tuple: (first day after the books are closed, or None if nothing is closed;
+                the FiscalYear holding the opening balances, or None)
+    """
+    closed_through = FiscalYear.closed_through()
+    if closed_through is None:
+        return None, None
+    since = closed_through + timedelta(days=1)
+    return since, FiscalYear.objects.filter(start_date__gte=since).order_by('start_date').first()
+
+
+def _add(totals, key, debit, credit):
+    current = totals[key]
+    totals[key] = (current[0] + (debit or 0), current[1] + (credit or 0))
+
+
+def _amounts(totals):
+    """{key: (debit units, credit units)} -> {key: (debit, credit)} as Decimals."""
+    return {key: (AMOUNT.from_minor(debit), AMOUNT.from_minor(credit)) for key, (debit, credit) in totals.items()}
+
+
+def _sums(rows, key):
+    return rows.values(key).annotate(debit=MinorSum('debit_amount'), credit=MinorSum('credit_amount')).order_by()
+
+
+def account_totals(account_type=None, account_ids=None, minor_units=False):
+    """
+    Cumulative debit and credit per account: opening balances plus open-period lines.
+
+    Returns:
+        dict: {account_id: (debit, credit)} as Decimals, or as integer minor units with
+              `minor_units`; accounts without activity are missing.
+    """
+    since, opening_year = open_period()
+    totals = defaultdict(lambda: (0, 0))
+    if opening_year:
+        openings = OpeningBalance.objects.filter(fiscal_year=opening_year)
+        if account_type:
+            openings = openings.filter(account__account_type=account_type)
+        if account_ids is not None:
+            openings = openings.filter(account_id__in=account_ids)
+        for account_id, debit, credit in openings.values_list(
+            'account_id', minor('debit_amount'), minor('credit_amount')
+        ):
+            _add(totals, account_id, debit, credit)
+    lines = JournalEntry.objects.all()
+    if since:
+        lines = lines.filter(date__gte=since)
+    if account_type:
+        lines = lines.filter(account_type=account_type)
+    if account_ids is not None:
+        lines = lines.filter(account_id__in=account_ids)
+    for row in _sums(lines, 'account_id'):
+        _add(totals, row['account_id'], row['debit'], row['credit'])
+    return dict(totals) if minor_units else _amounts(totals)
+
+
+def type_totals():
+    """
+    Cumulative debit and credit per account type: opening balances plus open-period lines.
+
+    Returns:
+        dict: {account_type: (debit, credit)}; types without activity are missing.
+    """
+    since, opening_year = open_period()
+    totals = defaultdict(lambda: (0, 0))
+    if opening_year:
+        for row in _sums(OpeningBalance.objects.filter(fiscal_year=opening_year), 'account__account_type'):
+            _add(totals, row['account__account_type'], row['debit'], row['credit'])
+    lines = JournalEntry.objects.all()
+    if since:
+        lines = lines.filter(date__gte=since)
+    for row in _sums(lines, 'account_type'):
+        _add(totals, row['account_type'], row['debit'], row['credit'])
+    return _amounts(totals)
+
+
+def close_fiscal_year(fiscal_year, user=None):
+    """
+    Close a fiscal year and write the next year's opening balances.
+
+    Returns:
+        FiscalYear: the following year, which now holds the opening balances.
+
+    Raises:
+        ValueError: if the year is already closed or an earlier year is still open.
+    """
+    with transaction.atomic():
+        year = FiscalYear.objects.select_for_update().get(pk=fiscal_year.pk)
+        if year.is_closed:
+            raise ValueError(f"{year} is already closed")
+        earlier = FiscalYear.objects.filter(is_closed=False, start_date__lt=year.start_date).first()
+        if earlier:
+            raise ValueError(f"Close {earlier} before {year}")
+
+        since, opening_year = open_period()
+        totals = defaultdict(lambda: (0, 0))
+        if opening_year:
+            for account_id, debit, credit in opening_year.opening_balances.values_list(
+                'account_id', minor('debit_amount'), minor('credit_amount')
+            ):
+                _add(totals, account_id, debit, credit)
+        lines = JournalEntry.objects.filter(date__lte=year.end_date)
+        if since:
+            lines = lines.filter(date__gte=since)
+        for row in _sums(lines, 'account_id'):
+            _add(totals, row['account_id'], row['debit'], row['credit'])
+
+        following = fiscal_year_for(year.end_date + timedelta(days=1))
+        following.opening_balances.all().delete()
+        OpeningBalance.objects.bulk_create(
+            OpeningBalance(fiscal_year=following, account_id=account_id, debit_amount=debit, credit_amount=credit)
+            for account_id, (debit, credit) in _amounts(totals).items()
+        )
+        year.is_closed = True
+        year.closed_at = timezone.now()
+        year.closed_by = user
+        year.save(update_fields=['is_closed', 'closed_at', 'closed_by'])
+    print(f"Closed fiscal year {year}: {len(totals)} opening balance(s) written to {following}")
+    return following
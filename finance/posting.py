@@ -0,0 +1,224 @@
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Account, Company, FiscalYear, JournalEntry
+from .sequences import assign_entry_numbers
+
+# Bulk posting of journal lines grouped into vouchers (a payroll run, a bank
+# batch). Everything is validated first, with one query for the accounts, one
+# for the companies and one for the closed-period date, so a rejected batch
+# writes nothing. Entry numbers are
+# then reserved in one update per company and the lines are inserted with
+# bulk_create in chunks, all in a single transaction. That transaction checks
+# the closed-period date again while holding off close_fiscal_year
+# (FiscalYear.hold_open), as a year may be closed after validation.
+#
+# A voucher is a dict:
+#     {"voucher": "PAY-2025-03", "date": "2025-03-31", "company": 1,
+#      "description": "March payroll",
+#      "lines": [{"account": 12, "debit": "1500.00", "description": "..."},
+#                {"account_number": "2100", "credit": "1500.00"}]}
+# "voucher", "company" and the descriptions are optional; a voucher without a
+# reference is labelled with the entry number of its first line.
+
+MAX_REPORTED_ERRORS = 1000
+CENT = Decimal('0.01')
+MAX_AMOUNT = Decimal('9999999999999.99')  # max_digits=15, decimal_places=2
+
+
+class PostingError(Exception):
+    """A batch failed validation; `errors` lists {"voucher", "line", "error"} dicts and nothing was written."""
+
+    def __init__(self, errors, total=None):
+        self.errors = errors
+        self.total = total if total is not None else len(errors)
+        super().__init__(f"{self.total} problem(s) in the batch, e.g. {errors[0]['error'] if errors else ''}")
+
+
+def _amount(value):
+    if value in (None, ''):
+        return Decimal('0.00')
+    try:
+        amount = Decimal(str(value).replace(',', ''))
+    except InvalidOperation:
+        raise ValueError(f"'{value}' is not an amount")
+    if not amount.is_finite() or amount < 0 or amount > MAX_AMOUNT:
+        raise ValueError(f"amount {value} must be between 0 and {MAX_AMOUNT}")
+    if amount != amount.quantize(CENT):
+        raise ValueError(f"amount {value} has more than 2 decimal places")
+    return amount.quantize(CENT)
+
+
+def _prefetch_accounts(vouchers):
+    """All referenced accounts in one query: by id, and by (company, account number)."""
+    ids, numbers = set(), set()
+    for voucher in vouchers:
+        for line in voucher.get('lines') or []:
+            if not isinstance(line, dict):
+                continue
+            if isinstance(line.get('account'), int):
+                ids.add(line['account'])
+            elif line.get('account_number'):
+                numbers.add(str(line['account_number']))
+    accounts = Account.objects.filter(Q(pk__in=ids) | Q(account_number__in=numbers)).only(
+        'id', 'name', 'account_number', 'account_type', 'company_id', 'is_disabled', 'is_group'
+    )
+    by_id, by_number = {}, {}
+    for account in accounts:
+        by_id[account.pk] = account
+        if account.account_number:
+            by_number.setdefault(account.account_number, []).append(account)
+    return by_id, by_number
+
+
+def _resolve_account(line, company_id, by_id, by_number):
+    if 'account' in line:
+        account = by_id.get(line['account']) if isinstance(line['account'], int) else None
+        if account is None:
+            raise ValueError(f"account {line['account']!r} does not exist")
+    elif line.get('account_number'):
+        candidates = by_number.get(str(line['account_number']), [])
+        if company_id is not None:
+            candidates = [account for account in candidates if account.company_id == company_id]
+        if not candidates:
+            raise ValueError(f"account number {line['account_number']} does not exist")
+        if len(candidates) > 1:
+            raise ValueError(f"account number {line['account_number']} exists in several companies; give the voucher a company")
+        account = candidates[0]
+    else:
+        raise ValueError("line needs an account (id) or account_number")
+    if account.is_disabled:
+        raise ValueError(f"account {account.name} is disabled")
+    if account.is_group:
+        raise ValueError(f"account {account.name} is a group account and cannot be posted to")
+    if company_id is not None and account.company_id != company_id:
+        raise ValueError(f"account {account.name} belongs to another company")
+    return account
+
+
+def build_entries(vouchers, user=None):
+    """
+    Validate vouchers and turn them into unsaved JournalEntry lines.
+
+    Returns:
+        list[list[JournalEntry]]: the lines of each voucher, in order.
+
+    Raises:
+        PostingError: with every problem found (up to MAX_REPORTED_ERRORS).
+    """
+    vouchers = list(vouchers)
+    errors = []
+    error_count = 0
+
+    def fail(voucher_label, line_number, message):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({'voucher': voucher_label, 'line': line_number, 'error': message})
+
+    by_id, by_number = _prefetch_accounts(vouchers)
+    company_ids = {v.get('company') for v in vouchers if isinstance(v, dict) and v.get('company') is not None}
+    closed_through = FiscalYear.closed_through()
+    companies = set(Company.objects.filter(pk__in=[c for c in company_ids if isinstance(c, int)]).values_list('pk', flat=True))
+
+    grouped = []
+    for index, voucher in enumerate(vouchers, start=1):
+        if not isinstance(voucher, dict):
+            fail(f"#{index}", None, "voucher must be an object")
+            continue
+        label = str(voucher.get('voucher') or f"#{index}")
+        reference = str(voucher.get('voucher') or '')[:50]
+        company_id = voucher.get('company')
+        if company_id is not None and company_id not in companies:
+            fail(label, None, f"company {company_id!r} does not exist")
+            continue
+        try:
+            posting_date = date.fromisoformat(str(voucher.get('date')))
+        except ValueError:
+            fail(label, None, f"date {voucher.get('date')!r} is not YYYY-MM-DD")
+            continue
+        if closed_through and posting_date <= closed_through:
+            fail(label, None, f"the books are closed through {closed_through}")
+            continue
+        lines = voucher.get('lines')
+        if not isinstance(lines, list) or len(lines) < 2:
+            fail(label, None, "a voucher needs at least two lines")
+            continue
+
+        entries = []
+        total_debit = total_credit = Decimal('0.00')
+        for line_number, line in enumerate(lines, start=1):
+            try:
+                if not isinstance(line, dict):
+                    raise ValueError("line must be an object")
+                account = _resolve_account(line, company_id, by_id, by_number)
+                debit, credit = _amount(line.get('debit')), _amount(line.get('credit'))
+                if (debit > 0) == (credit > 0):
+                    raise ValueError("line needs either a debit or a credit amount")
+            except ValueError as e:
+                fail(label, line_number, str(e))
+                continue
+            total_debit += debit
+            total_credit += credit
+            entries.append(JournalEntry(
+                date=posting_date,
+                account_id=account.pk,
+                debit_amount=debit,
+                credit_amount=credit,
+                description=str(line.get('description') or voucher.get('description') or ''),
+                company_id=account.company_id,
+                account_type=account.account_type,
+                voucher=reference,
+                created_by=user,
+            ))
+        if len(entries) == len(lines) and total_debit != total_credit:
+            fail(label, None, f"voucher does not balance: debit {total_debit} vs credit {total_credit}")
+        grouped.append(entries)
+
+    if error_count:
+        raise PostingError(errors, error_count)
+    return grouped
+
+
+def post_vouchers(vouchers, user=None, chunk_size=2000):
+    """
+    Validate and post vouchers of journal lines in one transaction.
+
+    Returns:
+        dict: {"vouchers": int, "lines": int, "first_entry_number": str, "last_entry_number": str}
+
+    Raises:
+        PostingError: if anything is invalid; nothing is written then.
+    """
+    grouped = build_entries(vouchers, user)
+    entries = [entry for voucher_entries in grouped for entry in voucher_entries]
+    if not entries:
+        return {"vouchers": 0, "lines": 0, "first_entry_number": None, "last_entry_number": None}
+    with transaction.atomic():
+        # A year may have been closed since build_entries() checked
+        FiscalYear.hold_open({entry.date for entry in entries})
+        closed_through = FiscalYear.closed_through()
+        if closed_through:
+            errors = [
+                {'voucher': voucher_entries[0].voucher or f"#{index}", 'line': None,
+                 'error': f"the books are closed through {closed_through}"}
+                for index, voucher_entries in enumerate(grouped, start=1)
+                if voucher_entries[0].date <= closed_through
+            ]
+            if errors:
+                raise PostingError(errors[:MAX_REPORTED_ERRORS], len(errors))
+        assign_entry_numbers(entries)
+        for voucher_entries in grouped:
+            if not voucher_entries[0].voucher:
+                for entry in voucher_entries:
+                    entry.voucher = voucher_entries[0].entry_number
+        JournalEntry.objects.bulk_create(entries, batch_size=chunk_size)
+    return {
+        "vouchers": len(grouped),
+        "lines": len(entries),
+        "first_entry_number": entries[0].entry_number,
+        "last_entry_number": entries[-1].entry_number,
+    }
@@ -0,0 +1,59 @@
+import hashlib
+import re
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+
+from . import imaging
+
+# First-page WebP thumbnails, made once at ingestion so list pages never have
+# to fetch a source document (which only lives behind expiring GCS URLs).
+# Previews are stored under the SHA-256 of their own bytes, so a key never
+# changes meaning: identical previews share one file and the serving view can
+# let browsers cache them indefinitely. The storage is the
+# "invoice_previews" entry of STORAGES, so it can move to object storage by
+# configuration alone.
+
+KEY_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _storage():
+    return storages['invoice_previews']
+
+
+def storage_name(key):
+    return f"{key[:2]}/{key}.webp"
+
+
+def is_key(key):
+    return bool(KEY_PATTERN.match(key or ''))
+
+
+def store_preview(source_path):
+    """
+    Render and store the preview of a source document (PDF or image).
+
+    Returns:
+        str: the preview key, or '' if no preview could be made.
+    """
+    try:
+        with open(source_path, 'rb') as fp:
+            data = imaging.render_preview(
+                fp.read(), max_side=settings.INVOICE_PREVIEW_MAX_SIDE, quality=settings.INVOICE_PREVIEW_QUALITY
+            )
+        if not data:
+            return ''
+        key = hashlib.sha256(data).hexdigest()
+        storage = _storage()
+        if not storage.exists(storage_name(key)):
+            storage.save(storage_name(key), ContentFile(data))
+        return key
+    except Exception as e:
+        print(f"Preview generation failed for {source_path}: {e}")
+        return ''
+
+
+def open_preview(key):
+    """Readable file for a stored preview; raises FileNotFoundError if missing."""
+    return _storage().open(storage_name(key), 'rb')
@@ -0,0 +1,280 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import openai
+from django.conf import settings
+from google.api_core import exceptions as google_exceptions
+
+try:
+    import fcntl
+except ImportError:  # Windows: budgets are only shared between threads
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Outbound calls to OpenAI / Vision / GCS go through one limiter per service:
+#  - a token bucket (requests/minute and tokens/minute) whose state lives in a
+#    small file under INVOICE_RATE_LIMIT_DIR, locked with flock, so every
+#    thread and worker process on the host draws from the same budget;
+#  - an adaptive in-process concurrency cap that halves on 429s, shrinks when
+#    latency passes its target and creeps back up on healthy responses;
+#  - retries with full-jitter exponential backoff, honouring Retry-After.
+#    The SDK calls run with their own retries turned off, so this is the
+#    only retry loop and every attempt is counted against the budget.
+
+RATE_LIMITED_ERRORS = (
+    openai.RateLimitError,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+)
+TRANSIENT_ERRORS = (
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    ConnectionError,
+    TimeoutError,
+)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class _SharedBucket:
+    """Requests and tokens per minute, refilled continuously; state is shared through a locked file."""
+
+    def __init__(self, service, requests_per_minute, tokens_per_minute, state_dir):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.state_path = os.path.join(state_dir, f"{service}.bucket")
+        self._lock = threading.Lock()
+        os.makedirs(state_dir, exist_ok=True)
+
+    @contextmanager
+    def _state(self):
+        with self._lock, open(self.state_path, 'a+', encoding='utf-8') as fp:
+            if fcntl:
+                fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                fp.seek(0)
+                try:
+                    state = json.loads(fp.read() or '{}')
+                except ValueError:
+                    state = {}
+                now = time.time()
+                elapsed = max(0.0, now - state.get('updated', now))
+                state['requests'] = self._refill(state.get('requests'), self.requests_per_minute, elapsed)
+                state['tokens'] = self._refill(state.get('tokens'), self.tokens_per_minute, elapsed)
+                state['updated'] = now
+                yield state
+                fp.seek(0)
+                fp.truncate()
+                fp.write(json.dumps(state))
+                fp.flush()
+            finally:
+                if fcntl:
+                    fcntl.flock(fp, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _refill(level, per_minute, elapsed):
+        if not per_minute:
+            return None
+        if level is None:
+            return float(per_minute)
+        return min(float(per_minute), level + elapsed * per_minute / 60)
+
+    def try_take(self, tokens):
+        """Take one request and `tokens` from the budget; returns 0, or how many seconds to wait first."""
+        with self._state() as state:
+            if self.tokens_per_minute:
+                tokens = min(tokens, self.tokens_per_minute)
+            waits = []
+            if self.requests_per_minute and state['requests'] < 1:
+                waits.append((1 - state['requests']) * 60 / self.requests_per_minute)
+            if self.tokens_per_minute and state['tokens'] < tokens:
+                waits.append((tokens - state['tokens']) * 60 / self.tokens_per_minute)
+            if waits:
+                return max(waits)
+            if self.requests_per_minute:
+                state['requests'] -= 1
+            if self.tokens_per_minute:
+                state['tokens'] -= tokens
+            return 0
+
+    def adjust_tokens(self, delta):
+        """Settle the difference between estimated and actual token usage (may leave the bucket negative)."""
+        if not self.tokens_per_minute or not delta:
+            return
+        with self._state() as state:
+            state['tokens'] -= delta
+
+
+class _AdaptiveConcurrency:
+    """AIMD cap on calls in flight from this process."""
+
+    def __init__(self, max_concurrency, latency_target=None):
+        self.max_concurrency = max_concurrency
+        self.latency_target = latency_target
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            self.waiting += 1
+            while self.in_flight >= max(1, int(self.limit)):
+                self._cond.wait()
+            self.waiting -= 1
+            self.in_flight += 1
+
+    def release(self, latency, throttled):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1.0, self.limit / 2)
+            elif self.latency_target and latency > self.latency_target:
+                self.limit = max(1.0, self.limit * 0.9)
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class ServiceLimiter:
+
+    def __init__(self, service, requests_per_minute=None, tokens_per_minute=None, max_concurrency=8,
+                 latency_target=None, max_retries=5, backoff_base=1.0, backoff_cap=60.0, state_dir=None):
+        self.service = service
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.bucket = _SharedBucket(service, requests_per_minute, tokens_per_minute, state_dir)
+        self.concurrency = _AdaptiveConcurrency(max_concurrency, latency_target)
+        self._stats_lock = threading.Lock()
+        self._budget_waiting = 0
+        self._stats = {'calls': 0, 'errors': 0, 'retries': 0, 'rate_limited': 0,
+                       'throttle_seconds': 0.0, 'latency_seconds': 0.0}
+
+    def call(self, fn, tokens=1, usage=None):
+        """
+        Run `fn` within this service's budgets, retrying rate-limited and transient failures.
+
+        Args:
+            fn (callable): Performs the external call.
+            tokens (int): Estimated budget units the call consumes (LLM tokens, images).
+            usage (callable): Optional; returns the actual units from fn's result so the
+                shared bucket can be settled.
+        """
+        attempt = 0
+        while True:
+            self._wait_for_budget(tokens)
+            self.concurrency.acquire()
+            started = time.perf_counter()
+            error = None
+            try:
+                result = fn()
+            except Exception as e:
+                error = e
+            latency = time.perf_counter() - started
+            throttled = isinstance(error, RATE_LIMITED_ERRORS)
+            self.concurrency.release(latency, throttled)
+            self._count(latency_seconds=latency, rate_limited=int(throttled))
+
+            if error is None:
+                self._count(calls=1)
+                if usage:
+                    actual = usage(result)
+                    if actual is not None:
+                        self.bucket.adjust_tokens(actual - tokens)
+                return result
+
+            if attempt >= self.max_retries or not (throttled or isinstance(error, TRANSIENT_ERRORS)):
+                self._count(errors=1)
+                raise error
+
+            delay = _retry_after(error) or random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+            attempt += 1
+            self._count(retries=1, throttle_seconds=delay)
+            logger.debug(
+                "%s: %s, retry %d/%d in %.1fs", self.service, type(error).__name__, attempt, self.max_retries, delay
+            )
+            time.sleep(delay)
+
+    def _wait_for_budget(self, tokens):
+        with self._stats_lock:
+            self._budget_waiting += 1
+        try:
+            while True:
+                wait = self.bucket.try_take(tokens)
+                if not wait:
+                    return
+                # Jitter keeps processes that ran dry together from waking in lockstep
+                wait *= random.uniform(1.0, 1.2)
+                self._count(throttle_seconds=wait)
+                time.sleep(wait)
+        finally:
+            with self._stats_lock:
+                self._budget_waiting -= 1
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for key, value in deltas.items():
+                self._stats[key] += value
+
+    def metrics(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+            budget_waiting = self._budget_waiting
+        attempts = stats['calls'] + stats['errors'] + stats['retries']
+        return {
+            'queue_depth': budget_waiting + self.concurrency.waiting,
+            'in_flight': self.concurrency.in_flight,
+            'concurrency_limit': round(self.concurrency.limit, 2),
+            'calls': stats['calls'],
+            'errors': stats['errors'],
+            'retries': stats['retries'],
+            'rate_limited': stats['rate_limited'],
+            'throttle_seconds': round(stats['throttle_seconds'], 3),
+            'mean_latency_ms': round(stats['latency_seconds'] / attempts * 1000, 2) if attempts else None,
+        }
+
+
+def _retry_after(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        return min(float(headers.get('retry-after')), 300.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_limiter(service):
+    """The process-wide limiter for a service configured in INVOICE_RATE_LIMITS."""
+    with _limiters_lock:
+        limiter = _limiters.get(service)
+        if limiter is None:
+            config = getattr(settings, 'INVOICE_RATE_LIMITS', {}).get(service, {})
+            limiter = ServiceLimiter(service, state_dir=settings.INVOICE_RATE_LIMIT_DIR, **config)
+            _limiters[service] = limiter
+        return limiter
+
+
+def call(service, fn, tokens=1, usage=None):
+    return get_limiter(service).call(fn, tokens=tokens, usage=usage)
+
+
+def metrics():
+    """{service: {...}} for every limiter used by this process."""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {service: limiter.metrics() for service, limiter in sorted(limiters.items())}
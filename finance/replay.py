@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+REPLAY_MODES = ('live', 'record', 'replay')
+
+_config = {
+    'mode': getattr(settings, 'INVOICE_REPLAY_MODE', 'live'),
+    'fixtures_dir': getattr(settings, 'INVOICE_REPLAY_DIR', os.path.join('invoices', 'fixtures')),
+}
+_timings_lock = threading.Lock()
+_stage_timings = defaultdict(list)
+_observations = defaultdict(list)
+
+
+class ReplayMiss(Exception):
+    """Raised in replay mode when no fixture was recorded for a request."""
+
+
+def configure(mode=None, fixtures_dir=None):
+    """Switch between live calls, recording fixtures and replaying them."""
+    if mode is not None:
+        if mode not in REPLAY_MODES:
+            raise ValueError(f"Unknown replay mode: {mode}")
+        _config['mode'] = mode
+    if fixtures_dir is not None:
+        _config['fixtures_dir'] = str(fixtures_dir)
+
+
+def current_mode():
+    return _config['mode']
+
+
+def fixture_key(service, payload):
+    """Stable fixture name for a request: sha256 over the service name and request bytes."""
+    digest = hashlib.sha256(service.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(payload)
+    return digest.hexdigest()
+
+
+def call(service, payload, live_fn, dump=None, load=None):
+    """
+    Run an external call through the recording/replay layer.
+
+    Args:
+        service (str): Fixture namespace, e.g. 'vision', 'openai', 'gcs'.
+        payload (bytes): Request bytes that identify the call.
+        live_fn (callable): Performs the real call and returns its result.
+        dump (callable): Turns the result into something JSON-serializable.
+        load (callable): Rebuilds the result from the stored JSON value.
+
+    Returns:
+        The live result, or the recorded one in replay mode.
+    """
+    mode = _config['mode']
+    if mode == 'live':
+        return live_fn()
+
+    key = fixture_key(service, payload)
+    fixture_path = os.path.join(_config['fixtures_dir'], service, f"{key}.json")
+
+    if mode == 'replay':
+        if not os.path.exists(fixture_path):
+            raise ReplayMiss(f"No {service} fixture recorded for request {key}")
+        with open(fixture_path, 'r', encoding='utf-8') as fp:
+            stored = json.load(fp)
+        return load(stored['response']) if load else stored['response']
+
+    result = live_fn()
+    os.makedirs(os.path.dirname(fixture_path), exist_ok=True)
+    tmp_path = f"{fixture_path}.tmp{threading.get_ident()}"
+    with open(tmp_path, 'w', encoding='utf-8') as fp:
+        json.dump({
+            'service': service,
+            'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'response': dump(result) if dump else result,
+        }, fp, ensure_ascii=False)
+    os.replace(tmp_path, fixture_path)
+    return result
+
+
+@contextmanager
+def stage(name):
+    """Time one pipeline stage; the benchmark command reads the collected timings."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _timings_lock:
+            _stage_timings[name].append(elapsed)
+
+
+def observe(name, value):
+    """Record a non-timing measurement (e.g. token counts) alongside the stage timings."""
+    with _timings_lock:
+        _observations[name].append(value)
+
+
+def reset_stage_timings():
+    with _timings_lock:
+        _stage_timings.clear()
+        _observations.clear()
+
+
+def stage_timings():
+    """Snapshot of {stage name: [seconds, ...]} collected since the last reset."""
+    with _timings_lock:
+        return {name: list(values) for name, values in _stage_timings.items()}
+
+
+def observations():
+    """Snapshot of {name: [value, ...]} recorded with observe() since the last reset."""
+    with _timings_lock:
+        return {name: list(values) for name, values in _observations.items()}
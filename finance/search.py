@@ -0,0 +1,580 @@
+import re
+import sqlite3
+import unicodedata
+
+from django.conf import settings
+from django.db import connection as default_connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from . import pagination
+from .models import Invoice, JournalEntry
+
+# Full-text search over journal entries (entry number, account name,
+# description) and invoices (invoice number, supplier and customer name).
+# The database keeps the index itself, through triggers on the indexed tables
+# and on the names they pull in, so bulk_create, update() and imports stay
+# searchable without any Python hooks:
+#   - SQLite: an FTS5 table per model (rowid = primary key), ranked with bm25;
+#   - PostgreSQL: a tsvector table per model with a GIN index, ranked with ts_rank.
+# Text is folded the same way on both sides: lower case, Arabic-Indic digits to
+# ASCII, Arabic diacritics and tatweel removed, and the alef/yeh/teh marbuta
+# variants merged, so "فاتورة" finds "فاتوره". The triggers fold in plain SQL
+# (finance_fold on PostgreSQL, nested replace() on SQLite, whose FTS5 tokenizer
+# lowers case), so rows written by any client, dbshell included, are indexed.
+# Search words are also NFKC-normalized; on SQLite stored text is not, so
+# Arabic presentation forms only match themselves there. Punctuation splits
+# words on both (finance_words), so "INV-8" is the words "inv" and "8" rather
+# than PostgreSQL's "inv" and "-8". Every search word is a prefix match and all
+# of them must match.
+# Other databases fall back to the old icontains filters.
+#
+# The triggers are dropped around migrations and reinstalled afterwards
+# (finance.triggers); rows written while they were off are caught up then.
+
+ARABIC_MARKS = "".join(map(chr, [*range(0x064B, 0x0660), 0x0670, 0x0640]))  # harakat, superscript alef, tatweel
+ARABIC_VARIANTS, ARABIC_BASES = "أإآٱىة٠١٢٣٤٥٦٧٨٩", "اااايه0123456789"
+ARABIC_MARK = re.compile(f"[{ARABIC_MARKS}]")
+ARABIC_LETTERS = str.maketrans(ARABIC_VARIANTS, ARABIC_BASES)
+FOLD_PAIRS = [(mark, '') for mark in ARABIC_MARKS] + list(zip(ARABIC_VARIANTS, ARABIC_BASES))
+FOLD_DEPTH = 13  # replace() calls nested per subquery
+WORD = re.compile(r"[^\W_]+")
+RANK_CANDIDATES = 10000  # newest matches scored per query; the rest follow the best ones newest first
+TAIL_WINDOW = 10000  # most index entries read at once while paging past the ranked matches
+
+
+def fold(text):
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return ARABIC_MARK.sub("", text).translate(ARABIC_LETTERS)
+
+
+def _folded(select, columns):
+    """
+    SQLite `select` (naming its results id and `columns`) with those columns folded
+    like fold(), without NFKC (the unicode61 tokenizer lowers case itself). The
+    replace() calls are spread over nested subqueries, a few per level, as
+    deeper nesting overflows SQLite's parser stack.
+    """
+    for start in range(0, len(FOLD_PAIRS), FOLD_DEPTH):
+        folded = []
+        for column in columns:
+            expression = column
+            for old, new in FOLD_PAIRS[start:start + FOLD_DEPTH]:
+                expression = f"replace({expression}, '{old}', '{new}')"
+            folded.append(f"{expression} AS {column}")
+        select = f"SELECT id, {', '.join(folded)} FROM ({select})"
+    return select
+
+
+def _folded_value(expression):
+    return f"(SELECT value FROM ({_folded(f'SELECT 0 AS id, {expression} AS value', ['value'])}))"
+
+
+class Index:
+    def __init__(self, model, table, weights, fallback):
+        self.model = model
+        self.table = table
+        self.weights = weights  # per indexed column, in column order
+        self.fallback = fallback  # icontains lookups used where there is no index
+
+
+INDEXES = {
+    JournalEntry: Index(JournalEntry, 'finance_journal_search', (10.0, 5.0, 1.0),
+                        ('entry_number', 'account__name', 'description')),
+    Invoice: Index(Invoice, 'finance_invoice_search', (10.0, 5.0, 5.0),
+                   ('invoice_number', 'supplier__name', 'customer__name')),
+}
+
+SQLITE_TABLES = """
+CREATE VIRTUAL TABLE IF NOT EXISTS finance_journal_search
+    USING fts5(entry_number, account_name, description, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3');
+CREATE VIRTUAL TABLE IF NOT EXISTS finance_invoice_search
+    USING fts5(invoice_number, supplier_name, customer_name, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3');
+"""
+
+JOURNAL_COLUMNS = ['entry_number', 'account_name', 'description']
+INVOICE_COLUMNS = ['invoice_number', 'supplier_name', 'customer_name']
+SQLITE_JOURNAL_ROW = _folded(
+    "SELECT new.id AS id, new.entry_number AS entry_number, a.name AS account_name, new.description AS description "
+    "FROM finance_account a WHERE a.id = new.account_id",
+    JOURNAL_COLUMNS,
+)
+SQLITE_INVOICE_ROW = _folded(
+    "SELECT new.id AS id, new.invoice_number AS invoice_number, "
+    "(SELECT name FROM finance_supplier WHERE id = new.supplier_id) AS supplier_name, "
+    "(SELECT name FROM finance_customer WHERE id = new.customer_id) AS customer_name",
+    INVOICE_COLUMNS,
+)
+SQLITE_JOURNAL_SYNC = _folded(
+    "SELECT e.id AS id, e.entry_number AS entry_number, a.name AS account_name, e.description AS description "
+    "FROM finance_journalentry e JOIN finance_account a ON a.id = e.account_id "
+    "WHERE e.id NOT IN (SELECT rowid FROM finance_journal_search)",
+    JOURNAL_COLUMNS,
+)
+SQLITE_INVOICE_SYNC = _folded(
+    "SELECT i.id AS id, i.invoice_number AS invoice_number, s.name AS supplier_name, c.name AS customer_name "
+    "FROM finance_invoice i "
+    "LEFT JOIN finance_supplier s ON s.id = i.supplier_id LEFT JOIN finance_customer c ON c.id = i.customer_id "
+    "WHERE i.id NOT IN (SELECT rowid FROM finance_invoice_search)",
+    INVOICE_COLUMNS,
+)
+
+SQLITE_TRIGGERS = f"""
+CREATE TRIGGER IF NOT EXISTS finance_journal_search_insert AFTER INSERT ON finance_journalentry BEGIN
+    INSERT INTO finance_journal_search (rowid, entry_number, account_name, description)
+    {SQLITE_JOURNAL_ROW};
+END;
+CREATE TRIGGER IF NOT EXISTS finance_journal_search_update
+AFTER UPDATE OF entry_number, account_id, description ON finance_journalentry BEGIN
+    DELETE FROM finance_journal_search WHERE rowid = old.id;
+    INSERT INTO finance_journal_search (rowid, entry_number, account_name, description)
+    {SQLITE_JOURNAL_ROW};
+END;
+CREATE TRIGGER IF NOT EXISTS finance_journal_search_delete AFTER DELETE ON finance_journalentry BEGIN
+    DELETE FROM finance_journal_search WHERE rowid = old.id;
+END;
+CREATE TRIGGER IF NOT EXISTS finance_journal_search_account AFTER UPDATE OF name ON finance_account BEGIN
+    UPDATE finance_journal_search SET account_name = {_folded_value('new.name')}
+    WHERE rowid IN (SELECT id FROM finance_journalentry WHERE account_id = new.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS finance_invoice_search_insert AFTER INSERT ON finance_invoice BEGIN
+    INSERT INTO finance_invoice_search (rowid, invoice_number, supplier_name, customer_name)
+    {SQLITE_INVOICE_ROW};
+END;
+CREATE TRIGGER IF NOT EXISTS finance_invoice_search_update
+AFTER UPDATE OF invoice_number, supplier_id, customer_id ON finance_invoice BEGIN
+    DELETE FROM finance_invoice_search WHERE rowid = old.id;
+    INSERT INTO finance_invoice_search (rowid, invoice_number, supplier_name, customer_name)
+    {SQLITE_INVOICE_ROW};
+END;
+CREATE TRIGGER IF NOT EXISTS finance_invoice_search_delete AFTER DELETE ON finance_invoice BEGIN
+    DELETE FROM finance_invoice_search WHERE rowid = old.id;
+END;
+CREATE TRIGGER IF NOT EXISTS finance_invoice_search_supplier AFTER UPDATE OF name ON finance_supplier BEGIN
+    UPDATE finance_invoice_search SET supplier_name = {_folded_value('new.name')}
+    WHERE rowid IN (SELECT id FROM finance_invoice WHERE supplier_id = new.id);
+END;
+CREATE TRIGGER IF NOT EXISTS finance_invoice_search_customer AFTER UPDATE OF name ON finance_customer BEGIN
+    UPDATE finance_invoice_search SET customer_name = {_folded_value('new.name')}
+    WHERE rowid IN (SELECT id FROM finance_invoice WHERE customer_id = new.id);
+END;
+"""
+
+# Indexes the rows missing from the index and forgets deleted ones (everything after a DELETE of the index)
+SQLITE_SYNC = f"""
+DELETE FROM finance_journal_search WHERE rowid NOT IN (SELECT id FROM finance_journalentry);
+INSERT INTO finance_journal_search (rowid, entry_number, account_name, description) {SQLITE_JOURNAL_SYNC};
+DELETE FROM finance_invoice_search WHERE rowid NOT IN (SELECT id FROM finance_invoice);
+INSERT INTO finance_invoice_search (rowid, invoice_number, supplier_name, customer_name) {SQLITE_INVOICE_SYNC};
+"""
+
+SQLITE_CLEAR = """
+DELETE FROM finance_journal_search;
+DELETE FROM finance_invoice_search;
+"""
+
+SQLITE_DROP_TRIGGERS = """
+DROP TRIGGER IF EXISTS finance_journal_search_insert;
+DROP TRIGGER IF EXISTS finance_journal_search_update;
+DROP TRIGGER IF EXISTS finance_journal_search_delete;
+DROP TRIGGER IF EXISTS finance_journal_search_account;
+DROP TRIGGER IF EXISTS finance_invoice_search_insert;
+DROP TRIGGER IF EXISTS finance_invoice_search_update;
+DROP TRIGGER IF EXISTS finance_invoice_search_delete;
+DROP TRIGGER IF EXISTS finance_invoice_search_supplier;
+DROP TRIGGER IF EXISTS finance_invoice_search_customer;
+"""
+
+SQLITE_DROP_TABLES = """
+DROP TABLE IF EXISTS finance_journal_search;
+DROP TABLE IF EXISTS finance_invoice_search;
+"""
+
+# Statements are separated by lines holding only "--;" (function bodies contain semicolons)
+POSTGRESQL_TABLES = r"""
+CREATE TABLE IF NOT EXISTS finance_journal_search (id bigint PRIMARY KEY, document tsvector NOT NULL);
+--;
+CREATE INDEX IF NOT EXISTS finance_journal_search_document ON finance_journal_search USING gin (document);
+--;
+CREATE TABLE IF NOT EXISTS finance_invoice_search (id bigint PRIMARY KEY, document tsvector NOT NULL);
+--;
+CREATE INDEX IF NOT EXISTS finance_invoice_search_document ON finance_invoice_search USING gin (document);
+"""
+
+POSTGRESQL_TRIGGERS = r"""
+CREATE OR REPLACE FUNCTION finance_fold(value text) RETURNS text AS $$
+    SELECT translate(
+        regexp_replace(lower(normalize(coalesce(value, ''), NFKC)), '[\u064B-\u065F\u0670\u0640]', '', 'g'),
+        'أإآٱىة٠١٢٣٤٥٦٧٨٩', 'اااايه0123456789')
+$$ LANGUAGE sql IMMUTABLE;
+--;
+CREATE OR REPLACE FUNCTION finance_words(value text) RETURNS text AS $$
+    SELECT regexp_replace(finance_fold(value), '[[:punct:]]+', ' ', 'g')
+$$ LANGUAGE sql IMMUTABLE;
+--;
+CREATE OR REPLACE FUNCTION finance_search_document(a text, b text, c text, d text DEFAULT NULL) RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('simple', finance_words(a)), 'A')
+        || setweight(to_tsvector('simple', finance_words(b)), 'B')
+        || setweight(to_tsvector('simple', finance_words(c)), 'B')
+        || setweight(to_tsvector('simple', finance_words(d)), 'C')
+$$ LANGUAGE sql IMMUTABLE;
+--;
+CREATE OR REPLACE FUNCTION finance_journal_search_refresh() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM finance_journal_search WHERE id = OLD.id;
+        RETURN NULL;
+    END IF;
+    INSERT INTO finance_journal_search (id, document)
+    SELECT NEW.id, finance_search_document(NEW.entry_number, a.name, NULL, NEW.description)
+    FROM finance_account a WHERE a.id = NEW.account_id
+    ON CONFLICT (id) DO UPDATE SET document = EXCLUDED.document;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+--;
+DROP TRIGGER IF EXISTS finance_journal_search_refresh ON finance_journalentry;
+--;
+CREATE TRIGGER finance_journal_search_refresh
+AFTER INSERT OR DELETE OR UPDATE OF entry_number, account_id, description ON finance_journalentry
+FOR EACH ROW EXECUTE FUNCTION finance_journal_search_refresh();
+--;
+CREATE OR REPLACE FUNCTION finance_journal_search_account() RETURNS trigger AS $$
+BEGIN
+    UPDATE finance_journal_search s
+    SET document = finance_search_document(e.entry_number, NEW.name, NULL, e.description)
+    FROM finance_journalentry e WHERE e.account_id = NEW.id AND s.id = e.id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+--;
+DROP TRIGGER IF EXISTS finance_journal_search_account ON finance_account;
+--;
+CREATE TRIGGER finance_journal_search_account AFTER UPDATE OF name ON finance_account
+FOR EACH ROW EXECUTE FUNCTION finance_journal_search_account();
+--;
+CREATE OR REPLACE FUNCTION finance_invoice_search_refresh() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM finance_invoice_search WHERE id = OLD.id;
+        RETURN NULL;
+    END IF;
+    INSERT INTO finance_invoice_search (id, document)
+    SELECT NEW.id, finance_search_document(
+        NEW.invoice_number,
+        (SELECT name FROM finance_supplier WHERE id = NEW.supplier_id),
+        (SELECT name FROM finance_customer WHERE id = NEW.customer_id))
+    ON CONFLICT (id) DO UPDATE SET document = EXCLUDED.document;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+--;
+DROP TRIGGER IF EXISTS finance_invoice_search_refresh ON finance_invoice;
+--;
+CREATE TRIGGER finance_invoice_search_refresh
+AFTER INSERT OR DELETE OR UPDATE OF invoice_number, supplier_id, customer_id ON finance_invoice
+FOR EACH ROW EXECUTE FUNCTION finance_invoice_search_refresh();
+--;
+CREATE OR REPLACE FUNCTION finance_invoice_search_party() RETURNS trigger AS $$
+BEGIN
+    UPDATE finance_invoice_search s
+    SET document = finance_search_document(
+        i.invoice_number,
+        (SELECT name FROM finance_supplier WHERE id = i.supplier_id),
+        (SELECT name FROM finance_customer WHERE id = i.customer_id))
+    FROM finance_invoice i
+    WHERE s.id = i.id AND (
+        (TG_TABLE_NAME = 'finance_supplier' AND i.supplier_id = NEW.id)
+        OR (TG_TABLE_NAME = 'finance_customer' AND i.customer_id = NEW.id));
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+--;
+DROP TRIGGER IF EXISTS finance_invoice_search_supplier ON finance_supplier;
+--;
+CREATE TRIGGER finance_invoice_search_supplier AFTER UPDATE OF name ON finance_supplier
+FOR EACH ROW EXECUTE FUNCTION finance_invoice_search_party();
+--;
+DROP TRIGGER IF EXISTS finance_invoice_search_customer ON finance_customer;
+--;
+CREATE TRIGGER finance_invoice_search_customer AFTER UPDATE OF name ON finance_customer
+FOR EACH ROW EXECUTE FUNCTION finance_invoice_search_party();
+"""
+
+POSTGRESQL_SYNC = r"""
+DELETE FROM finance_journal_search s WHERE NOT EXISTS (SELECT 1 FROM finance_journalentry e WHERE e.id = s.id);
+--;
+INSERT INTO finance_journal_search (id, document)
+SELECT e.id, finance_search_document(e.entry_number, a.name, NULL, e.description)
+FROM finance_journalentry e JOIN finance_account a ON a.id = e.account_id
+WHERE NOT EXISTS (SELECT 1 FROM finance_journal_search s WHERE s.id = e.id);
+--;
+DELETE FROM finance_invoice_search s WHERE NOT EXISTS (SELECT 1 FROM finance_invoice i WHERE i.id = s.id);
+--;
+INSERT INTO finance_invoice_search (id, document)
+SELECT i.id, finance_search_document(i.invoice_number, s.name, c.name)
+FROM finance_invoice i
+LEFT JOIN finance_supplier s ON s.id = i.supplier_id
+LEFT JOIN finance_customer c ON c.id = i.customer_id
+WHERE NOT EXISTS (SELECT 1 FROM finance_invoice_search x WHERE x.id = i.id);
+"""
+
+POSTGRESQL_CLEAR = r"""
+TRUNCATE finance_journal_search;
+--;
+TRUNCATE finance_invoice_search;
+"""
+
+POSTGRESQL_DROP_TRIGGERS = r"""
+DROP TRIGGER IF EXISTS finance_journal_search_refresh ON finance_journalentry;
+--;
+DROP TRIGGER IF EXISTS finance_journal_search_account ON finance_account;
+--;
+DROP TRIGGER IF EXISTS finance_invoice_search_refresh ON finance_invoice;
+--;
+DROP TRIGGER IF EXISTS finance_invoice_search_supplier ON finance_supplier;
+--;
+DROP TRIGGER IF EXISTS finance_invoice_search_customer ON finance_customer;
+"""
+
+POSTGRESQL_DROP_TABLES = r"""
+DROP FUNCTION IF EXISTS finance_journal_search_refresh();
+--;
+DROP FUNCTION IF EXISTS finance_journal_search_account();
+--;
+DROP FUNCTION IF EXISTS finance_invoice_search_refresh();
+--;
+DROP FUNCTION IF EXISTS finance_invoice_search_party();
+--;
+DROP FUNCTION IF EXISTS finance_search_document(text, text, text, text);
+--;
+DROP FUNCTION IF EXISTS finance_words(text);
+--;
+DROP FUNCTION IF EXISTS finance_fold(text);
+--;
+DROP TABLE IF EXISTS finance_journal_search;
+--;
+DROP TABLE IF EXISTS finance_invoice_search;
+"""
+
+SCRIPTS = {
+    'sqlite': {'tables': SQLITE_TABLES, 'triggers': SQLITE_TRIGGERS, 'sync': SQLITE_SYNC, 'clear': SQLITE_CLEAR,
+               'drop_triggers': SQLITE_DROP_TRIGGERS, 'drop_tables': SQLITE_DROP_TABLES},
+    'postgresql': {'tables': POSTGRESQL_TABLES, 'triggers': POSTGRESQL_TRIGGERS, 'sync': POSTGRESQL_SYNC,
+                   'clear': POSTGRESQL_CLEAR, 'drop_triggers': POSTGRESQL_DROP_TRIGGERS,
+                   'drop_tables': POSTGRESQL_DROP_TABLES},
+}
+
+
+def _statements(connection, script):
+    if connection.vendor != 'sqlite':
+        return [statement for statement in script.split('\n--;\n') if statement.strip()]
+    # Trigger bodies hold semicolons; sqlite3 knows where a statement really ends
+    statements, pending = [], ''
+    for line in script.splitlines(keepends=True):
+        pending += line
+        if sqlite3.complete_statement(pending):
+            statements.append(pending.strip())
+            pending = ''
+    return statements
+
+
+def _run(connection, *scripts):
+    if not supported(connection):
+        return
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        for script in scripts:
+            for statement in _statements(connection, SCRIPTS[connection.vendor][script]):
+                cursor.execute(statement)
+
+
+def supported(connection=default_connection):
+    return connection.vendor in SCRIPTS
+
+
+def installed(connection=default_connection):
+    """Whether the search tables exist (migration 0047 creates them)."""
+    return supported(connection) and INDEXES[JournalEntry].table in connection.introspection.table_names()
+
+
+def install(connection=default_connection, rebuild=True):
+    """
+    Create the search tables, replace the triggers with the current ones and index
+    every row again (rebuild) or only the rows missing from the index.
+    """
+    _run(connection, 'tables', 'drop_triggers', 'triggers', *(('clear',) if rebuild else ()), 'sync')
+
+
+def drop_triggers(connection=default_connection):
+    """Stop maintaining the index (until install()); the indexed rows stay."""
+    _run(connection, 'drop_triggers')
+
+
+def uninstall(connection=default_connection):
+    _run(connection, 'drop_triggers', 'drop_tables')
+
+
+def match_query(query, connection=default_connection):
+    """The user's words as a database full-text query (every word a prefix, all required), or None."""
+    words = WORD.findall(fold(query))
+    if not words:
+        return None
+    if connection.vendor == 'postgresql':
+        return ' & '.join(f"{word}:*" for word in words)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def ranked_ids(model, query, limit=500, connection=default_connection):
+    """
+    Primary keys of the best `limit` matches, best first.
+
+    Only the newest RANK_CANDIDATES matches are scored, so a query for a word
+    on every other line costs a bounded amount of ranking work.
+    """
+    index = INDEXES[model]
+    match = match_query(query, connection)
+    if match is None:
+        return []
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f"SELECT id FROM (SELECT id, document, query FROM {index.table}, to_tsquery('simple', %s) query "
+                f"WHERE document @@ query ORDER BY id DESC LIMIT %s) candidates "
+                f"ORDER BY ts_rank(document, query) DESC, id DESC LIMIT %s",
+                [match, RANK_CANDIDATES, limit],
+            )
+        else:
+            weights = ', '.join(str(weight) for weight in index.weights)
+            cursor.execute(
+                f"SELECT rowid FROM (SELECT rowid, bm25({index.table}, {weights}) AS score FROM {index.table} "
+                f"WHERE {index.table} MATCH %s ORDER BY rowid DESC LIMIT %s) "
+                f"ORDER BY score, rowid DESC LIMIT %s",
+                [match, RANK_CANDIDATES, limit],
+            )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _match_sql(index, connection):
+    if connection.vendor == 'postgresql':
+        return f"SELECT id FROM {index.table} WHERE document @@ to_tsquery('simple', %s)", 'id'
+    return f"SELECT rowid FROM {index.table} WHERE {index.table} MATCH %s", 'rowid'
+
+
+def matches(queryset, query):
+    """Narrow a JournalEntry or Invoice queryset to every row matching `query`, in the queryset's own order."""
+    index = INDEXES[queryset.model]
+    connection = default_connection
+    if not supported(connection):
+        condition = Q()
+        for lookup in index.fallback:
+            condition |= Q(**{f"{lookup}__icontains": query})
+        return queryset.filter(condition)
+    match = match_query(query, connection)
+    if match is None:
+        return queryset.none()
+    sql, _ = _match_sql(index, connection)
+    return queryset.filter(pk__in=RawSQL(sql, [match]))
+
+
+def _matching_ids(index, match, past, newest_first, limit, connection):
+    """Up to `limit` ids of matching rows past id `past` (None: from the end), straight from the index."""
+    sql, column = _match_sql(index, connection)
+    params = [match]
+    if past is not None:
+        sql += f" AND {column} {'<' if newest_first else '>'} %s"
+        params.append(past)
+    sql += f" ORDER BY {column} {'DESC' if newest_first else 'ASC'} LIMIT %s"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [limit])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _unranked(queryset, index, match, ranked, past, newest_first, count, connection):
+    """Up to `count` ids of matches in `queryset` past id `past` that are not in `ranked`, nearest first."""
+    found, window = [], count
+    while len(found) < count:
+        ids = _matching_ids(index, match, past, newest_first, window, connection)
+        if not ids:
+            break
+        kept = set(queryset.filter(pk__in=ids).values_list('pk', flat=True))
+        found += [pk for pk in ids if pk in kept and pk not in ranked][:count - len(found)]
+        if len(ids) < window:
+            break
+        # The queryset's filters dropped rows; read further along the index in growing steps
+        past, window = ids[-1], min(window * 4, TAIL_WINDOW)
+    return found
+
+
+def _cursor(value):
+    """("r", position in the ranked matches) or ("t", id of an unranked match) from a query parameter, else None."""
+    found = re.fullmatch(r"([rt])(\d+)", value or "")
+    return (found.group(1), int(found.group(2))) if found else None
+
+
+def paginate(request, queryset, query, limit=500, per_page=None):
+    """
+    The requested page of every JournalEntry or Invoice in `queryset` matching `query`.
+
+    The best `limit` matches (ranked_ids) come first, then all other matches,
+    newest first, read from the index a page at a time, so a search for a common
+    word pages through every match at the same cost as its first page. Without
+    a full-text index this pages through the icontains filter (pagination.paginate).
+
+    Returns:
+        pagination.KeysetPage
+    """
+    connection = default_connection
+    if not supported(connection):
+        return pagination.paginate(request, matches(queryset, query), per_page=per_page)
+    per_page = per_page or settings.LIST_PAGE_SIZE
+    index = INDEXES[queryset.model]
+    match = match_query(query, connection)
+    if match is None:
+        return pagination.KeysetPage([], False, False, None, None)
+
+    ids = ranked_ids(queryset.model, query, limit, connection)
+    kept = set(queryset.filter(pk__in=ids).values_list('pk', flat=True))
+    ranked = [pk for pk in ids if pk in kept]
+    ranked_set = set(ranked)
+    after, before = _cursor(request.GET.get(pagination.AFTER)), _cursor(request.GET.get(pagination.BEFORE))
+    if after and after[0] == 'r' and after[1] >= len(ranked):
+        after = None
+    if before and before[0] == 'r' and before[1] >= len(ranked):
+        before = None
+
+    # Every entry is (cursor, pk); the ranked matches' cursors are their positions
+    if before and not after:
+        entries = []
+        if before[0] == 't':
+            newer = _unranked(queryset, index, match, ranked_set, before[1], False, per_page + 1, connection)
+            entries = [(f"t{pk}", pk) for pk in reversed(newer)]
+            end = len(ranked)
+        else:
+            end = before[1]
+        start = max(0, end - (per_page + 1 - len(entries)))
+        entries = [(f"r{position}", ranked[position]) for position in range(start, end)] + entries
+        has_previous, has_next = len(entries) > per_page, True
+        entries = entries[-per_page:]
+    else:
+        if after and after[0] == 't':
+            entries = []
+            past = after[1]
+        else:
+            start = after[1] + 1 if after else 0
+            entries = [(f"r{position}", ranked[position]) for position in range(start, min(len(ranked), start + per_page + 1))]
+            past = None
+        if len(entries) <= per_page:
+            older = _unranked(queryset, index, match, ranked_set, past, True, per_page + 1 - len(entries), connection)
+            entries += [(f"t{pk}", pk) for pk in older]
+        has_previous, has_next = after is not None, len(entries) > per_page
+        entries = entries[:per_page]
+
+    rows = {row.pk: row for row in queryset.filter(pk__in=[pk for _, pk in entries])}
+    return pagination.KeysetPage(
+        [rows[pk] for _, pk in entries if pk in rows],
+        has_next,
+        has_previous,
+        pagination.page_query(request.GET, pagination.AFTER, entries[-1][0]) if has_next and entries else None,
+        pagination.page_query(request.GET, pagination.BEFORE, entries[0][0]) if has_previous and entries else None,
+    )
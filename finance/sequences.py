@@ -0,0 +1,153 @@
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, transaction
+from django.db.models import F
+from django.db.models.functions import Length
+
+from .models import Company, JournalEntry, NumberSequence
+
+# Document numbers (journal entries, ...) come from one NumberSequence row per
+# company and series. Instead of touching that row for every document, each
+# process reserves a block of numbers with a single locked UPDATE (hi/lo) and
+# hands them out from memory, so concurrent posting neither serializes on the
+# row nor races on "last number + 1". Numbers stay unique and increasing per
+# process; a block left unused when a process exits leaves a gap.
+#
+# Inside a transaction the block is reserved on a second, short-lived
+# connection in autocommit, so the caller's transaction never holds the sequence
+# row (which would queue every other poster until it commits) and a rollback
+# only leaves a gap. SQLite has one writer at a time, so there the number is
+# reserved in the caller's transaction as before; so is it for callers asking
+# for gap_free numbers. Bulk posting reserves all the numbers it needs in one
+# update (assign_entry_numbers).
+
+JOURNAL_SERIES = 'JE'
+
+_blocks = {}  # (company_id, series) -> [next number, end of block]
+_key_locks = {}
+_lock = threading.Lock()
+
+
+def _forget_blocks():
+    # A forked worker must not hand out its parent's numbers
+    global _lock
+    _lock = threading.Lock()
+    _blocks.clear()
+    _key_locks.clear()
+
+
+os.register_at_fork(after_in_child=_forget_blocks)
+
+
+def format_number(series, company_id, number):
+    """'JE00042' for entries without a company (the original format), 'JE3-00042' for company 3."""
+    if company_id is None:
+        return f"{series}{number:05d}"
+    return f"{series}{company_id}-{number:05d}"
+
+
+def _first_free(series, company_id, using=DEFAULT_DB_ALIAS):
+    """First number after the ones already used, for a sequence created on an existing database."""
+    prefix = format_number(series, company_id, 0)[:-5]
+    last = (
+        JournalEntry.objects.using(using).filter(entry_number__regex=rf"^{re.escape(prefix)}[0-9]+$")
+        .order_by(Length('entry_number').desc(), '-entry_number')
+        .values_list('entry_number', flat=True)
+        .first()
+    )
+    return int(last[len(prefix):]) + 1 if last else 1
+
+
+def reserve(count, company_id=None, series=JOURNAL_SERIES, using=DEFAULT_DB_ALIAS):
+    """
+    Reserve `count` consecutive numbers with one locked update.
+
+    Commits at once outside a transaction; inside one, the reservation is
+    rolled back with it.
+
+    Returns:
+        int: the first reserved number.
+    """
+    sequences = NumberSequence.objects.using(using).filter(company_id=company_id, series=series)
+    for _ in range(2):
+        with transaction.atomic(using=using):
+            # UPDATE first, so the row lock is taken before the value is read
+            if sequences.update(next_value=F('next_value') + count):
+                return sequences.values_list('next_value', flat=True).get() - count
+        try:
+            with transaction.atomic(using=using):
+                first = _first_free(series, company_id, using)
+                NumberSequence.objects.using(using).create(company_id=company_id, series=series, next_value=first + count)
+                return first
+        except IntegrityError:
+            continue  # created concurrently; reserve from that row
+    raise RuntimeError(f"Could not reserve numbers for series {series}")
+
+
+@contextmanager
+def _outside_transaction():
+    """Alias of a new connection to the current database, for reserving a block outside its transaction."""
+    connection = transaction.get_connection()
+    alias = f"{connection.alias}-sequences"
+    outside = connections.create_connection(connection.alias)
+    outside.alias = alias
+    connections[alias] = outside
+    try:
+        yield alias
+    finally:
+        outside.close()
+        del connections[alias]
+
+
+def next_number(company_id=None, series=JOURNAL_SERIES, gap_free=False):
+    """
+    Next number of a series, from this process's block (reserving a new block when it runs out).
+
+    With `gap_free`, the number is reserved in the caller's transaction and returned to the
+    sequence if it rolls back; that transaction then holds the sequence row until it ends.
+    """
+    in_transaction = transaction.get_connection().in_atomic_block
+    if gap_free and in_transaction:
+        return reserve(1, company_id, series)
+    key = (company_id, series)
+    with _lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        block = _blocks.get(key)
+        if not block or block[0] >= block[1]:
+            size = max(1, settings.JOURNAL_NUMBER_BLOCK_SIZE)
+            if not in_transaction:
+                first = reserve(size, company_id, series)
+            elif transaction.get_connection().vendor != 'postgresql':
+                return reserve(1, company_id, series)
+            else:
+                with _outside_transaction() as alias:
+                    # A company created in the caller's transaction is not visible there yet
+                    if company_id is not None and not Company.objects.using(alias).filter(pk=company_id).exists():
+                        return reserve(1, company_id, series)
+                    first = reserve(size, company_id, series, alias)
+            block = _blocks[key] = [first, first + size]
+        number = block[0]
+        block[0] += 1
+        return number
+
+
+def next_entry_number(company_id=None):
+    return format_number(JOURNAL_SERIES, company_id, next_number(company_id, JOURNAL_SERIES))
+
+
+def assign_entry_numbers(entries):
+    """Give unnumbered JournalEntry objects (e.g. before bulk_create) their numbers, one reservation per company."""
+    by_company = {}
+    for entry in entries:
+        if not entry.entry_number:
+            by_company.setdefault(entry.company_id, []).append(entry)
+    for company_id, unnumbered in by_company.items():
+        first = reserve(len(unnumbered), company_id, JOURNAL_SERIES)
+        for offset, entry in enumerate(unnumbered):
+            entry.entry_number = format_number(JOURNAL_SERIES, company_id, first + offset)
+    return entries
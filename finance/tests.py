@@ -1,3 +1,1315 @@
-from django.test import TestCase
+import csv
+import hashlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date
+from decimal import Decimal
+from multiprocessing import shared_memory
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import OperationalError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import ProtectedError, Sum
+from django.http import QueryDict
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+import fitz
+import numpy as np
+import requests
+from PIL import Image
+
+from finance import (
+    counters, duplicates, grouping, imaging, imports, lineitems, money, ocr, ocr_stub, pagination, periods, posting,
+    previews, replay, search, sequences, views, watchfolder,
+)
+from finance.models import (
+    Account, Company, Customer, FiscalYear, Invoice, InvoiceDeadLetter, InvoicePageHash, InvoiceUpload, JournalEntry, Supplier,
+)
+from finance.views import _is_rescan, correct_image_orientation, detect_text_blocks, upload_to_gcs
+
+
+class DuplicateScanTests(TestCase):
+    PAGE = 0x9F3A_5C21_77E0_1B4D
+
+    def setUp(self):
+        # A fresh in-memory index, so hashes of other tests' (rolled back) invoices are not in it
+        for name, value in (('_index', duplicates.PageHashIndex()), ('_last_id', 0)):
+            patcher = mock.patch.object(duplicates, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.stored = Invoice.objects.create(
+            invoice_id="SCAN-1", invoice_number="INV-100", date=date(2026, 3, 1),
+            amount_before_vat=100, total_vat=15, total_amount=115,
+        )
+        InvoicePageHash.objects.bulk_create(duplicates.page_hash_rows(self.stored, [(self.PAGE, "qr-inv-100")]))
+
+    def test_matching_qr_confirms_a_rescan(self):
+        match = duplicates.find_duplicate(self.PAGE ^ 0b11, "qr-inv-100")
+        self.assertEqual(match, (self.stored, 2, True))
+        self.assertTrue(_is_rescan(match))
+
+    def test_hash_alone_is_only_suspected(self):
+        # Same template, no QR code on the new scan: distances 0 and 4 are both plausible for another invoice
+        for flipped in (0, 0b1111):
+            match = duplicates.find_duplicate(self.PAGE ^ flipped)
+            self.assertEqual(match, (self.stored, bin(flipped).count('1'), False))
+            self.assertFalse(_is_rescan(match))
+
+    def test_different_qr_is_not_a_match(self):
+        self.assertIsNone(duplicates.find_duplicate(self.PAGE, "qr-inv-101"))
+
+    def test_suspected_duplicate_is_kept_for_review(self):
+        invoice = Invoice.objects.create(
+            invoice_id="SCAN-2", invoice_number="INV-101", date=date(2026, 3, 2),
+            amount_before_vat=100, total_vat=15, total_amount=115,
+            duplicate_of=self.stored, duplicate_distance=4,
+        )
+        self.assertEqual(list(self.stored.suspected_duplicates.all()), [invoice])
+
+
+class MoneyFieldTests(TestCase):
+    def setUp(self):
+        company = Company.objects.create(name="Money Co", country="Jordan")
+        self.account = Account.objects.create(name="Cash", account_type='asset', company=company)
+
+    def line(self, debit, credit=0):
+        return JournalEntry.objects.create(
+            account=self.account, date=date(2026, 3, 1), debit_amount=debit, credit_amount=credit,
+        )
+
+    def test_amounts_are_stored_as_minor_units(self):
+        entry = self.line(Decimal('1234.56'), '0.1')
+        entry.refresh_from_db()
+
+        self.assertEqual((entry.debit_amount, entry.credit_amount), (Decimal('1234.56'), Decimal('0.10')))
+        self.assertEqual(
+            JournalEntry.objects.values_list(money.minor('debit_amount'), money.minor('credit_amount')).get(),
+            (123456, 10),
+        )
+
+    def test_aggregates(self):
+        for amount in ('10.00', '10.01', '10.05'):
+            self.line(Decimal(amount))
+
+        totals = JournalEntry.objects.aggregate(
+            total=Sum('debit_amount'), units=money.MinorSum('debit_amount'),
+            average=money.MinorAvg('debit_amount'), none=money.MinorSum('credit_amount', filter=None),
+        )
+
+        self.assertEqual(totals['total'], Decimal('30.06'))
+        self.assertEqual(totals['units'], 3006)
+        self.assertEqual(totals['average'], Decimal('10.02'))
+        self.assertEqual(JournalEntry.objects.none().aggregate(units=money.MinorSum('debit_amount'))['units'], 0)
+        with self.assertRaises(TypeError):
+            JournalEntry.objects.aggregate(money.MinorAvg('entry_number'))
+
+
+class ClosedPeriodTests(TestCase):
+    def setUp(self):
+        company = Company.objects.create(name="Closed Co", country="Jordan")
+        self.account = Account.objects.create(name="Rent", account_type='expense', company=company)
+        self.old = JournalEntry.objects.create(account=self.account, date=date(2025, 6, 1), debit_amount=5)
+        self.new = JournalEntry.objects.create(account=self.account, date=date(2026, 6, 1), debit_amount=7)
+        FiscalYear.objects.create(name="2025", start_date=date(2025, 1, 1), end_date=date(2025, 12, 31), is_closed=True)
+
+    def test_closed_lines_are_frozen(self):
+        with self.assertRaises(ValidationError):
+            JournalEntry.objects.create(account=self.account, date=date(2025, 7, 1), debit_amount=1)
+        with self.assertRaises(ValidationError):
+            self.old.delete()
+
+    def test_account_with_lines_is_not_deleted(self):
+        with self.assertRaises(ProtectedError):
+            self.account.delete()
+        self.assertEqual(JournalEntry.objects.filter(account=self.account).count(), 2)
+
+    def test_account_changes_skip_closed_lines(self):
+        Account.objects.filter(pk=self.account.pk).update(account_type='asset')
+        Account.sync_journal_entries([self.account.pk])
+        self.old.refresh_from_db()
+        self.new.refresh_from_db()
+        self.assertEqual((self.old.account_type, self.new.account_type), ('expense', 'asset'))
+
+        self.account.refresh_from_db()
+        self.account.account_type = 'liability'
+        self.account.save()
+        self.assertEqual(JournalEntry.objects.get(pk=self.old.pk).account_type, 'expense')
+        self.assertEqual(JournalEntry.objects.get(pk=self.new.pk).account_type, 'liability')
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "SQLite has one writer at a time")
+class PostgreSQLClosingTests(TransactionTestCase):
+    def setUp(self):
+        company = Company.objects.create(name="Closing Co", country="Jordan")
+        self.account = Account.objects.create(name="Cash", account_type='asset', company=company)
+        self.year = FiscalYear.objects.create(name="2025", start_date=date(2025, 1, 1), end_date=date(2025, 12, 31))
+
+    def in_thread(self, work, started, release):
+        def run():
+            try:
+                with transaction.atomic():
+                    work()
+                    started.set()
+                    release.wait(10)
+            except Exception as error:
+                self.error = error
+                started.set()
+            finally:
+                connection.close()
+        self.error = None
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def test_close_waits_for_postings_in_progress(self):
+        started, release = threading.Event(), threading.Event()
+        thread = self.in_thread(
+            lambda: JournalEntry.objects.create(account=self.account, date=date(2025, 12, 31), debit_amount=3),
+            started, release,
+        )
+        started.wait(10)
+        try:
+            with self.assertRaises(OperationalError):
+                with transaction.atomic():
+                    with connection.cursor() as cursor:
+                        cursor.execute("SET LOCAL lock_timeout = '500ms'")
+                    periods.close_fiscal_year(self.year)
+        finally:
+            release.set()
+            thread.join()
+        self.assertIsNone(self.error)
+
+        following = periods.close_fiscal_year(self.year)
+        self.assertEqual(following.opening_balances.get().debit_amount, Decimal('3.00'))
+
+    def test_postings_wait_for_a_close_in_progress(self):
+        started, release = threading.Event(), threading.Event()
+        with transaction.atomic():
+            FiscalYear.objects.select_for_update().filter(pk=self.year.pk).update(is_closed=True)
+            thread = self.in_thread(
+                lambda: JournalEntry.objects.create(account=self.account, date=date(2025, 12, 31), debit_amount=3),
+                started, release,
+            )
+            time.sleep(0.5)
+            self.assertFalse(started.is_set())
+        started.wait(10)
+        release.set()
+        thread.join()
+        self.assertIsInstance(self.error, ValidationError)
+        self.assertFalse(JournalEntry.objects.exists())
+
+
+class PostingTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Posting Co", country="Jordan")
+        self.cash = Account.objects.create(name="Cash", account_number="1000", account_type='asset', company=self.company)
+        self.salaries = Account.objects.create(name="Salaries", account_type='expense', company=self.company)
+        other = Company.objects.create(name="Other Co", country="Jordan")
+        self.foreign = Account.objects.create(name="Foreign Cash", account_type='asset', company=other)
+
+    def voucher(self, debit="1500.00", credit="1500.00", credit_account=None, day="2026-03-31", **extra):
+        return {
+            "date": day, "company": self.company.pk,
+            "lines": [{"account": self.salaries.pk, "debit": debit},
+                      {"account": (credit_account or self.cash).pk, "credit": credit}],
+            **extra,
+        }
+
+    def assertRejected(self, vouchers, message):
+        with self.assertRaises(posting.PostingError) as raised:
+            posting.post_vouchers(vouchers)
+        self.assertIn(message, raised.exception.errors[0]['error'])
+        self.assertFalse(JournalEntry.objects.exists())
+
+    def test_balanced_vouchers_are_posted(self):
+        result = posting.post_vouchers([self.voucher(voucher="PAY-03"), self.voucher(debit="2.50", credit="2.50")])
+
+        self.assertEqual((result['vouchers'], result['lines']), (2, 4))
+        lines = JournalEntry.objects.order_by('entry_number')
+        self.assertEqual([line.voucher for line in lines][:2], ["PAY-03", "PAY-03"])
+        self.assertEqual(lines[2].voucher, lines[2].entry_number)
+        self.assertEqual(lines.aggregate(total=Sum('debit_amount'))['total'], Decimal('1502.50'))
+        self.assertEqual({line.account_type for line in lines}, {'asset', 'expense'})
+
+    def test_unbalanced_voucher_is_rejected(self):
+        self.assertRejected([self.voucher(), self.voucher(credit="1499.99")], "does not balance")
+
+    def test_account_of_another_company_is_rejected(self):
+        self.assertRejected([self.voucher(credit_account=self.foreign)], "belongs to another company")
+
+    def test_closed_period_is_rejected(self):
+        FiscalYear.objects.create(name="2025", start_date=date(2025, 1, 1), end_date=date(2025, 12, 31), is_closed=True)
+        self.assertRejected([self.voucher(), self.voucher(day="2025-12-31")], "closed through 2025-12-31")
+
+    def test_year_closed_after_validation_is_rejected(self):
+        year = FiscalYear.objects.create(name="2026", start_date=date(2026, 1, 1), end_date=date(2026, 12, 31))
+        build_entries = posting.build_entries
+
+        def build_then_close(vouchers, user=None):
+            grouped = build_entries(vouchers, user)
+            FiscalYear.objects.filter(pk=year.pk).update(is_closed=True)
+            return grouped
+
+        with mock.patch.object(posting, 'build_entries', build_then_close):
+            self.assertRejected([self.voucher(voucher="PAY-03")], "closed through 2026-12-31")
+
+
+class SequenceTests(TestCase):
+    def setUp(self):
+        company = Company.objects.create(name="Numbered Co", country="Jordan")
+        self.account = Account.objects.create(name="Cash", account_type='asset', company=company)
+
+    def test_entries_are_numbered_per_company(self):
+        first, second = (
+            JournalEntry.objects.create(account=self.account, date=date(2026, 3, 1), debit_amount=1)
+            for _ in range(2)
+        )
+        prefix = f"JE{self.account.company_id}-"
+        self.assertTrue(first.entry_number.startswith(prefix) and second.entry_number.startswith(prefix))
+        self.assertLess(int(first.entry_number[len(prefix):]), int(second.entry_number[len(prefix):]))
+
+    def test_gap_free_numbers_return_on_rollback(self):
+        company_id = self.account.company_id
+        try:
+            with transaction.atomic():
+                taken = sequences.next_number(company_id, 'GF', gap_free=True)
+                raise ValueError
+        except ValueError:
+            pass
+        with transaction.atomic():
+            self.assertEqual(sequences.next_number(company_id, 'GF', gap_free=True), taken)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "SQLite has one writer at a time")
+class PostgreSQLSequenceTests(TransactionTestCase):
+    def test_open_transactions_do_not_wait_on_the_sequence(self):
+        company = Company.objects.create(name="Busy Co", country="Jordan")
+        account = Account.objects.create(name="Cash", account_type='asset', company=company)
+        holding, release, numbers = threading.Event(), threading.Event(), []
+
+        def post_and_roll_back():
+            try:
+                with transaction.atomic():
+                    numbers.append(JournalEntry.objects.create(account=account, date=date(2026, 3, 1)).entry_number)
+                    holding.set()
+                    release.wait(10)
+                    transaction.set_rollback(True)
+            finally:
+                holding.set()
+                connection.close()
+
+        writer = threading.Thread(target=post_and_roll_back)
+        writer.start()
+        holding.wait(10)
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL lock_timeout = '1s'")
+                numbers.append(JournalEntry.objects.create(account=account, date=date(2026, 3, 1)).entry_number)
+        finally:
+            release.set()
+            writer.join()
+
+        self.assertEqual(len(set(numbers)), 2)
+        self.assertEqual(list(JournalEntry.objects.values_list('entry_number', flat=True)), numbers[1:])
+
+
+class MinorUnitsMigrationTests(TransactionTestCase):
+    before, after = ('finance', '0048_row_counts'), ('finance', '0049_money_minor_units')
+
+    def historical(self, target, model):
+        return MigrationExecutor(connection).loader.project_state(target).apps.get_model('finance', model)
+
+    def test_amounts_scale_to_minor_units_and_back(self):
+        call_command('migrate', *self.before, verbosity=0)
+        try:
+            company = self.historical(self.before, 'Company').objects.create(name="Old Co", country="Jordan")
+            account = self.historical(self.before, 'Account').objects.create(
+                name="Cash", account_type='asset', company_id=company.pk,
+            )
+            self.historical(self.before, 'JournalEntry').objects.create(
+                entry_number='OLD-1', date=date(2026, 3, 1), account_id=account.pk,
+                debit_amount=Decimal('1234.56'), credit_amount=Decimal('0.05'),
+            )
+
+            call_command('migrate', *self.after, verbosity=0)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT debit_amount, credit_amount FROM finance_journalentry")
+                self.assertEqual(cursor.fetchone(), (123456, 5))
+            entry = self.historical(self.after, 'JournalEntry').objects.get()
+            self.assertEqual((entry.debit_amount, entry.credit_amount), (Decimal('1234.56'), Decimal('0.05')))
+
+            call_command('migrate', *self.before, verbosity=0)
+            entry = self.historical(self.before, 'JournalEntry').objects.get()
+            self.assertEqual((entry.debit_amount, entry.credit_amount), (Decimal('1234.56'), Decimal('0.05')))
+        finally:
+            call_command('migrate', 'finance', verbosity=0)
+
+
+class RowCounterTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Counted Co", country="Jordan")
+        self.other = Company.objects.create(name="Other Co", country="Jordan")
+
+    def test_counters_follow_bulk_writes(self):
+        Supplier.objects.bulk_create([Supplier(name=f"Supplier {i}", company=self.company) for i in range(5)])
+        Supplier.objects.filter(name__in=["Supplier 0", "Supplier 1"]).delete()
+        Supplier.objects.filter(name="Supplier 2").update(company=self.other)
+
+        self.assertEqual(counters.count(Supplier, self.company), 2)
+        self.assertEqual(counters.count(Supplier, self.other.pk), 1)
+        self.assertEqual(counters.count(Supplier), Supplier.objects.count())
+        self.assertEqual(counters.reconcile(), [])
+
+    def test_reconcile_corrects_drift(self):
+        Supplier.objects.create(name="Counted", company=self.company)
+        table = Supplier._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(f"UPDATE {counters.COUNTER_TABLE} SET row_count = row_count + 7 WHERE table_name = %s", [table])
+
+        drift = counters.reconcile()
+
+        self.assertIn((table, self.company.pk, 8, 1), drift)
+        self.assertEqual(counters.count(Supplier, self.company), 1)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "slot rows only matter with concurrent writers")
+class PostgreSQLRowCounterTests(TransactionTestCase):
+    def test_concurrent_writers_do_not_wait_on_one_counter(self):
+        company = Company.objects.create(name="Busy Co", country="Jordan")
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid()")
+            own_slot = cursor.fetchone()[0] % counters.SLOTS
+
+        holding, release, seen = threading.Event(), threading.Event(), {}
+
+        def post_and_hold():
+            # A writer in another backend that keeps its transaction open
+            try:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_backend_pid()")
+                    seen['slot'] = cursor.fetchone()[0] % counters.SLOTS
+                    if seen['slot'] != own_slot:
+                        Supplier.objects.create(name="Held", company=company)
+                    holding.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        # Backend pids are not ours to pick; retry until the other writer lands on a different slot
+        for _ in range(20):
+            holding.clear()
+            writer = threading.Thread(target=post_and_hold)
+            writer.start()
+            holding.wait(10)
+            if seen['slot'] != own_slot:
+                break
+            release.set()
+            writer.join()
+            release.clear()
+        self.assertNotEqual(seen['slot'], own_slot)
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SET lock_timeout = '2s'")
+            started = time.monotonic()
+            Supplier.objects.create(name="Not waiting", company=company)
+            self.assertLess(time.monotonic() - started, 1)
+        finally:
+            release.set()
+            writer.join()
+            with connection.cursor() as cursor:
+                cursor.execute("RESET lock_timeout")
+
+        self.assertEqual(counters.count(Supplier, company), 2)
+        self.assertEqual(counters.reconcile(), [])
+
+
+class ReplayTests(TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        self.addCleanup(replay.configure, mode=replay.current_mode(), fixtures_dir=replay._config['fixtures_dir'])
+
+    def bench_file(self, concurrency, n):
+        # Same bytes under the working name the benchmark gives each job
+        path = os.path.join(self.workdir, f"bench{concurrency}-{n}-invoice.png")
+        with open(path, 'wb') as fp:
+            fp.write(b"page bytes")
+        return path
+
+    def test_storage_fixture_recorded_at_one_level_replays_at_another(self):
+        fixtures = os.path.join(self.workdir, 'fixtures')
+        with mock.patch('finance.views.storage') as storage:
+            storage.Client.from_service_account_json.return_value.bucket.return_value.blob.return_value \
+                .generate_signed_url.return_value = "https://storage.example/bench1-0-invoice.png"
+            replay.configure(mode='record', fixtures_dir=fixtures)
+            recorded = upload_to_gcs("bucket", self.bench_file(1, 0), "credentials.json")
+
+            replay.configure(mode='replay')
+            storage.reset_mock()
+            self.assertEqual(upload_to_gcs("bucket", self.bench_file(4, 3), "credentials.json"), recorded)
+            storage.Client.from_service_account_json.assert_not_called()
+
+        with self.assertRaises(replay.ReplayMiss):
+            upload_to_gcs("other-bucket", self.bench_file(4, 3), "credentials.json")
+
+
+def _invoice(number, **fields):
+    return Invoice.objects.create(**{
+        'invoice_id': f"SCAN-{number}", 'invoice_number': number, 'date': date(2026, 3, 1),
+        'amount_before_vat': 100, 'total_vat': 15, 'total_amount': 115, **fields,
+    })
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        company = Company.objects.create(name="Search Co", country="Jordan")
+        self.account = Account.objects.create(name="Office Rent", account_type='expense', company=company)
+        self.supplier = Supplier.objects.create(name="Acme Trading")
+        self.customer = Customer.objects.create(name="Globex")
+
+    def found(self, model, query):
+        return set(search.matches(model.objects.all(), query).values_list('pk', flat=True))
+
+    def test_index_follows_inserts_renames_and_deletes(self):
+        entry = JournalEntry.objects.create(account=self.account, date=date(2026, 3, 1), debit_amount=5, description="March")
+        invoice = _invoice("INV-7", supplier=self.supplier, customer=self.customer)
+        self.assertEqual(self.found(JournalEntry, "rent"), {entry.pk})
+        self.assertEqual(self.found(Invoice, "acme"), {invoice.pk})
+
+        self.account.name = "Warehouse Lease"
+        self.account.save()
+        Supplier.objects.filter(pk=self.supplier.pk).update(name="Initech")
+        Customer.objects.filter(pk=self.customer.pk).update(name="Umbrella")
+        self.assertEqual(self.found(JournalEntry, "rent"), set())
+        self.assertEqual(self.found(JournalEntry, "lease"), {entry.pk})
+        self.assertEqual(self.found(Invoice, "acme"), set())
+        self.assertEqual(self.found(Invoice, "initech"), {invoice.pk})
+        self.assertEqual(self.found(Invoice, "umbrella"), {invoice.pk})
+
+        Invoice.objects.filter(pk=invoice.pk).update(invoice_number="INV-8")
+        self.assertEqual(self.found(Invoice, "INV-8"), {invoice.pk})
+        self.assertEqual(self.found(Invoice, "inv 8"), {invoice.pk})
+        invoice.delete()
+        self.assertEqual(self.found(Invoice, "initech"), set())
+
+    def test_arabic_variants_match(self):
+        invoice = _invoice("INV-9", supplier=Supplier.objects.create(name="فاتورة المؤسسة"))
+        for query in ("فاتوره", "فاتورة", "فَاتُورَة", "المؤسسه"):
+            self.assertEqual(self.found(Invoice, query), {invoice.pk}, query)
+        self.assertEqual(search.fold("إحسان ٤٢"), "احسان 42")
+
+    def test_every_word_is_a_required_prefix(self):
+        invoice = _invoice("INV-10", supplier=self.supplier, customer=self.customer)
+        self.assertEqual(self.found(Invoice, "acm glob"), {invoice.pk})
+        self.assertEqual(self.found(Invoice, "acme nobody"), set())
+        self.assertEqual(self.found(Invoice, "cme"), set())
+        self.assertEqual(search.matches(Invoice.objects.all(), "  ").count(), 0)
+
+    def walk(self, queryset, query, limit, per_page):
+        """Ids on every page going forward, then on every page going back from the last one."""
+        forward, backward = [], []
+        request = RequestFactory().get('/')
+        while True:
+            page = search.paginate(request, queryset, query, limit=limit, per_page=per_page)
+            self.assertLessEqual(len(page), per_page)
+            forward += [row.pk for row in page]
+            # A page that repeats rows could otherwise send this round in circles
+            self.assertLessEqual(len(forward), Invoice.objects.count())
+            if not page.has_next:
+                break
+            request = RequestFactory().get(f"/{page.next_query}")
+        while True:
+            backward = [row.pk for row in page] + backward
+            self.assertLessEqual(len(backward), Invoice.objects.count())
+            if not page.has_previous:
+                break
+            request = RequestFactory().get(f"/{page.previous_query}")
+            page = search.paginate(request, queryset, query, limit=limit, per_page=per_page)
+        return forward, backward
+
+    def test_paging_crosses_ranked_and_unranked_matches_both_ways(self):
+        invoices = [_invoice(f"INV-{n}", supplier=self.supplier) for n in range(11)]
+        # The invoice number weighs more than the supplier, so these rank above their newer neighbours
+        best = [_invoice(f"ACME-{n}") for n in range(2)]
+        _invoice("OTHER-1", customer=self.customer)
+
+        forward, backward = self.walk(Invoice.objects.all(), "acme", limit=5, per_page=4)
+
+        self.assertEqual(forward[:2], [best[1].pk, best[0].pk])
+        self.assertEqual(sorted(forward), sorted(row.pk for row in invoices + best))
+        self.assertEqual(backward, forward)
+
+    def test_paging_keeps_the_queryset_filters(self):
+        invoices = [_invoice(f"INV-{n}", supplier=self.supplier, total_vat=n % 2) for n in range(9)]
+
+        forward, backward = self.walk(Invoice.objects.filter(total_vat=1), "acme", limit=3, per_page=2)
+
+        self.assertEqual(sorted(forward), sorted(row.pk for row in invoices if row.total_vat == 1))
+        self.assertEqual(backward, forward)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "SQLite indexes stored text without NFKC")
+class PostgreSQLSearchTests(TestCase):
+    def test_presentation_forms_are_folded_when_indexed(self):
+        # "فاتورة" written in Arabic presentation forms, as some PDF text layers produce it
+        invoice = _invoice("INV-11", supplier=Supplier.objects.create(name="\ufed3\ufe8e\ufe97\ufeee\ufead\ufe93"))
+        self.assertEqual(list(search.matches(Invoice.objects.all(), "فاتوره")), [invoice])
+        self.assertEqual(search.ranked_ids(Invoice, "فاتوره"), [invoice.pk])
+
+
+class KeysetPaginationTests(TestCase):
+    DISTANCES = [None, 3, None, 1, 3, 0, None, 1, 3]
+
+    def setUp(self):
+        self.invoices = [
+            _invoice(f"INV-{n}", date=date(2026, 3, 1 + n % 2), duplicate_distance=distance)
+            for n, distance in enumerate(self.DISTANCES)
+        ]
+
+    def expected(self, ordering):
+        """Rows in `ordering` order, NULLs first ascending and last descending, ties by pk in the first key's direction."""
+        rows = sorted(self.invoices, key=lambda row: row.pk, reverse=ordering[0].startswith('-'))
+        for term in reversed(ordering):
+            name = term.lstrip('-')
+            rows = sorted(rows, key=lambda row: (getattr(row, name) is not None, getattr(row, name) or 0),
+                          reverse=term.startswith('-'))
+        return [row.pk for row in rows]
+
+    def walk(self, ordering, per_page=2, query=''):
+        """Ids on every page going forward, then on every page going back from the last one."""
+        paginator = pagination.KeysetPaginator(Invoice.objects.all(), ordering, per_page)
+        forward, backward = [], []
+        page = paginator.page(QueryDict(query))
+        while True:
+            self.assertLessEqual(len(page), per_page)
+            forward += [row.pk for row in page]
+            # A page that repeats rows could otherwise send this round in circles
+            self.assertLessEqual(len(forward), len(self.invoices))
+            if not page.has_next:
+                break
+            page = paginator.page(QueryDict(page.next_query[1:]))
+        while True:
+            backward = [row.pk for row in page] + backward
+            self.assertLessEqual(len(backward), len(self.invoices))
+            if not page.has_previous:
+                break
+            page = paginator.page(QueryDict(page.previous_query[1:]))
+        return forward, backward
+
+    def test_every_row_once_in_both_directions(self):
+        for ordering in (['duplicate_distance'], ['-duplicate_distance'], ['-date', 'duplicate_distance'],
+                         ['date', '-duplicate_distance'], ['-date']):
+            for per_page in (1, 2, 4):
+                with self.subTest(ordering=ordering, per_page=per_page):
+                    forward, backward = self.walk(ordering, per_page)
+                    self.assertEqual(forward, self.expected(ordering))
+                    self.assertEqual(backward, forward)
+
+    def test_before_page_ends_at_the_cursor(self):
+        paginator = pagination.KeysetPaginator(Invoice.objects.all(), ['duplicate_distance'], 3)
+        order = self.expected(['duplicate_distance'])
+        last = paginator.page(QueryDict())
+        for _ in range(2):
+            last = paginator.page(QueryDict(last.next_query[1:]))
+        self.assertEqual([row.pk for row in last], order[6:])
+        self.assertFalse(last.has_next)
+
+        previous = paginator.page(QueryDict(last.previous_query[1:]))
+        self.assertEqual([row.pk for row in previous], order[3:6])
+        self.assertEqual((previous.has_previous, previous.has_next), (True, True))
+
+    def test_invalid_cursors_give_the_first_page(self):
+        paginator = pagination.KeysetPaginator(Invoice.objects.all(), ['-duplicate_distance'], 2)
+        first = [row.pk for row in paginator.page(QueryDict())]
+        for cursor in ("not base64!", pagination._encode(["3"]), pagination._encode(["x", "1"]),
+                       "eyJub3QiOiAibGlzdCJ9"):
+            with self.subTest(cursor=cursor):
+                page = paginator.page(QueryDict(f"after={cursor}"))
+                self.assertEqual([row.pk for row in page], first)
+                self.assertFalse(page.has_previous)
+        self.assertEqual(paginator._values(pagination._encode([None, "7"])), [None, 7])
+
+    def test_filters_are_carried_to_the_neighbouring_pages(self):
+        paginator = pagination.KeysetPaginator(Invoice.objects.all(), ['-date'], 2)
+        page = paginator.page(QueryDict("q=acme&status=draft"))
+        next_query = QueryDict(page.next_query[1:])
+        self.assertEqual((next_query['q'], next_query['status']), ("acme", "draft"))
+
+        page = paginator.page(next_query)
+        previous_query = QueryDict(page.previous_query[1:])
+        self.assertEqual((previous_query['q'], previous_query['status']), ("acme", "draft"))
+        self.assertNotIn(pagination.AFTER, previous_query)
+        self.assertEqual(pagination.page_query(previous_query, pagination.AFTER, "c"), "?q=acme&status=draft&after=c")
+
+
+class ImportTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Import Co", country="Jordan")
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        self.report_path = os.path.join(self.workdir, 'errors.csv')
+
+    def run_import(self, kind, text, chunk_size=2000):
+        return imports.import_file(kind, io.BytesIO(text.encode('utf-8')), f"{kind}.csv", self.report_path,
+                                   chunk_size=chunk_size)
+
+    def report_rows(self):
+        with open(self.report_path, encoding='utf-8', newline='') as fp:
+            return [row[:2] for row in csv.reader(fp)][1:]
+
+    def test_csv_rows_are_streamed_in_chunks(self):
+        read = []
+
+        def rows():
+            for n in range(5):
+                read.append(n)
+                yield n + 2, {'name': f"Supplier {n}", 'company': "Import Co"}
+
+        seen_at_write = []
+        write = imports.SupplierImporter.write
+
+        def recording_write(importer, new, changed, fields):
+            seen_at_write.append(len(read))
+            write(importer, new, changed, fields)
+
+        report = imports.ErrorReport(self.report_path)
+        with mock.patch.object(imports.SupplierImporter, 'write', recording_write):
+            counts = imports.SupplierImporter(chunk_size=2).import_rows(rows(), report)
+
+        self.assertEqual(seen_at_write, [2, 4, 5])
+        self.assertEqual(counts, {'rows': 5, 'created': 5, 'updated': 0, 'failed': 0})
+        self.assertEqual(Supplier.objects.filter(company=self.company).count(), 5)
+
+    def test_read_rows_numbers_records_like_a_spreadsheet(self):
+        text = '\ufeffName,Company\n"Two\nlines",Import Co\n\nAcme,Import Co\n'
+        rows = imports.read_rows(io.BytesIO(text.encode('utf-8')), "suppliers.csv")
+        self.assertEqual(next(rows), (2, {'name': "Two\nlines", 'company': "Import Co"}))
+        self.assertEqual(list(rows), [(4, {'name': "Acme", 'company': "Import Co"})])
+
+    def test_error_report_names_the_failing_rows(self):
+        result = self.run_import('suppliers', (
+            "name,company,supplier_type\n"
+            "Acme,Import Co,company\n"
+            "Globex,Nowhere Co,company\n"
+            ",Import Co,company\n"
+            "Initech,Import Co,robot\n"
+        ))
+
+        self.assertEqual((result['created'], result['failed']), (1, 3))
+        self.assertEqual([error['row'] for error in result['errors']], [3, 4, 5])
+        self.assertEqual(self.report_rows(), [
+            ['3', "company 'Nowhere Co' does not exist"],
+            ['4', "name is required"],
+            ['5', "supplier_type: Value 'robot' is not a valid choice."],
+        ])
+        self.assertEqual(result['report'], self.report_path)
+
+    def test_duplicate_keys_in_one_chunk(self):
+        result = self.run_import('suppliers', (
+            "name,company,city\n"
+            "Acme,Import Co,Amman\n"
+            "Acme,import co,Irbid\n"
+            "Acme,,Zarqa\n"
+        ))
+
+        self.assertEqual((result['created'], result['updated'], result['failed']), (2, 0, 1))
+        self.assertEqual(self.report_rows(), [['3', "same company, name as row 2"]])
+        self.assertEqual(Supplier.objects.get(company=self.company, name="Acme").city, "Amman")
+
+        # In separate chunks the later row updates the one the earlier chunk created
+        result = self.run_import('suppliers', "name,company,city\nBeta,Import Co,Amman\nBeta,Import Co,Irbid\n", chunk_size=1)
+        self.assertEqual((result['created'], result['updated'], result['failed']), (1, 1, 0))
+        self.assertEqual(Supplier.objects.get(company=self.company, name="Beta").city, "Irbid")
+
+    def test_journal_vouchers_resolve_their_company(self):
+        result = self.run_import('journal', (
+            "voucher,date,company,account,debit,credit\n"
+            "V1,2026-03-01,Nowhere Co,1,5,\n"
+            "V1,2026-03-01,Nowhere Co,2,,5\n"
+        ))
+        self.assertEqual((result['created'], result['failed']), (0, 2))
+        self.assertEqual(self.report_rows(), [['2', "voucher V1: company 'Nowhere Co' does not exist"]])
+
+
+def _png(width, height, color=(255, 255, 255)):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class OCRBatchTests(TestCase):
+    def setUp(self):
+        self.server = ocr_stub.start_stub_server()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        endpoint = override_settings(INVOICE_OCR_ENDPOINT=self.server.endpoint)
+        endpoint.enable()
+        self.addCleanup(endpoint.disable)
+        for name in ('_client', '_client_pid'):
+            patcher = mock.patch.object(ocr, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_pages_share_requests_of_at_most_16_images(self):
+        batcher = ocr.OCRBatcher(max_wait=0.5)
+        pages = [_png(40 + n, 30) for n in range(20)]
+
+        futures = [batcher.submit(page) for page in pages]
+        responses = [future.result(timeout=30) for future in futures]
+
+        self.assertEqual(self.server.stats(), {'requests': 2, 'images': 20})
+        # Every caller gets the response for its own image
+        for page, response in zip(pages, responses):
+            self.assertEqual(response.full_text_annotation.text, f"STUB-{hashlib.sha256(page).hexdigest()[:8]}")
+            self.assertEqual(response.full_text_annotation.pages[0].width, Image.open(io.BytesIO(page)).width)
+
+    def test_batches_stay_under_the_byte_limit(self):
+        batcher = ocr.OCRBatcher(max_wait=0)
+        page = 3 * 1024 * 1024
+        batcher._pending = [(b"x" * page, None) for _ in range(5)]
+        self.assertEqual([len(batcher._take_batch()) for _ in range(3)], [2, 2, 1])
+        self.assertLessEqual(2 * page, ocr.MAX_REQUEST_BYTES)
+
+        # A single image over the limit still goes out, on its own
+        batcher._pending = [(b"x" * (ocr.MAX_REQUEST_BYTES + 1), None), (b"x", None)]
+        self.assertEqual([len(batcher._take_batch()) for _ in range(2)], [1, 1])
+
+    def test_a_failed_page_does_not_fail_its_batch(self):
+        batcher = ocr.OCRBatcher(max_wait=0.5)
+        futures = [batcher.submit(content) for content in (_png(50, 40), b"not an image", _png(60, 40))]
+        responses = [future.result(timeout=30) for future in futures]
+
+        self.assertEqual(self.server.stats(), {'requests': 1, 'images': 3})
+        self.assertEqual(responses[1].error.message, "Bad image data.")
+        self.assertTrue(responses[0].full_text_annotation.text.startswith("STUB-"))
+        self.assertFalse(responses[2].error.message)
+
+    def test_scale_response_maps_boxes_back_to_the_original_image(self):
+        response = ocr.OCRBatcher(max_wait=0).annotate(_png(200, 100))
+        word_box = [(v.x, v.y) for v in response.full_text_annotation.pages[0].blocks[0].paragraphs[0].words[0].bounding_box.vertices]
+
+        scaled = ocr.scale_response(response, 2, 1.5)
+
+        page = scaled.full_text_annotation.pages[0]
+        self.assertEqual((page.width, page.height), (400, 150))
+        self.assertEqual(
+            [(v.x, v.y) for v in page.blocks[0].paragraphs[0].words[0].bounding_box.vertices],
+            [(round(x * 2), round(y * 1.5)) for x, y in word_box],
+        )
+        self.assertEqual([(v.x, v.y) for v in scaled.text_annotations[0].bounding_poly.vertices][0], (20, 15))
+
+    def test_boxes_come_back_on_the_original_pixel_grid(self):
+        page_path = os.path.join(tempfile.mkdtemp(), "page.png")
+        self.addCleanup(shutil.rmtree, os.path.dirname(page_path))
+        Image.new('RGB', (3000, 1500), 'white').save(page_path)
+        with mock.patch.object(ocr, '_batcher', None), override_settings(INVOICE_OCR_MAX_SIDE=1000):
+            response = detect_text_blocks(page_path)
+
+        page = response.full_text_annotation.pages[0]
+        self.assertEqual((page.width, page.height), (3000, 1500))
+        # The stub boxed the word at (10, 10)-(10 + 12 * len, 30) on the 1000x500 copy it was sent
+        right = 3 * (10 + 12 * len(response.full_text_annotation.text))
+        for box in (response.text_annotations[0].bounding_poly, page.blocks[0].paragraphs[0].words[0].bounding_box):
+            self.assertEqual([(v.x, v.y) for v in box.vertices], [(30, 30), (right, 30), (right, 90), (30, 90)])
+
+
+class OCRCompressionTests(TestCase):
+    def encoded(self, image, fmt='PNG'):
+        buffer = io.BytesIO()
+        image.save(buffer, format=fmt)
+        return buffer.getvalue()
+
+    def test_large_pages_are_shrunk_to_grayscale_jpeg(self):
+        content = self.encoded(Image.new('RGB', (4000, 2000), (200, 30, 30)))
+        data, scale_x, scale_y = imaging.prepare_for_ocr(content, max_side=2048)
+        with Image.open(io.BytesIO(data)) as image:
+            self.assertEqual((image.format, image.mode, image.size), ('JPEG', 'L', (2048, 1024)))
+        self.assertEqual((scale_x, scale_y), (4000 / 2048, 2000 / 1024))
+
+    def test_noisy_pages_are_squeezed_into_the_byte_budget(self):
+        noise = np.random.default_rng(0).integers(0, 256, (1600, 1200), dtype=np.uint8)
+        content = self.encoded(Image.fromarray(noise))
+        data, scale_x, scale_y = imaging.prepare_for_ocr(content, max_side=2048, max_bytes=300 * 1024)
+        self.assertLessEqual(len(data), 300 * 1024)
+        with Image.open(io.BytesIO(data)) as image:
+            self.assertLess(image.width, 1200)
+            self.assertEqual((scale_x, scale_y), (1200 / image.width, 1600 / image.height))
+
+    def test_compact_pages_are_sent_as_they_are(self):
+        content = _png(300, 200)
+        self.assertEqual(imaging.prepare_for_ocr(content), (content, 1.0, 1.0))
+
+
+class OrientationTests(TestCase):
+    SAMPLE = os.path.join(settings.BASE_DIR, 'invoices', 'invoice_False_34537_p1.png')
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        with Image.open(self.SAMPLE) as img:
+            self.page = img.convert('L')
+
+    def turned(self, angle):
+        path = os.path.join(self.workdir, f"page_{angle}.png")
+        self.page.rotate(angle, expand=True).save(path)
+        return path
+
+    def test_upright_page_is_left_alone(self):
+        path = self.turned(0)
+        self.assertEqual(imaging.estimate_text_angle(path), 0)
+        self.assertEqual(correct_image_orientation(path), path)
+
+    def test_sideways_pages_are_turned_back_upright(self):
+        upright = np.asarray(self.page, dtype=np.float32)
+        for angle in (90, 270):
+            with self.subTest(angle=angle):
+                path = self.turned(angle)
+                self.assertEqual(imaging.estimate_text_angle(path), angle)
+                with Image.open(correct_image_orientation(path)) as fixed:
+                    fixed = np.asarray(fixed.convert('L'), dtype=np.float32)
+                self.assertEqual(fixed.shape, upright.shape)
+                # Far closer to the original than to the original turned upside down
+                self.assertLess(np.abs(fixed - upright).mean() * 10, np.abs(fixed[::-1, ::-1] - upright).mean())
+
+
+class GroupingTests(TestCase):
+    def signals(self, *pages):
+        return [grouping.page_signals(text, qr) for text, qr in pages]
+
+    def test_page_footers(self):
+        for text, expected in (
+            ("Page No. : 1 of 1", (1, 1)),
+            ("Page No.\n: 3 of 4", (3, 4)),
+            ("Page 2 of 3", (2, 3)),
+            ("page: 2/3", (2, 3)),
+            ("صفحة ٢ من ٣", (2, 3)),
+            ("Page 4 of 3", (None, None)),
+            ("Homepage 1 of 2", (None, None)),
+        ):
+            signals = grouping.page_signals(text)
+            self.assertEqual((signals.page, signals.page_count), expected, text)
+
+    def test_sample_invoice_footer(self):
+        with open(os.path.join(settings.BASE_DIR, 'invoices', 'invoice_False_34537.pdf'), 'rb') as fp:
+            texts = grouping.page_texts(fp.read())
+        signals = grouping.page_signals(texts[0])
+        self.assertEqual((signals.page, signals.page_count), (1, 1))
+
+    def test_footers_tie_pages_together(self):
+        pages = self.signals(("Page 1 of 2", None), ("Page 2 of 2", None), ("Page 1 of 1", None))
+        self.assertEqual(grouping.group_pages(pages), [[1, 2], [3]])
+        pages = self.signals(("Page 1 of 3", None), ("Notes", None), ("Page 3 of 3", None))
+        self.assertEqual(grouping.group_pages(pages), [[1, 2, 3]])
+        # A last page ("k of k") closes its invoice even when the next page says nothing
+        pages = self.signals(("Page 1 of 2", None), ("Page 2 of 2", None), ("Notes", None))
+        self.assertEqual(grouping.group_pages(pages), [[1, 2], [3]])
+
+    def test_invoice_numbers_split_pages(self):
+        pages = self.signals(("Invoice No: INV-1042", None), ("Terms", None), ("Invoice No: INV-1042", None),
+                             ("رقم الفاتورة: 1043", None))
+        self.assertEqual(grouping.group_pages(pages), [[1, 2, 3], [4]])
+
+    def test_qr_codes_open_or_close_invoices(self):
+        closing = self.signals(("", None), ("", "qr-a"), ("", None), ("", "qr-b"))
+        self.assertEqual(grouping.group_pages(closing), [[1, 2], [3, 4]])
+        opening = self.signals(("", "qr-a"), ("", None), ("", "qr-b"), ("", None))
+        self.assertEqual(grouping.group_pages(opening), [[1, 2], [3, 4]])
+
+    def test_pages_without_signals_stay_together(self):
+        self.assertEqual(grouping.group_pages(self.signals(("", None), ("", None))), [[1, 2]])
+        self.assertEqual(grouping.group_pages([]), [])
+
+
+class ChunkedUploadTests(TestCase):
+    CONTENT = b"%PDF-1.4 chunked invoice upload"
+
+    def setUp(self):
+        self.user = User.objects.create_user("uploader")
+        self.client.force_login(self.user)
+        staging = override_settings(INVOICE_UPLOAD_STAGING_DIR=tempfile.mkdtemp())
+        staging.enable()
+        self.addCleanup(shutil.rmtree, settings.INVOICE_UPLOAD_STAGING_DIR, ignore_errors=True)
+        self.addCleanup(staging.disable)
+        schedule = mock.patch.object(views, '_schedule_upload')
+        self.schedule = schedule.start()
+        self.addCleanup(schedule.stop)
+
+    def start(self, content=CONTENT, **headers):
+        response = self.client.post(
+            reverse('finance-invoice-upload-start'), {'filename': "scan.pdf", 'size': len(content)},
+            content_type='application/json', headers=headers,
+        )
+        return response.status_code, response.json()
+
+    def put(self, state, offset, data):
+        response = self.client.put(state['chunk_url'], data, content_type='application/octet-stream',
+                                   headers={'Upload-Offset': str(offset)})
+        return response.status_code, response.json()
+
+    def finalize(self, state, sha256=''):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(state['finalize_url'], {'sha256': sha256}, content_type='application/json')
+        return response.status_code, response.json()
+
+    def test_chunks_resume_from_the_received_offset(self):
+        status, state = self.start()
+        self.assertEqual((status, state['offset'], state['status']), (201, 0, 'uploading'))
+
+        self.assertEqual(self.put(state, 0, self.CONTENT[:10])[1]['offset'], 10)
+        # A retried or out-of-order chunk is refused and told where to carry on
+        status, conflict = self.put(state, 4, self.CONTENT[4:20])
+        self.assertEqual((status, conflict['offset']), (409, 10))
+        self.assertEqual(self.client.get(state['status_url']).json()['offset'], 10)
+        status, _ = self.finalize(state)
+        self.assertEqual(status, 409)
+
+        # Another process takes over: the running hash is rebuilt from the staged bytes
+        views._upload_hashers.clear()
+        self.assertEqual(self.put(state, 10, self.CONTENT[10:])[1]['offset'], len(self.CONTENT))
+        with open(views._staging_path(InvoiceUpload.objects.get()), 'rb') as fp:
+            self.assertEqual(fp.read(), self.CONTENT)
+
+        self.assertEqual(self.finalize(state, sha256="0" * 64)[0], 400)
+        status, state = self.finalize(state, sha256=hashlib.sha256(self.CONTENT).hexdigest())
+        self.assertEqual((status, state['status'], state['sha256']), (202, 'queued', hashlib.sha256(self.CONTENT).hexdigest()))
+        self.schedule.assert_called_once_with(InvoiceUpload.objects.get().pk)
+        # Finalize is idempotent
+        self.assertEqual(self.finalize(state)[1]['status'], 'queued')
+        self.schedule.assert_called_once()
+
+    def test_idempotency_key_reopens_the_same_upload(self):
+        _, first = self.start(**{'Idempotency-Key': "scan-1"})
+        status, again = self.start(**{'Idempotency-Key': "scan-1"})
+        self.assertEqual((status, again['upload_id']), (200, first['upload_id']))
+        self.assertEqual(InvoiceUpload.objects.count(), 1)
+
+    def test_same_bytes_twice_are_ingested_once(self):
+        for _ in range(2):
+            _, state = self.start()
+            self.put(state, 0, self.CONTENT)
+            status, state = self.finalize(state)
+        self.assertEqual((status, state['status'], state['result']['duplicates']), (202, 'done', 1))
+        self.assertEqual(self.schedule.call_count, 1)
+
+
+class ImagePoolTests(TestCase):
+    def setUp(self):
+        previous, imaging._pool = imaging._pool, None
+        self.addCleanup(setattr, imaging, '_pool', previous)
+        self.addCleanup(self.shutdown_pool)
+
+    def shutdown_pool(self):
+        if imaging._pool is not None:
+            imaging._pool.shutdown()
+        imaging._reset_pool()
+
+    def pdf(self, pages):
+        doc = fitz.open()
+        for number in range(pages):
+            doc.new_page(width=200, height=100).insert_text((20, 50), f"Page {number + 1}")
+        return doc.tobytes()
+
+    def test_pages_rendered_in_workers_match_inline_rendering(self):
+        pdf_bytes = self.pdf(3)
+        with override_settings(INVOICE_IMAGE_WORKERS=0):
+            self.assertIsNone(imaging._get_pool())
+            inline = imaging.render_pdf_pages_png(pdf_bytes)
+        with override_settings(INVOICE_IMAGE_WORKERS=2):
+            pool = imaging._get_pool()
+            self.assertIs(imaging._get_pool(), pool)
+            pooled = imaging.render_pdf_pages_png(pdf_bytes)
+
+        self.assertEqual(len(pooled), 3)
+        self.assertEqual(pooled, inline)
+        with Image.open(io.BytesIO(pooled[0])) as page:
+            self.assertEqual(page.size, (200 * imaging.PDF_RENDER_ZOOM, 100 * imaging.PDF_RENDER_ZOOM))
+
+    def test_shared_bytes_are_readable_by_reference_and_freed_afterwards(self):
+        with imaging._SharedBytes(b"%PDF shared") as shared:
+            self.assertEqual(imaging._load_source(shared.ref), b"%PDF shared")
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=shared.ref[1])
+        self.assertEqual(imaging._load_source(b"raw"), b"raw")
+
+    def test_a_dead_worker_gets_a_fresh_pool(self):
+        with override_settings(INVOICE_IMAGE_WORKERS=1):
+            broken = imaging._get_pool()
+            with self.assertRaises(BrokenProcessPool):
+                imaging._run(os._exit, 1)
+            self.assertIsNone(imaging._pool)
+            broken.shutdown()
+            self.assertEqual(imaging.merge_images_vertically([_png(10, 5, 'white'), _png(20, 5, 'black')])[:4], b"\x89PNG")
+
+
+class LineItemTests(TestCase):
+    SAMPLE = os.path.join(settings.BASE_DIR, 'invoices', 'invoice_False_34537.pdf')
+
+    def pdf(self, rows):
+        path = os.path.join(tempfile.mkdtemp(), "invoice.pdf")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        doc = fitz.open()
+        page = doc.new_page()
+        for y, cells in rows:
+            for x, text in cells:
+                page.insert_text((x, y), text, fontsize=9)
+        doc.save(path)
+        return path
+
+    def test_sample_invoice_items_stop_at_the_totals_line(self):
+        items = lineitems.extract_line_items(self.SAMPLE)
+        self.assertEqual(
+            [(item["Item Name"], item["Quantity"], item["Unit Price"], item["Total Price"]) for item in items],
+            [
+                ("Accommodation / Package إقامة لمدة ليلة", 1, 460.0, 460.0),
+                ("Municipality Tax ضريبة رسوم بلدية", 1, 11.51, 11.51),
+                ("VAT-SVC Room تكلفة خدمة - القيمة المضافة", 1, 70.71, 70.71),
+            ],
+        )
+        self.assertEqual(round(sum(item["Total Price"] for item in items), 2), 542.22)
+
+    def test_columns_are_read_from_the_header_and_wrapped_lines_join_the_description(self):
+        path = self.pdf([
+            (100, [(50, "Description"), (300, "Qty"), (380, "Unit"), (410, "Price"), (480, "Amount")]),
+            (120, [(50, "Steel pipes"), (300, "4"), (380, "25.50"), (480, "102.00")]),
+            (132, [(50, "2 inch, galvanised")]),
+            (144, [(50, "Delivery"), (300, "2"), (380, "15.00")]),
+            (170, [(400, "Subtotal"), (480, "132.00")]),
+            (182, [(50, "Not an item"), (300, "1"), (480, "9.00")]),
+        ])
+        self.assertEqual(lineitems.extract_line_items(path), [
+            {"Item Name": "Steel pipes", "Item Description": "2 inch, galvanised",
+             "Quantity": 4, "Unit Price": 25.5, "Total Price": 102.0},
+            {"Item Name": "Delivery", "Item Description": None,
+             "Quantity": 2, "Unit Price": 15.0, "Total Price": 30.0},
+        ])
+
+    def test_pages_without_an_item_table_give_none(self):
+        path = self.pdf([(100, [(50, "Dear customer,")]), (120, [(50, "Total due"), (300, "10.00")])])
+        self.assertIsNone(lineitems.extract_line_items(path))
+
+
+@override_settings(INVOICE_INGEST_MAX_ATTEMPTS=2, INVOICE_INGEST_RETRY_BASE_SECONDS=30, INVOICE_INGEST_RETRY_MAX_SECONDS=60)
+class IngestionRetryTests(TestCase):
+    def setUp(self):
+        staging = override_settings(INVOICE_UPLOAD_STAGING_DIR=tempfile.mkdtemp())
+        staging.enable()
+        self.addCleanup(shutil.rmtree, settings.INVOICE_UPLOAD_STAGING_DIR, ignore_errors=True)
+        self.addCleanup(staging.disable)
+        self.upload = InvoiceUpload.objects.create(filename="scan.pdf", total_size=4, received_bytes=4, status='queued')
+        with open(views._staging_path(self.upload), 'wb') as fp:
+            fp.write(b"%PDF")
+        for name in ('_schedule_upload', 'upload_invoice_for_project'):
+            patcher = mock.patch.object(views, name)
+            setattr(self, name.strip('_'), patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def attempt(self, outcome):
+        if isinstance(outcome, Exception):
+            self.upload_invoice_for_project.side_effect = outcome
+        else:
+            self.upload_invoice_for_project.side_effect = None
+            self.upload_invoice_for_project.return_value = outcome
+        views._run_upload_task(self.upload.pk)
+        self.upload.refresh_from_db()
+        return self.upload
+
+    def test_transient_failures_back_off_then_dead_letter(self):
+        upload = self.attempt(requests.exceptions.ConnectionError("reset by peer"))
+        self.assertEqual((upload.status, upload.attempts, upload.error), ('retrying', 1, "reset by peer"))
+        (pk, delay), _ = self.schedule_upload.call_args
+        self.assertEqual(pk, upload.pk)
+        self.assertTrue(15 <= delay <= 30)
+        self.assertAlmostEqual((upload.next_attempt_at - timezone.now()).total_seconds(), delay, delta=5)
+        # Not due until the backoff has passed
+        self.assertFalse(views.due_uploads().exists())
+        InvoiceUpload.objects.filter(pk=upload.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(list(views.due_uploads()), [upload])
+
+        upload = self.attempt(requests.exceptions.Timeout("read timed out"))
+        self.assertEqual((upload.status, upload.attempts, upload.next_attempt_at), ('dead', 2, None))
+        self.assertEqual((upload.dead_letter.attempts, upload.dead_letter.transient), (2, True))
+        self.assertIn("Timeout", upload.dead_letter.traceback)
+        self.assertEqual(self.schedule_upload.call_count, 1)
+        self.assertFalse(views.due_uploads().exists())
+
+    def test_permanent_failures_dead_letter_at_once(self):
+        upload = self.attempt(views.PageIngestionError([(2, ValueError("no total")), (1, OperationalError("locked"))]))
+        self.assertEqual((upload.status, upload.attempts), ('dead', 1))
+        self.assertEqual(upload.error, "page 1: locked; page 2: no total")
+        self.assertFalse(upload.dead_letter.transient)
+        self.schedule_upload.assert_not_called()
+
+    def test_requeued_dead_letters_get_a_fresh_budget(self):
+        self.attempt(ValueError("bad file"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(views.requeue_dead_letters(InvoiceDeadLetter.objects.all()), [self.upload.pk])
+        self.upload.refresh_from_db()
+        self.assertEqual((self.upload.status, self.upload.attempts, self.upload.error), ('queued', 0, ''))
+        self.assertFalse(InvoiceDeadLetter.objects.exists())
+        self.schedule_upload.assert_called_once_with(self.upload.pk)
+
+        upload = self.attempt({'created': 1})
+        self.assertEqual((upload.status, upload.result, upload.attempts), ('done', {'created': 1}, 1))
+        self.assertFalse(os.path.exists(views._staging_path(upload)))
+        # A finished upload is never claimed again
+        self.attempt(ValueError("late timer"))
+        self.assertEqual((upload.status, self.upload_invoice_for_project.call_count), ('done', 2))
+
+    def test_backoff_doubles_up_to_the_cap(self):
+        with mock.patch('random.uniform', return_value=1.0):
+            self.assertEqual([views._retry_delay(attempts) for attempts in (1, 2, 3, 4)], [30, 60, 60, 60])
+
+
+class WatchFolderTests(TransactionTestCase):
+    EXTENSIONS = ('.pdf', '.png')
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        staging = override_settings(INVOICE_UPLOAD_STAGING_DIR=os.path.join(self.root, 'staging'))
+        staging.enable()
+        self.addCleanup(staging.disable)
+        self.inbox = os.path.join(self.root, 'inbox')
+        os.makedirs(self.inbox)
+
+    def drop(self, name, content=b"%PDF invoice", directory=None):
+        path = os.path.join(directory or self.inbox, name)
+        with open(path, 'wb') as fp:
+            fp.write(content)
+        return path
+
+    def test_listing_skips_hidden_foreign_and_fresh_files(self):
+        self.drop("a.pdf"), self.drop(".partial.pdf"), self.drop("notes.txt"), self.drop("b.PNG")
+        os.makedirs(os.path.join(self.inbox, 'done.pdf'))
+        self.assertEqual(
+            [os.path.basename(path) for path in watchfolder.list_files(self.inbox, self.EXTENSIONS)], ["a.pdf", "b.PNG"]
+        )
+        self.assertEqual(watchfolder.list_files(self.inbox, self.EXTENSIONS, settle_seconds=60), [])
+        self.assertEqual(watchfolder.list_files(os.path.join(self.root, 'missing'), self.EXTENSIONS), [])
+
+    def test_polling_reports_a_file_once_it_stops_changing(self):
+        watcher = watchfolder.PollingWatcher([self.inbox], self.EXTENSIONS, settle_seconds=0)
+        path = self.drop("scan.pdf")
+        self.assertEqual(watcher.poll(0), [])
+        self.assertEqual(watcher.poll(0), [path])
+        self.assertEqual(watcher.poll(0), [])
+        # The daemon moves reported files away; a new file under the same name is reported again
+        os.remove(path)
+        self.assertEqual(watcher.poll(0), [])
+        self.drop("scan.pdf", b"%PDF next invoice")
+        self.assertEqual(watcher.poll(0), [])
+        self.assertEqual(watcher.poll(0), [path])
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), "inotify is Linux only")
+    def test_inotify_reports_closed_and_moved_in_files(self):
+        watcher = watchfolder.InotifyWatcher([self.inbox], self.EXTENSIONS)
+        self.addCleanup(watcher.close)
+        self.assertEqual(watcher.poll(0), [])
+        closed = self.drop("closed.pdf")
+        self.drop(".hidden.pdf"), self.drop("notes.txt")
+        moved = os.path.join(self.inbox, "moved.png")
+        os.replace(self.drop("moved.png", directory=self.root), moved)
+        self.assertEqual(watcher.poll(1), [closed, moved])
+
+    def test_once_ingests_the_backlog_and_files_by_outcome(self):
+        self.drop("good.pdf"), self.drop("bad.pdf", b"%PDF broken"), self.drop("notes.txt")
+
+        def process(upload_pk):
+            upload = InvoiceUpload.objects.get(pk=upload_pk)
+            status = 'done' if upload.filename == "good.pdf" else 'dead'
+            InvoiceUpload.objects.filter(pk=upload_pk).update(status=status, error="unreadable")
+
+        out = io.StringIO()
+        with mock.patch('finance.management.commands.watch_invoices.process_staged_upload', side_effect=process):
+            call_command('watch_invoices', dir=[self.inbox], once=True, settle=0, stdout=out, stderr=io.StringIO())
+
+        listing = {name: sorted(os.listdir(os.path.join(self.inbox, name))) for name in ('processing', 'done', 'failed')}
+        self.assertEqual(listing, {'processing': [], 'done': ["good.pdf"], 'failed': ["bad.pdf"]})
+        self.assertEqual(sorted(os.listdir(self.inbox)), ["done", "failed", "notes.txt", "processing"])
+        self.assertIn("2 file(s) already waiting", out.getvalue())
+
+    def test_files_left_in_processing_are_reattached_to_their_upload(self):
+        with open(self.drop("left.pdf"), 'rb') as fp:
+            upload = views.stage_upload_file(File(fp, name="left.pdf"), None)
+        InvoiceUpload.objects.filter(pk=upload.pk).update(status='done')
+        os.makedirs(os.path.join(self.inbox, 'processing'))
+        os.replace(os.path.join(self.inbox, "left.pdf"), os.path.join(self.inbox, 'processing', "left.pdf"))
+
+        with mock.patch('finance.management.commands.watch_invoices.process_staged_upload') as process:
+            call_command('watch_invoices', dir=[self.inbox], once=True, stdout=io.StringIO())
+        process.assert_not_called()
+        self.assertEqual(os.listdir(os.path.join(self.inbox, 'done')), ["left.pdf"])
+        self.assertEqual(InvoiceUpload.objects.count(), 1)
+
+
+class PreviewTests(TestCase):
+    SAMPLE_PDF = os.path.join(settings.BASE_DIR, 'invoices', 'invoice_False_34537.pdf')
+    SAMPLE_PNG = os.path.join(settings.BASE_DIR, 'invoices', 'invoice_False_34537_p1.png')
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, ignore_errors=True)
+        storage = override_settings(STORAGES={
+            **settings.STORAGES,
+            'invoice_previews': {
+                'BACKEND': "django.core.files.storage.FileSystemStorage", 'OPTIONS': {'location': self.location},
+            },
+        })
+        storage.enable()
+        self.addCleanup(storage.disable)
+        self.client.force_login(User.objects.create_user("viewer"))
+
+    def test_previews_are_small_webp_stored_under_their_hash(self):
+        for source in (self.SAMPLE_PDF, self.SAMPLE_PNG):
+            with self.subTest(source=os.path.basename(source)):
+                key = previews.store_preview(source)
+                self.assertTrue(previews.is_key(key))
+                path = os.path.join(self.location, key[:2], f"{key}.webp")
+                with open(path, 'rb') as fp:
+                    self.assertEqual(hashlib.sha256(fp.read()).hexdigest(), key)
+                with Image.open(path) as image:
+                    self.assertEqual((image.format, max(image.size)), ('WEBP', settings.INVOICE_PREVIEW_MAX_SIDE))
+                # The same document again reuses the stored file
+                self.assertEqual(previews.store_preview(source), key)
+                self.assertEqual(os.listdir(os.path.dirname(path)), [f"{key}.webp"])
+
+    def test_unreadable_sources_get_no_preview(self):
+        broken = os.path.join(self.location, "broken.png")
+        with open(broken, 'wb') as fp:
+            fp.write(b"not an image")
+        self.assertEqual(previews.store_preview(broken), '')
+
+    def test_previews_are_served_with_an_etag_and_revalidated(self):
+        key = previews.store_preview(self.SAMPLE_PNG)
+        url = reverse('finance-invoice-preview', args=[key])
+
+        response = self.client.get(url)
+        self.assertEqual((response.status_code, response['Content-Type'], response['ETag']), (200, 'image/webp', f'"{key}"'))
+        self.assertEqual(hashlib.sha256(b"".join(response.streaming_content)).hexdigest(), key)
+        self.assertEqual(response['Cache-Control'], 'private, max-age=31536000, immutable')
+
+        response = self.client.get(url, headers={'If-None-Match': f'"{key}"'})
+        self.assertEqual((response.status_code, response.content, response['ETag']), (304, b"", f'"{key}"'))
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': '"other"'}).status_code, 200)
+
+    def test_unknown_keys_and_anonymous_users_are_refused(self):
+        key = previews.store_preview(self.SAMPLE_PNG)
+        self.assertEqual(self.client.get(reverse('finance-invoice-preview', args=["f" * 64])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('finance-invoice-preview', args=["not-a-hash"])).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('finance-invoice-preview', args=[key])).status_code, 302)
@@ -0,0 +1,120 @@
+import re
+import unicodedata
+from collections import Counter
+
+try:
+    import tiktoken
+except ImportError:  # optional; token counts fall back to a chars/4 estimate
+    tiktoken = None
+
+# Shrinks extracted invoice text before it is sent to the LLM. Pages are
+# separated by form feeds (as pdfminer and extract_text_from_pdf emit them).
+# Whitespace is collapsed, headers/footers repeated on every page are kept
+# only once, and long documents are cut down to the lines around the fields
+# we extract plus anything that looks like a line-item row.
+
+ENGLISH_ANCHORS = re.compile(
+    r"\b(?:invoice|inv\s*no|receipt|bill\s*to|tax|vat|total|sub\s*total|amount|net|due|date|"
+    r"supplier|vendor|seller|customer|client|buyer|qty|quantity|unit|price|description|item)",
+    re.IGNORECASE,
+)
+ARABIC_ANCHORS = re.compile(
+    r"فاتورة|رقم|ضريب|إجمالي|اجمالي|الإجمالي|الاجمالي|المجموع|مبلغ|تاريخ|المورد|البائع|العميل|المشتري|"
+    r"الكمية|السعر|الوصف|الصنف|البيان"
+)
+PAGE_COUNTERS = (re.compile(r"\bpage\b|\bof\b", re.IGNORECASE), re.compile(r"صفحة|الصفحة"))
+ANCHORS = (ENGLISH_ANCHORS, ARABIC_ANCHORS)
+NUMBER_PATTERN = re.compile(r"\d[\d,]*(?:\.\d+)?")
+WHITESPACE_PATTERN = re.compile(r"[ \t\u00a0\u200e\u200f]+")
+
+HEADER_FOOTER_LINES = 4  # lines at the top/bottom of a page that may be a running header/footer
+ANCHOR_WINDOW = 2  # lines kept on each side of an anchor line
+LEADING_LINES = 8  # the first page's opening lines usually carry the supplier name
+
+
+def count_tokens(text, model="gpt-4o"):
+    if tiktoken is not None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def _matches(patterns, line):
+    """
+    pdfplumber emits Arabic as presentation forms in visual order; NFKC folds the
+    glyphs back to letters and the reversed copy restores the Arabic reading order.
+    """
+    english, arabic = patterns
+    folded = unicodedata.normalize("NFKC", line)
+    return bool(english.search(folded) or arabic.search(folded) or arabic.search(folded[::-1]))
+
+
+def _running_key(line):
+    # Page counters differ per page ("Page 2 of 5"); anything else must repeat verbatim
+    return NUMBER_PATTERN.sub("#", line) if _matches(PAGE_COUNTERS, line) else line
+
+
+def _normalize_pages(text):
+    pages = []
+    for page in text.split("\f"):
+        lines = [WHITESPACE_PATTERN.sub(" ", line).strip() for line in page.splitlines()]
+        lines = [line for line in lines if line]
+        if lines:
+            pages.append(lines)
+    return pages
+
+
+def _running_lines(pages):
+    """Lines that repeat in the header/footer zone of most pages."""
+    if len(pages) < 2:
+        return set()
+    seen = Counter()
+    for lines in pages:
+        edge = lines[:HEADER_FOOTER_LINES] + lines[-HEADER_FOOTER_LINES:]
+        seen.update({_running_key(line) for line in edge})
+    threshold = max(2, (len(pages) + 1) // 2)
+    return {line for line, count in seen.items() if count >= threshold}
+
+
+def _is_table_row(line):
+    return len(NUMBER_PATTERN.findall(line)) >= 2
+
+
+def reduce_invoice_text(text, min_chars=2000):
+    """
+    Returns the text to send to the LLM.
+
+    Documents shorter than `min_chars` after whitespace and header/footer removal
+    are returned whole; longer ones keep only anchor neighbourhoods and table rows.
+    """
+    pages = _normalize_pages(text or "")
+    running = _running_lines(pages)
+
+    lines = []
+    for page_number, page_lines in enumerate(pages):
+        for line in page_lines:
+            # Keep running headers/footers once, on the first page
+            if page_number and _running_key(line) in running:
+                continue
+            lines.append(line)
+
+    if sum(len(line) + 1 for line in lines) <= min_chars:
+        return "\n".join(lines)
+
+    keep = set(range(min(LEADING_LINES, len(lines))))
+    for index, line in enumerate(lines):
+        if _matches(ANCHORS, line):
+            keep.update(range(max(0, index - ANCHOR_WINDOW), min(len(lines), index + ANCHOR_WINDOW + 1)))
+        elif _is_table_row(line):
+            keep.add(index)
+
+    reduced, previous = [], None
+    for index in sorted(keep):
+        if previous is not None and index != previous + 1:
+            reduced.append("...")
+        reduced.append(lines[index])
+        previous = index
+    return "\n".join(reduced)
@@ -0,0 +1,44 @@
+from django.db import connections
+from django.db.migrations.executor import MigrationExecutor
+
+from . import counters, search
+
+# finance.search and finance.counters keep their tables current with database
+# triggers, which schema changes trip over: SQLite rebuilds a table for most
+# ALTERs, which fails while another table's trigger names it and silently drops
+# the table's own triggers; PostgreSQL cannot change the type of a column a
+# trigger names and drops the trigger with the column. So a migrate run that
+# applies finance migrations drops all of them first (pre_migrate), and every
+# migrate (and flush) installs them again afterwards (post_migrate), indexing
+# and counting whatever was written in between. Migrations never touch them.
+# The triggers are written for the current models, so after migrating finance
+# back to an older state they stay off until it is migrated forward again.
+#
+# Only added and deleted rows are caught up: after a data migration that
+# rewrites indexed text, run `manage.py rebuild_search_index`. After applying
+# `sqlmigrate` output by hand, run `manage.py reconcile_row_counts --reinstall`
+# and `manage.py rebuild_search_index`.
+
+
+def drop(sender, using, plan=None, **kwargs):
+    """pre_migrate receiver: drop the triggers before finance migrations change the schema."""
+    if not any(migration.app_label == 'finance' for migration, _ in plan or ()):
+        return
+    connection = connections[using]
+    if search.installed(connection):
+        search.drop_triggers(connection)
+    if counters.installed(connection):
+        counters.uninstall(connection)
+
+
+def install(sender, using, **kwargs):
+    """post_migrate receiver: (re)install the triggers once finance is fully migrated."""
+    connection = connections[using]
+    executor = MigrationExecutor(connection)
+    if executor.migration_plan([node for node in executor.loader.graph.leaf_nodes() if node[0] == 'finance']):
+        print("finance has unapplied migrations; search and row count triggers stay off until they are applied")
+        return
+    if search.installed(connection):
+        search.install(connection, rebuild=False)
+    if counters.installed(connection):
+        counters.install(connection)
@@ -2,7 +2,7 @@ from django.urls import path
 
 from finance.models import TaxWithholdingCategory
 
-from .views import AccountingDimensionCreate, AccountingDimensionDelete, AccountingDimensionEdit, AccountingDimensions, BankAccountCreate, BankAccountDelete, BankAccountEdit, BankAccountSubTypeCreate, BankAccountSubTypeDelete, BankAccountSubTypeEdit, BankAccountSubTypes, BankAccountTypeCreate, BankAccountTypeDelete, BankAccountTypeEdit, BankAccountTypes, BankAccounts, BankGuaranteeCreate, BankGuaranteeCreate, BankGuaranteeDelete, BankGuaranteeEdit, BankGuarantees, Budgets,BudgetCreate,BudgetEdit, BudgetDelete, CostCenterAllocations, CostCenterAllocationsCreate, CostCenterAllocationsDelete, CostCenterAllocationsEdit,CostCenterDelete, CostCenterCreate, CostCenterEdit, CostCenters, CustomerCreate, CustomerDelete, CustomerEdit, Customers, DeductionCertificateCreate, DeductionCertificateDelete, DeductionCertificateEdit, DeductionCertificateView, DunningCreate, DunningDelete, DunningEdit, DunningList, DunningTypeCreate, DunningTypeDelete, DunningTypeEdit, DunningTypeList, Login, ProcessPaymentReconciliationCreate, ProcessPaymentReconciliationDelete, ProcessPaymentReconciliationEdit, ProcessPaymentReconciliationList, Signup, Logout, Dashboard, Journal, TaxCategories, TaxCategoryCreate, TaxCategoryDelete, TaxCategoryEdit, TaxItemTemplates, TaxItemTemplatesCreate, TaxItemTemplatesEdit, TaxItemTemplatesDelete, TaxRuleView, TaxRulesCreate, TaxRulesDelete, TaxRulesEdit, TaxWithholdingCategoryCreate, TaxWithholdingCategoryDelete, TaxWithholdingCategoryEdit, TaxWithholdingCategoryList, TrialBalance, Ledger, Companies, Payables, Invoices, Receivables, InvoiceScan, Reports, CompanyCreate, CompanyEdit, CompanyDelete, Accounts,AccountCreate,AccountEdit, AccountDelete, InvoiceCreate, InvoiceEdit, InvoiceDelete, JournalCreate, JournalEdit, JournalDelete, Suppliers, SupplierCreate, SupplierEdit, SupplierDelete, UnreconcilePaymentCreate, UnreconcilePaymentDelete, UnreconcilePaymentEdit, UnreconcilePayments, create_invoice
+from .views import AccountingDimensionCreate, AccountingDimensionDelete, AccountingDimensionEdit, AccountingDimensions, BankAccountCreate, BankAccountDelete, BankAccountEdit, BankAccountSubTypeCreate, BankAccountSubTypeDelete, BankAccountSubTypeEdit, BankAccountSubTypes, BankAccountTypeCreate, BankAccountTypeDelete, BankAccountTypeEdit, BankAccountTypes, BankAccounts, BankGuaranteeCreate, BankGuaranteeCreate, BankGuaranteeDelete, BankGuaranteeEdit, BankGuarantees, Budgets,BudgetCreate,BudgetEdit, BudgetDelete, CostCenterAllocations, CostCenterAllocationsCreate, CostCenterAllocationsDelete, CostCenterAllocationsEdit,CostCenterDelete, CostCenterCreate, CostCenterEdit, CostCenters, CustomerCreate, CustomerDelete, CustomerEdit, Customers, DeductionCertificateCreate, DeductionCertificateDelete, DeductionCertificateEdit, DeductionCertificateView, DunningCreate, DunningDelete, DunningEdit, DunningList, DunningTypeCreate, DunningTypeDelete, DunningTypeEdit, DunningTypeList, Login, ProcessPaymentReconciliationCreate, ProcessPaymentReconciliationDelete, ProcessPaymentReconciliationEdit, ProcessPaymentReconciliationList, Signup, Logout, Dashboard, Journal, TaxCategories, TaxCategoryCreate, TaxCategoryDelete, TaxCategoryEdit, TaxItemTemplates, TaxItemTemplatesCreate, TaxItemTemplatesEdit, TaxItemTemplatesDelete, TaxRuleView, TaxRulesCreate, TaxRulesDelete, TaxRulesEdit, TaxWithholdingCategoryCreate, TaxWithholdingCategoryDelete, TaxWithholdingCategoryEdit, TaxWithholdingCategoryList, TrialBalance, Ledger, Companies, Payables, Invoices, DataImport, DataImportReport, Receivables, InvoiceScan, Reports, CompanyCreate, CompanyEdit, CompanyDelete, Accounts,AccountCreate,AccountEdit, AccountDelete, InvoiceCreate, InvoiceEdit, InvoiceDelete, JournalBulkPost, JournalCreate, JournalEdit, JournalDelete, Suppliers, SupplierCreate, SupplierEdit, SupplierDelete, UnreconcilePaymentCreate, UnreconcilePaymentDelete, UnreconcilePaymentEdit, UnreconcilePayments, create_invoice, InvoiceUploadStart, InvoiceUploadDetail, InvoiceUploadChunk, InvoiceUploadFinalize, InvoicePipelineMetrics, InvoicePreview, InvoiceSpend
 
 urlpatterns = [
      # ============ Authentication ============
@@ -34,6 +34,9 @@ urlpatterns = [
      # ============ Journal Entry Management ============
     path('journal/', Journal.as_view(), name='finance-journal'),
     path('journal/add/', JournalCreate.as_view(), name='finance-journal-create'),
+    path('journal/bulk/', JournalBulkPost.as_view(), name='finance-journal-bulk'),
+    path('import/<str:kind>/', DataImport.as_view(), name='finance-import'),
+    path('import/reports/<str:name>.csv', DataImportReport.as_view(), name='finance-import-report'),
     path('journal/<int:pk>/edit/', JournalEdit.as_view(), name='finance-journal-edit'),
     path('journal/<int:pk>/delete/', JournalDelete.as_view(), name='finance-journal-delete'),
 
@@ -44,6 +47,11 @@ urlpatterns = [
     path('reports/', Reports.as_view(), name='finance-reports'),
     path('scan/', InvoiceScan.as_view(), name='finance-scan'),
     path('scan/scan/', create_invoice, name='finance-invoice-scan'),
+    path('scan/uploads/', InvoiceUploadStart.as_view(), name='finance-invoice-upload-start'),
+    path('scan/uploads/<uuid:upload_id>/', InvoiceUploadDetail.as_view(), name='finance-invoice-upload-detail'),
+    path('scan/uploads/<uuid:upload_id>/chunk/', InvoiceUploadChunk.as_view(), name='finance-invoice-upload-chunk'),
+    path('scan/uploads/<uuid:upload_id>/finalize/', InvoiceUploadFinalize.as_view(), name='finance-invoice-upload-finalize'),
+    path('scan/metrics/', InvoicePipelineMetrics.as_view(), name='finance-invoice-pipeline-metrics'),
     
     # ============ Company/Account Management ============
     path('companies/', Companies.as_view(), name='finance-companies'),
@@ -53,9 +61,11 @@ urlpatterns = [
     
     # ============ Invoice Management ============
     path('invoices/', Invoices.as_view(), name='finance-invoices'),
+    path('invoices/previews/<str:key>.webp', InvoicePreview.as_view(), name='finance-invoice-preview'),
     path('invoices/add/', InvoiceCreate.as_view(), name='finance-invoice-create'),
     path('invoices/<int:pk>/edit/', InvoiceEdit.as_view(), name='finance-invoice-edit'),
     path('invoices/<int:pk>/delete/', InvoiceDelete.as_view(), name='finance-invoice-delete'),
+    path('invoices/spend/', InvoiceSpend.as_view(), name='finance-invoice-spend'),
     
     # ============ Accounting Modules ============
     path('payables/', Payables.as_view(), name='finance-payables'),
@@ -3,31 +3,40 @@ from xml.parsers.expat import model
 import os
 from django.conf import settings
 from django.shortcuts import redirect, render, get_object_or_404
+from django.urls import reverse
+from django.http import FileResponse, Http404, HttpResponseNotModified, JsonResponse
+from django.core.exceptions import ValidationError
+from django.core.files import File
 from django.views import View
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.contrib import messages
 from .forms import AccountingDimensionForm, BankAccountForm, BankAccountSubTypeForm, BankAccountTypeForm, BankGuaranteeForm, BudgetForm, CostCenterAllocationsForm, CostCenterForm, DeductionCertificateForm, DunningForm, DunningTypeForm, LoginForm, ProcessPaymentReconciliationForm, SignupForm, CompanyForm, AccountForm, InvoiceForm, JournalEntryForm, SupplierForm, CustomerForm, TaxAccountFormSet, TaxCategoryForm, TaxItemTemplatesForm, TaxRateFormSet, TaxRuleForm, TaxWithholdingCategoryForm, UnreconcilePaymentForm
-from django.db import models, transaction
-from .models import AccountingDimension, BankAccount, BankAccountSubtype, BankAccountType, BankGuarantee, Budget, Company, Account, CostCenter, CostCenterAllocation, Customer, DeductionCertificate, Dunning, DunningType, Invoice, JournalEntry, ProcessPaymentReconciliation, Supplier, TaxCategory, TaxItemTemplate, TaxRule, TaxWithholdingCategory, UnreconcilePayment
+from django.db import models, transaction, close_old_connections, IntegrityError, OperationalError
+from .models import AccountingDimension, BankAccount, BankAccountSubtype, BankAccountType, BankGuarantee, Budget, Company, Account, CostCenter, CostCenterAllocation, Customer, DeductionCertificate, Dunning, DunningType, Invoice, InvoiceDeadLetter, InvoiceLineItem, InvoicePageHash, InvoiceUpload, JournalEntry, ProcessPaymentReconciliation, Supplier, TaxCategory, TaxItemTemplate, TaxRule, TaxWithholdingCategory, UnreconcilePayment
 from django.contrib.messages import get_messages
-from django.db.models import Sum, Q
+from django.db.models import Sum, Q, Count, Avg, Max, F, ProtectedError
 from datetime import datetime, timedelta
 from django.utils import timezone
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 import math
-from django.db.models.functions import Coalesce
-from django.db.models import Value as V, DecimalField
+from django.db.models.functions import TruncMonth
 from PIL import Image
 import numpy as np
 import base64
 import cv2
 import pdfplumber
-import statistics
-import fitz
 import re
 import json
+import logging
+import hashlib
+import threading
+import random
+import traceback
+import uuid
+import requests
+from concurrent.futures import ThreadPoolExecutor
 from google.cloud import vision, storage
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4, landscape
@@ -37,8 +46,12 @@ import arabic_reshaper
 from bidi.algorithm import get_display
 from openai import OpenAI
 from pdfminer.high_level import extract_text
+from . import counters, duplicates, grouping, imaging, imports, lineitems, money, pagination, periods, posting, previews, ocr, ratelimit, replay, search, textreduce
 
-client_openai = OpenAI(api_key=settings.OPENAI_API_KEY)
+logger = logging.getLogger(__name__)
+
+# finance.ratelimit owns retries and backoff; SDK retries would multiply them unseen
+client_openai = OpenAI(api_key=settings.OPENAI_API_KEY, max_retries=0)
 
 class Accounts(View):
     """List all accounts"""
@@ -71,15 +84,18 @@ class Accounts(View):
         if account_type_filter:
             accounts = accounts.filter(account_type=account_type_filter)
         
+        page = pagination.paginate(request, accounts)
+
         context = {
-            'accounts': accounts,
+            'accounts': page.object_list,
+            'page': page,
             'search_query': search_query,
             'id_filter': id_filter,
             'account_number_filter': account_number_filter,
             'company_filter': company_filter,
             'account_type_filter': account_type_filter,
-            'total_count': Account.objects.count(),
-            'companies': Company.objects.all(),  # For filter dropdown
+            'total_count': counters.count(Account),
+            'companies': Company.objects.only('id', 'name'),  # For filter dropdown
         }
         return render(request, 'finance/accounts.html', context)
 
@@ -163,7 +179,11 @@ class AccountDelete(View):
     def post(self, request, pk):
         account = get_object_or_404(Account, pk=pk)
         account_name = account.name
-        account.delete()
+        try:
+            account.delete()
+        except ProtectedError:
+            messages.error(request, f'Account "{account_name}" has journal entries and cannot be deleted; disable it instead.')
+            return redirect('finance-accounts')
         messages.success(request, f'Account "{account_name}" deleted successfully!')
         return redirect('finance-accounts')
 
@@ -213,17 +233,20 @@ class Budgets(View):
         if distribution_filter:
             budgets = budgets.filter(distribution=distribution_filter)
 
+        page = pagination.paginate(request, budgets)
+
         context = {
-            'budgets': budgets,
+            'budgets': page.object_list,
+            'page': page,
             'search_query': search_query,
             'id_filter': id_filter,
             'company_filter': company_filter,
             'account_filter': account_filter,
             'budget_against_filter': budget_against_filter,
             'distribution_filter': distribution_filter,
-            'total_count': Budget.objects.count(),
-            'companies': Company.objects.all(),
-            'accounts': Account.objects.all(),
+            'total_count': counters.count(Budget),
+            'companies': Company.objects.only('id', 'name'),
+            'accounts': Account.objects.only('id', 'name'),
             'cost_centers': CostCenter.objects.filter(is_group=False, is_disabled=False),
             'cost_center_filter': cost_center_filter,
         }
@@ -344,14 +367,18 @@ class CostCenters(View):
         parent_filter = request.GET.get('parent', '')
         if parent_filter:
             cost_centers = cost_centers.filter(parent_id=parent_filter)
+
+        page = pagination.paginate(request, cost_centers)
+
         context = {
-            'cost_centers': cost_centers,
+            'cost_centers': page.object_list,
+            'page': page,
             'search_query': search_query,
             'company_filter': company_filter,
             'parent_filter': parent_filter,
-            'companies': Company.objects.all(),
-            'parents': CostCenter.objects.all(),
-            'total_count': CostCenter.objects.count(),
+            'companies': Company.objects.only('id', 'name'),
+            'parents': CostCenter.objects.only('id', 'name'),
+            'total_count': counters.count(CostCenter),
         }
 
         return render(request, 'finance/cost_centers.html', context)
@@ -458,10 +485,13 @@ class AccountingDimensions(View):
         if search_query:
             accounting_dimensions = accounting_dimensions.filter(name__icontains=search_query)
 
+        page = pagination.paginate(request, accounting_dimensions)
+
         context = {
-            'accounting_dimensions': accounting_dimensions,
+            'accounting_dimensions': page.object_list,
+            'page': page,
             'search_query': search_query,
-            'total_count': AccountingDimension.objects.count(),
+            'total_count': counters.count(AccountingDimension),
         }
 
         return render(request, 'finance/accountingdimensions.html', context)
@@ -568,10 +598,13 @@ class TaxCategories(View):
         if search_query:
             tax_categories = tax_categories.filter(title__icontains=search_query)
 
+        page = pagination.paginate(request, tax_categories)
+
         context = {
-            'tax_categories': tax_categories,
+            'tax_categories': page.object_list,
+            'page': page,
             'search_query': search_query,
-            'total_count': TaxCategory.objects.count(),
+            'total_count': counters.count(TaxCategory),
         }
 
         return render(request, 'finance/taxcategories.html', context)
@@ -679,10 +712,14 @@ class CostCenterAllocations(View):
         search_query = request.GET.get('search', '')
         if search_query:
             cost_center_allocations = cost_center_allocations.filter(cost_center__name__icontains=search_query)
+
+        page = pagination.paginate(request, cost_center_allocations)
+
         context = {
-            'cost_center_allocations': cost_center_allocations,
+            'cost_center_allocations': page.object_list,
+            'page': page,
             'search_query': search_query,
-            'total_count': CostCenterAllocation.objects.count(),
+            'total_count': counters.count(CostCenterAllocation),
         }
 
         return render(request, 'finance/costcenterallocations.html', context)
@@ -795,11 +832,14 @@ class TaxItemTemplates(View):
         if company_filter:
             tax_item_templates = tax_item_templates.filter(company_id=company_filter)
 
+        page = pagination.paginate(request, tax_item_templates)
+
         context = {
-            'tax_item_templates': tax_item_templates,
+            'tax_item_templates': page.object_list,
+            'page': page,
             'company_filter': company_filter,
             'search_query': search_query,
-            'total_count': TaxItemTemplate.objects.count(),
+            'total_count': counters.count(TaxItemTemplate),
         }
 
         return render(request, 'finance/tax_item_templates.html', context)
@@ -912,11 +952,14 @@ class TaxRuleView(View):
         if type_filter:
             tax_rules = tax_rules.filter(tax_type=type_filter)
 
+        page = pagination.paginate(request, tax_rules)
+
         context = {
-            'tax_rules': tax_rules,
+            'tax_rules': page.object_list,
+            'page': page,
             'type_filter': type_filter,
             'search_query': search_query,
-            'total_count': TaxRule.objects.count(),
+            'total_count': counters.count(TaxRule),
         }
 
         return render(request, 'finance/tax_rules.html', context)
@@ -1031,11 +1074,14 @@ class DeductionCertificateView(View):
         if company_filter:
             certificates = certificates.filter(company_id=company_filter)
 
+        page = pagination.paginate(request, certificates)
+
         context = {
-            'certificates': certificates,
+            'certificates': page.object_list,
+            'page': page,
             'search_query': search_query,
             'company_filter': company_filter,
-            'total_count': DeductionCertificate.objects.count(),
+            'total_count': counters.count(DeductionCertificate),
         }
 
         return render(
@@ -1154,11 +1200,14 @@ class TaxWithholdingCategoryList(View):
         if basis_filter:
             categories = categories.filter(deduct_tax_on_basis=basis_filter)
 
+        page = pagination.paginate(request, categories)
+
         context = {
-            'categories': categories,
+            'categories': page.object_list,
+            'page': page,
             'basis_filter': basis_filter,
             'search_query': search_query,
-            'total_count': TaxWithholdingCategory.objects.count(),
+            'total_count': counters.count(TaxWithholdingCategory),
         }
 
         # Make sure this template filename matches what is on your disk
@@ -1271,36 +1320,58 @@ class TaxWithholdingCategoryDelete(View):
         # ✅ FIXED: Matches your urls.py name
         return redirect('finance-tax-withholding-categories')
 
+def with_period_totals(accounts, account_type=None):
+    """
+    Accounts with debit_sum/credit_sum (and total_debit/total_credit) set from finance.periods,
+    and the same totals in integer minor units as debit_units/credit_units for adding up.
+    """
+    balances = periods.account_totals(account_type, minor_units=True)
+    accounts = list(accounts)
+    for account in accounts:
+        account.debit_units, account.credit_units = balances.get(account.pk, (0, 0))
+        account.debit_sum = account.total_debit = periods.AMOUNT.from_minor(account.debit_units)
+        account.credit_sum = account.total_credit = periods.AMOUNT.from_minor(account.credit_units)
+    return accounts
+
+
+def totals_by_account_name(account_type, debit_side):
+    """
+    [{'account__name', 'total', 'units'}] for accounts of one type, largest first, from the
+    opening balances plus open-period lines (finance.periods); units is total in minor units.
+    """
+    balances = periods.account_totals(account_type, minor_units=True)
+    names = dict(Account.objects.filter(pk__in=balances).values_list('pk', 'name'))
+    totals = {}
+    for account_id, (debit, credit) in balances.items():
+        name = names.get(account_id)
+        totals[name] = totals.get(name, 0) + (debit if debit_side else credit)
+    return sorted(
+        ({'account__name': name, 'total': periods.AMOUNT.from_minor(units), 'units': units}
+         for name, units in totals.items()),
+        key=lambda item: item['units'], reverse=True,
+    )
+
+
 class Dashboard(View):
     @method_decorator(login_required)
     def get(self, request):
         
         
+        # Running totals per account type: opening balances of the open fiscal year plus its lines
+        totals = periods.type_totals()
+        zero = (Decimal('0.00'), Decimal('0.00'))
+
         # Calculate Total Revenue (Income accounts - credit side)
-        total_revenue = JournalEntry.objects.filter(
-            account__account_type='income'
-        ).aggregate(
-            total=Sum('credit_amount')
-        )['total'] or Decimal('0.00')
+        total_revenue = totals.get('income', zero)[1]
         
         # Calculate Total Expenses (Expense accounts - debit side)
-        total_expenses = JournalEntry.objects.filter(
-            account__account_type='expense'
-        ).aggregate(
-            total=Sum('debit_amount')
-        )['total'] or Decimal('0.00')
+        total_expenses = totals.get('expense', zero)[0]
         
         # Calculate Net Profit
         net_profit = total_revenue - total_expenses
         
         # Calculate Cash on Hand (Asset accounts balance)
-        asset_debits = JournalEntry.objects.filter(
-            account__account_type='asset'
-        ).aggregate(total=Sum('debit_amount'))['total'] or Decimal('0.00')
-        
-        asset_credits = JournalEntry.objects.filter(
-            account__account_type='asset'
-        ).aggregate(total=Sum('credit_amount'))['total'] or Decimal('0.00')
+        asset_debits, asset_credits = totals.get('asset', zero)
         
         cash_on_hand = asset_credits - asset_debits
         
@@ -1312,26 +1383,26 @@ class Dashboard(View):
         
         # Current month revenue (for comparison)
         current_revenue = JournalEntry.objects.filter(
-            account__account_type='income',
+            account_type='income',
             date__gte=first_day_current_month
         ).aggregate(total=Sum('credit_amount'))['total'] or Decimal('0.00')
         
         # Previous month revenue
         prev_revenue = JournalEntry.objects.filter(
-            account__account_type='income',
+            account_type='income',
             date__gte=first_day_previous_month,
             date__lte=last_day_previous_month
         ).aggregate(total=Sum('credit_amount'))['total'] or Decimal('0.00')
         
         # Current month expenses
         current_expenses = JournalEntry.objects.filter(
-            account__account_type='expense',
+            account_type='expense',
             date__gte=first_day_current_month
         ).aggregate(total=Sum('debit_amount'))['total'] or Decimal('0.00')
         
         # Previous month expenses
         prev_expenses = JournalEntry.objects.filter(
-            account__account_type='expense',
+            account_type='expense',
             date__gte=first_day_previous_month,
             date__lte=last_day_previous_month
         ).aggregate(total=Sum('debit_amount'))['total'] or Decimal('0.00')
@@ -1348,13 +1419,7 @@ class Dashboard(View):
         monthly_data = self.get_monthly_data(6)
         
         # Get expense breakdown by category (for pie chart)
-        expense_breakdown = JournalEntry.objects.filter(
-            account__account_type='expense'
-        ).values(
-            'account__name'
-        ).annotate(
-            total=Sum('debit_amount')
-        ).order_by('-total')[:4]  # Top 4 categories
+        expense_breakdown = totals_by_account_name('expense', debit_side=True)[:4]  # Top 4 categories
         
         # Calculate total for percentages
         total_expense_sum = sum(item['total'] for item in expense_breakdown) if expense_breakdown else 0
@@ -1397,40 +1462,6 @@ class Dashboard(View):
         recent_entries = JournalEntry.objects.select_related(
             'account', 'company'
         ).order_by('-date', '-created_at')[:10]
-         # ===== DEBUG: ADD THIS BEFORE context = {...} =====
-        print("\n" + "="*60)
-        print("DASHBOARD DEBUG INFO")
-        print("="*60)
-        
-        # Check account types
-        from django.db.models import Count
-        account_type_counts = Account.objects.values('account_type').annotate(count=Count('id'))
-        print("\n📊 Accounts by Type:")
-        for item in account_type_counts: 
-            print(f"  {item['account_type'] or 'NO TYPE SET'}: {item['count']} accounts")
-        
-        # Check journal entries
-        print(f"\n📝 Total Journal Entries: {JournalEntry.objects.count()}")
-        
-        # Check entries with income accounts
-        income_entries = JournalEntry.objects.filter(account__account_type='income')
-        print(f"\n💰 Income Entries: {income_entries.count()}")
-        for entry in income_entries[: 3]: 
-            print(f"  - {entry.entry_number}: {entry.account.name} | Credit: ${entry.credit_amount} | Debit: ${entry.debit_amount}")
-        
-        # Check entries with expense accounts
-        expense_entries = JournalEntry.objects.filter(account__account_type='expense')
-        print(f"\n💸 Expense Entries: {expense_entries.count()}")
-        for entry in expense_entries[: 3]:
-            print(f"  - {entry.entry_number}: {entry.account.name} | Debit: ${entry.debit_amount} | Credit: ${entry.credit_amount}")
-        
-        # Show ALL journal entries with their account types
-        print(f"\n📋 First 5 Journal Entries:")
-        for entry in JournalEntry.objects.all()[:5]:
-            print(f"  {entry.entry_number}: Account={entry.account.name} (Type: {entry.account.account_type or 'NO TYPE'}) | Debit=${entry.debit_amount} | Credit=${entry.credit_amount}")
-        
-        print("\n" + "="*60 + "\n")
-        # ===== END DEBUG =====
         
         context = {
             'total_revenue': total_revenue,
@@ -1481,13 +1512,13 @@ class Dashboard(View):
                 month_end = month_start.replace(month=month_start.month + 1, day=1) - timedelta(days=1)
             
             income = JournalEntry.objects.filter(
-                account__account_type='income',
+                account_type='income',
                 date__gte=month_start,
                 date__lte=month_end
             ).aggregate(total=Sum('credit_amount'))['total'] or Decimal('0.00')
             
             expense = JournalEntry.objects.filter(
-                account__account_type='expense',
+                account_type='expense',
                 date__gte=month_start,
                 date__lte=month_end
             ).aggregate(total=Sum('debit_amount'))['total'] or Decimal('0.00')
@@ -1528,16 +1559,16 @@ class Journal(View):
         # Search functionality
         search_query = request.GET.get('search', '')
         if search_query:
-            journal_entries = journal_entries.filter(
-                models.Q(entry_number__icontains=search_query) |
-                models.Q(account__name__icontains=search_query) |
-                models.Q(description__icontains=search_query)
-            )
-        
+            # Full-text index over entry number, account name and description, best matches first
+            page = search.paginate(request, journal_entries, search_query)
+        else:
+            page = pagination.paginate(request, journal_entries)
+
         context = {
-            'journal_entries': journal_entries,
+            'journal_entries': page.object_list,
+            'page': page,
             'search_query': search_query,
-            'total_count': JournalEntry.objects.count(),
+            'total_count': counters.count(JournalEntry),
         }
         return render(request, 'finance/journal.html', context)
 
@@ -1572,6 +1603,88 @@ class JournalCreate(View):
         })
 
 
+class JournalBulkPost(View):
+    """
+    Post many journal lines at once, grouped into balanced vouchers (format in finance.posting).
+
+    Body: JSON {"vouchers": [...]} (or a bare list), or NDJSON with one voucher per line.
+    The whole batch is rejected with every problem listed if anything is invalid.
+    """
+    NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+    @method_decorator(login_required)
+    def post(self, request):
+        try:
+            if request.content_type in self.NDJSON_TYPES:
+                vouchers = []
+                for line_number, line in enumerate(request, start=1):
+                    if line.strip():
+                        try:
+                            vouchers.append(json.loads(line))
+                        except ValueError:
+                            return JsonResponse({'error': f'Line {line_number} is not valid JSON'}, status=400)
+            else:
+                payload = json.loads(request.body or b'null')
+                vouchers = payload.get('vouchers') if isinstance(payload, dict) else payload
+            if not isinstance(vouchers, list):
+                raise ValueError
+        except ValueError:
+            return JsonResponse({'error': 'Expected JSON {"vouchers": [...]} or NDJSON with one voucher per line'}, status=400)
+
+        try:
+            result = posting.post_vouchers(vouchers, user=request.user)
+        except posting.PostingError as e:
+            return JsonResponse({
+                'error': 'The batch was rejected; nothing was posted',
+                'error_count': e.total,
+                'errors': e.errors,
+            }, status=400)
+        return JsonResponse(result, status=201)
+
+
+class DataImport(View):
+    """
+    Bulk import of a CSV/XLSX file (multipart field "file") into accounts, suppliers, customers,
+    invoices or journal lines (finance.imports). Failed rows don't stop the import; they are
+    listed in an error report CSV linked from the response.
+    """
+    @method_decorator(login_required)
+    def post(self, request, kind):
+        if kind not in imports.IMPORTERS:
+            return JsonResponse({'error': f'Unknown import "{kind}"; expected one of {", ".join(imports.IMPORTERS)}'}, status=404)
+        uploaded_file = request.FILES.get('file')
+        if not uploaded_file:
+            return JsonResponse({'error': 'Attach the CSV or XLSX file as "file"'}, status=400)
+
+        report_name = f"{request.user.pk}-{kind}-{uuid.uuid4().hex}"
+        report_path = os.path.join(settings.IMPORT_REPORT_DIR, f"{report_name}.csv")
+        try:
+            # Large uploads are already spooled to a temporary file; rows are streamed from it
+            result = imports.import_file(
+                kind, uploaded_file.file, uploaded_file.name, report_path,
+                user=request.user, chunk_size=settings.IMPORT_CHUNK_SIZE,
+            )
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        if result['report']:
+            result['report'] = reverse('finance-import-report', args=[report_name])
+        return JsonResponse(result, status=200 if result['failed'] else 201)
+
+
+class DataImportReport(View):
+    """Download the error report of an import started by the same user."""
+    @method_decorator(login_required)
+    def get(self, request, name):
+        if not re.fullmatch(r"\d+-[a-z]+-[0-9a-f]{32}", name) or (
+            name.split('-', 1)[0] != str(request.user.pk) and not request.user.is_staff
+        ):
+            raise Http404("No such report")
+        path = os.path.join(settings.IMPORT_REPORT_DIR, f"{name}.csv")
+        if not os.path.isfile(path):
+            raise Http404("No such report")
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=f"{name}.csv", content_type='text/csv')
+
+
 class JournalEdit(View):
     """Edit existing journal entry"""
     @method_decorator(login_required)
@@ -1610,7 +1723,11 @@ class JournalDelete(View):
     def post(self, request, pk):
         journal_entry = get_object_or_404(JournalEntry, pk=pk)
         entry_number = journal_entry.entry_number
-        journal_entry.delete()
+        try:
+            journal_entry.delete()
+        except ValidationError as e:
+            messages.error(request, ' '.join(e.messages))
+            return redirect('finance-journal')
         messages.success(request, f'Journal Entry "{entry_number}" deleted successfully!')
         return redirect('finance-journal')
 
@@ -1618,37 +1735,31 @@ class TrialBalance(View):
     @method_decorator(login_required)
     def get(self, request):
         """
-        Build a trial balance table using the correct related_name 'journal_entries'
-        and ensure Coalesce uses a Decimal fallback and output_field=DecimalField().
+        Build a trial balance table using the correct related_name 'journal_entries'.
         """
-        # Annotate accounts with summed debits/credits (Coalesce to default 0.00 as Decimal)
-        accounts_qs = Account.objects.all().annotate(
-            total_debit=Coalesce(Sum('journal_entries__debit_amount'), V(Decimal('0.00')), output_field=DecimalField()),
-            total_credit=Coalesce(Sum('journal_entries__credit_amount'), V(Decimal('0.00')), output_field=DecimalField()),
-        ).order_by('account_number', 'name')
+        # Totals are the open fiscal year's opening balances plus its lines (finance.periods)
+        accounts_qs = with_period_totals(Account.objects.order_by('account_number', 'name'))
 
         accounts_list = []
-        total_debits = Decimal('0.00')
-        total_credits = Decimal('0.00')
+        # Added up in integer minor units, turned into amounts once for display
+        debit_units = credit_units = 0
 
         for acc in accounts_qs:
-            # total_debit/total_credit are Decimal-compatible now
-            debit = Decimal(acc.total_debit) if acc.total_debit is not None else Decimal('0.00')
-            credit = Decimal(acc.total_credit) if acc.total_credit is not None else Decimal('0.00')
-
             accounts_list.append({
                 'code': getattr(acc, 'account_number', '') or '',
                 'name': acc.name,
                 'type': (acc.account_type.capitalize() if acc.account_type else 'Unknown'),
-                'debit': debit,
-                'credit': credit,
-                'balance': debit - credit,
+                'debit': acc.total_debit,
+                'credit': acc.total_credit,
+                'balance': periods.AMOUNT.from_minor(acc.debit_units - acc.credit_units),
             })
 
-            total_debits += debit
-            total_credits += credit
+            debit_units += acc.debit_units
+            credit_units += acc.credit_units
 
-        discrepancy = total_debits - total_credits
+        total_debits = periods.AMOUNT.from_minor(debit_units)
+        total_credits = periods.AMOUNT.from_minor(credit_units)
+        discrepancy = periods.AMOUNT.from_minor(debit_units - credit_units)
 
         context = {
             'accounts_list': accounts_list,
@@ -1702,6 +1813,22 @@ class Ledger(View):
 
             running = Decimal('0.00')
 
+            # Closed fiscal years are brought forward as one opening row; only open-period lines are listed
+            since, opening_year = periods.open_period()
+            if since:
+                journal_qs = journal_qs.filter(date__gte=since)
+                opening = opening_year.opening_balances.filter(account=selected_account).first() if opening_year else None
+                if opening:
+                    debit, credit = opening.debit_amount, opening.credit_amount
+                    running = debit - credit if increase_by_debit else credit - debit
+                    entries.append({
+                        'date': since,
+                        'description': f'Opening balance ({opening_year})',
+                        'debit': debit,
+                        'credit': credit,
+                        'balance': running,
+                    })
+
             for je in journal_qs:
                 debit = je.debit_amount or Decimal('0.00')
                 credit = je.credit_amount or Decimal('0.00')
@@ -1747,11 +1874,14 @@ class Companies(View):
         if id_filter: 
             companies = companies.filter(id=id_filter)
         
+        page = pagination.paginate(request, companies)
+
         context = {
-            'companies': companies,
+            'companies': page.object_list,
+            'page': page,
             'search_query':  search_query,
             'id_filter': id_filter,
-            'total_count': Company.objects.count(),
+            'total_count': counters.count(Company),
         }
         return render(request, 'finance/companies.html', context)
 
@@ -1824,7 +1954,11 @@ class CompanyDelete(View):
     def post(self, request, pk):
         company = get_object_or_404(Company, pk=pk)
         company_name = company.name
-        company.delete()
+        try:
+            company.delete()
+        except ProtectedError:
+            messages.error(request, f'Company "{company_name}" has accounts with journal entries and cannot be deleted.')
+            return redirect('finance-companies')
         messages.success(request, f'Company "{company_name}" deleted successfully!')
         return redirect('finance-companies')
     
@@ -1953,22 +2087,22 @@ class Invoices(View):
     """List all invoices"""
     @method_decorator(login_required)
     def get(self, request):
-        # Eager-load supplier and company to avoid N+1 queries
-        invoices = Invoice.objects.select_related('company', 'supplier', 'customer').all()
+        # Eager-load supplier, company and suspected duplicate to avoid N+1 queries
+        invoices = Invoice.objects.select_related('company', 'supplier', 'customer', 'duplicate_of').all()
 
         # Search functionality
         search_query = request.GET.get('search', '')
         if search_query:
-            invoices = invoices.filter(
-                models.Q(invoice_number__icontains=search_query) |
-                models.Q(customer__name__icontains=search_query) |
-                models.Q(supplier__name__icontains=search_query)  # search supplier name via FK
-            )
+            # Full-text index over invoice number, supplier and customer name, best matches first
+            page = search.paginate(request, invoices, search_query)
+        else:
+            page = pagination.paginate(request, invoices)
 
         context = {
-            'invoices':  invoices,
+            'invoices': page.object_list,
+            'page': page,
             'search_query': search_query,
-            'total_count': Invoice.objects.count(),
+            'total_count': counters.count(Invoice),
         }
         return render(request, 'finance/invoices.html', context)
     
@@ -2044,6 +2178,68 @@ class InvoiceDelete(View):
         messages.success(request, f'Invoice "{invoice_number}" deleted successfully!')
         return redirect('finance-invoices')
 
+class InvoiceSpend(View):
+    """Spend by item or by supplier from extracted invoice line items, with a monthly trend"""
+    @method_decorator(login_required)
+    def get(self, request):
+        lines = InvoiceLineItem.objects.all()
+
+        company_id = request.GET.get('company', '')
+        date_from = request.GET.get('date_from', '')
+        date_to = request.GET.get('date_to', '')
+        search_query = request.GET.get('search', '')
+        group = 'supplier' if request.GET.get('group') == 'supplier' else 'item'
+        selected = request.GET.get('selected', '')
+
+        if company_id:
+            lines = lines.filter(company_id=company_id)
+        if date_from:
+            lines = lines.filter(date__gte=date_from)
+        if date_to:
+            lines = lines.filter(date__lte=date_to)
+        if search_query:
+            lines = lines.filter(
+                Q(item_name__icontains=search_query) | Q(supplier__name__icontains=search_query)
+            )
+
+        key = 'supplier__name' if group == 'supplier' else 'item_name'
+        rows = (
+            lines.values(key)
+            .annotate(
+                total_spend=Sum('total_price'),
+                total_quantity=Sum('quantity'),
+                avg_unit_price=money.MinorAvg('unit_price'),
+                invoice_count=Count('invoice', distinct=True),
+                last_date=Max('date'),
+            )
+            .order_by('-total_spend')[:200]
+        )
+        rows = [dict(row, label=row[key] or 'Unknown') for row in rows]
+
+        trend = []
+        if selected:
+            trend = (
+                lines.filter(**{key: selected})
+                .annotate(month=TruncMonth('date'))
+                .values('month')
+                .annotate(total_spend=Sum('total_price'), total_quantity=Sum('quantity'), avg_unit_price=money.MinorAvg('unit_price'))
+                .order_by('month')
+            )
+
+        context = {
+            'rows': rows,
+            'trend': trend,
+            'group': group,
+            'selected': selected,
+            'grand_total': lines.aggregate(total=Sum('total_price'))['total'] or 0,
+            'companies': Company.objects.only('id', 'name'),
+            'company_id': company_id,
+            'date_from': date_from,
+            'date_to': date_to,
+            'search_query': search_query,
+        }
+        return render(request, 'finance/invoice_spend.html', context)
+
 class Suppliers(View):
     """List all suppliers"""
     @method_decorator(login_required)
@@ -2077,12 +2273,15 @@ class Suppliers(View):
             suppliers = suppliers.filter(supplier_type=type_filter)
 
         # Pass companies for the dropdown
-        companies = Company.objects.all()
+        companies = Company.objects.only('id', 'name')
+
+        page = pagination.paginate(request, suppliers)
 
         context = {
-            'suppliers': suppliers,
+            'suppliers': page.object_list,
+            'page': page,
             'search_query': search_query,
-            'total_count': Supplier.objects.count(),
+            'total_count': counters.count(Supplier),
             'companies': companies,
             'company_filter': company_filter,
             'type_filter': type_filter,
@@ -2192,12 +2391,15 @@ class Customers(View):
             customers = customers.filter(customer_type=type_filter)
 
         # Pass companies for the dropdown
-        companies = Company.objects.all()
+        companies = Company.objects.only('id', 'name')
+
+        page = pagination.paginate(request, customers)
 
         context = {
-            'customers': customers,
+            'customers': page.object_list,
+            'page': page,
             'search_query': search_query,
-            'total_count': Customer.objects.count(),
+            'total_count': counters.count(Customer),
             'companies': companies,
             'company_filter': company_filter,
             'type_filter': type_filter,
@@ -2411,8 +2613,31 @@ class Receivables(View):
 class InvoiceScan(View):
     @method_decorator(login_required)  # Require login to access
     def get(self, request):
-        invoices = Invoice.objects.all().order_by('-date')
-        return render(request, 'finance/scan.html', {'invoices': invoices}) 
+        invoices = Invoice.objects.select_related('supplier', 'customer').order_by('-date')
+        return render(request, 'finance/scan.html', {
+            'invoices': invoices,
+            'upload_chunk_size': settings.INVOICE_UPLOAD_CHUNK_SIZE,
+        })
+
+class InvoicePreview(View):
+    """First-page thumbnail of an invoice; keys are content hashes, so responses never go stale."""
+    @method_decorator(login_required)
+    def get(self, request, key):
+        if not previews.is_key(key):
+            raise Http404("Unknown preview")
+        etag = f'"{key}"'
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponseNotModified()
+        else:
+            try:
+                response = FileResponse(previews.open_preview(key), content_type='image/webp')
+            except FileNotFoundError:
+                raise Http404("Unknown preview")
+        # private: previews show customer documents, so only the user's browser may keep them
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        response['ETag'] = etag
+        return response
+
 class Reports(View):
     @method_decorator(login_required)  # Require login to access
     def get(self, request):
@@ -2425,97 +2650,83 @@ class Reports(View):
         """
         now = timezone.now()
         # --- Profit & Loss (Income Statement) ---
-        income_qs = JournalEntry.objects.filter(account__account_type='income')
-        revenue_by_account = income_qs.values('account__name').annotate(
-            total=Coalesce(Sum('credit_amount'), V(Decimal('0.00')), output_field=DecimalField())
-        ).order_by('-total')
+        # Account totals are the open fiscal year's opening balances plus its lines (finance.periods)
+        revenue_by_account = totals_by_account_name('income', debit_side=False)
+
+        # Totals are added up in integer minor units and turned into amounts once for display
+        amount = periods.AMOUNT.from_minor
 
         revenue_items = []
-        total_revenue = Decimal('0.00')
+        revenue_units = 0
         for r in revenue_by_account:
-            amt = Decimal(r['total'] or 0)
-            revenue_items.append({'label': r['account__name'], 'amount': amt})
-            total_revenue += amt
+            revenue_items.append({'label': r['account__name'], 'amount': r['total']})
+            revenue_units += r['units']
+        total_revenue = amount(revenue_units)
 
-        expense_qs = JournalEntry.objects.filter(account__account_type='expense')
-        expense_by_account = expense_qs.values('account__name').annotate(
-            total=Coalesce(Sum('debit_amount'), V(Decimal('0.00')), output_field=DecimalField())
-        ).order_by('-total')
+        expense_by_account = totals_by_account_name('expense', debit_side=True)
 
         expense_items = []
-        total_expenses = Decimal('0.00')
+        expense_units = 0
         for e in expense_by_account:
-            amt = Decimal(e['total'] or 0)
-            expense_items.append({'label': e['account__name'], 'amount': amt})
-            total_expenses += amt
+            expense_items.append({'label': e['account__name'], 'amount': e['total']})
+            expense_units += e['units']
+        total_expenses = amount(expense_units)
 
-        net_profit = total_revenue - total_expenses
+        net_profit = amount(revenue_units - expense_units)
 
         revenue_display = revenue_items[:4] if revenue_items else [{'label': 'Sales Revenue', 'amount': Decimal('0.00')}]
         expense_display = expense_items[:5] if expense_items else [{'label': 'Salaries Expense', 'amount': Decimal('0.00')}]
 
         # --- Balance Sheet ---
-        asset_qs = Account.objects.filter(account_type='asset').annotate(
-            debit_sum=Coalesce(Sum('journal_entries__debit_amount'), V(Decimal('0.00')), output_field=DecimalField()),
-            credit_sum=Coalesce(Sum('journal_entries__credit_amount'), V(Decimal('0.00')), output_field=DecimalField()),
-        )
+        asset_qs = with_period_totals(Account.objects.filter(account_type='asset'), 'asset')
 
         assets_list = []
-        total_assets = Decimal('0.00')
+        asset_units = 0
         for a in asset_qs:
-            debit = Decimal(a.debit_sum or 0)
-            credit = Decimal(a.credit_sum or 0)
-            balance = debit - credit  # signed balance
-            display_balance = abs(balance)
+            units = a.debit_units - a.credit_units  # signed balance
+            balance = amount(units)
             assets_list.append({
                 'name': a.name,
                 'balance': balance,                    # keep raw signed value if needed
-                'display_balance': display_balance,    # non-negative value for UI
-                'is_negative': balance < 0,            # flag for styling/formatting
+                'display_balance': abs(balance),       # non-negative value for UI
+                'is_negative': units < 0,              # flag for styling/formatting
             })
-            total_assets += balance
+            asset_units += units
+        total_assets = amount(asset_units)
 
-        liability_qs = Account.objects.filter(account_type='liability').annotate(
-            debit_sum=Coalesce(Sum('journal_entries__debit_amount'), V(Decimal('0.00')), output_field=DecimalField()),
-            credit_sum=Coalesce(Sum('journal_entries__credit_amount'), V(Decimal('0.00')), output_field=DecimalField()),
-        )
+        liability_qs = with_period_totals(Account.objects.filter(account_type='liability'), 'liability')
 
         liabilities_list = []
-        total_liabilities = Decimal('0.00')
+        liability_units = 0
         for l in liability_qs:
-            debit = Decimal(l.debit_sum or 0)
-            credit = Decimal(l.credit_sum or 0)
-            balance = credit - debit  # signed balance (normal credit balance)
-            display_balance = abs(balance)   # non-negative for UI
+            units = l.credit_units - l.debit_units  # signed balance (normal credit balance)
+            balance = amount(units)
             liabilities_list.append({
                 'name': l.name,
                 'balance': balance,                # keep signed value if needed elsewhere
-                'display_balance': display_balance,
-                'is_negative': balance < 0,        # flag for styling
+                'display_balance': abs(balance),   # non-negative for UI
+                'is_negative': units < 0,          # flag for styling
             })
-            total_liabilities += balance
+            liability_units += units
+        total_liabilities = amount(liability_units)
 
-        equity_qs = Account.objects.filter(account_type='equity').annotate(
-            debit_sum=Coalesce(Sum('journal_entries__debit_amount'), V(Decimal('0.00')), output_field=DecimalField()),
-            credit_sum=Coalesce(Sum('journal_entries__credit_amount'), V(Decimal('0.00')), output_field=DecimalField()),
-        )
+        equity_qs = with_period_totals(Account.objects.filter(account_type='equity'), 'equity')
 
         equity_list = []
-        total_equity = Decimal('0.00')
+        equity_units = 0
         for q in equity_qs:
-            debit = Decimal(q.debit_sum or 0)
-            credit = Decimal(q.credit_sum or 0)
-            balance = credit - debit
-            display_balance = abs(balance)
+            units = q.credit_units - q.debit_units
+            balance = amount(units)
             equity_list.append({
                 'name': q.name,
                 'balance': balance,
-                'display_balance': display_balance,
-                'is_negative': balance < 0,
+                'display_balance': abs(balance),
+                'is_negative': units < 0,
             })
-            total_equity += balance
+            equity_units += units
+        total_equity = amount(equity_units)
 
-        total_liabilities_and_equity = total_liabilities + total_equity
+        total_liabilities_and_equity = amount(liability_units + equity_units)
 
         # Make non-negative "display" totals so totals appear positive in the UI
         display_total_assets = abs(total_assets)
@@ -2542,69 +2753,35 @@ class Reports(View):
             month_date = (now - timedelta(days=30 * i)).date()
             m_start, m_end = month_range_from_date(month_date)
 
-            income_month = JournalEntry.objects.filter(
-                account__account_type='income',
-                date__gte=m_start,
-                date__lte=m_end
-            ).aggregate(total=Coalesce(Sum('credit_amount'), V(Decimal('0.00')), output_field=DecimalField()))['total'] or Decimal('0.00')
-
-            expense_month = JournalEntry.objects.filter(
-                account__account_type='expense',
-                date__gte=m_start,
-                date__lte=m_end
-            ).aggregate(total=Coalesce(Sum('debit_amount'), V(Decimal('0.00')), output_field=DecimalField()))['total'] or Decimal('0.00')
-
-            operating = Decimal(income_month) - Decimal(expense_month)
-
-            asset_debits = JournalEntry.objects.filter(
-                account__account_type='asset',
-                date__gte=m_start,
-                date__lte=m_end
-            ).aggregate(total=Coalesce(Sum('debit_amount'), V(Decimal('0.00')), output_field=DecimalField()))['total'] or Decimal('0.00')
-
-            asset_credits = JournalEntry.objects.filter(
-                account__account_type='asset',
-                date__gte=m_start,
-                date__lte=m_end
-            ).aggregate(total=Coalesce(Sum('credit_amount'), V(Decimal('0.00')), output_field=DecimalField()))['total'] or Decimal('0.00')
-
-            investing = Decimal(asset_debits) - Decimal(asset_credits)
-
-            liab_debits = JournalEntry.objects.filter(
-                account__account_type='liability',
-                date__gte=m_start,
-                date__lte=m_end
-            ).aggregate(total=Coalesce(Sum('debit_amount'), V(Decimal('0.00')), output_field=DecimalField()))['total'] or Decimal('0.00')
-
-            liab_credits = JournalEntry.objects.filter(
-                account__account_type='liability',
-                date__gte=m_start,
-                date__lte=m_end
-            ).aggregate(total=Coalesce(Sum('credit_amount'), V(Decimal('0.00')), output_field=DecimalField()))['total'] or Decimal('0.00')
-
-            eq_debits = JournalEntry.objects.filter(
-                account__account_type='equity',
-                date__gte=m_start,
-                date__lte=m_end
-            ).aggregate(total=Coalesce(Sum('debit_amount'), V(Decimal('0.00')), output_field=DecimalField()))['total'] or Decimal('0.00')
-
-            eq_credits = JournalEntry.objects.filter(
-                account__account_type='equity',
-                date__gte=m_start,
-                date__lte=m_end
-            ).aggregate(total=Coalesce(Sum('credit_amount'), V(Decimal('0.00')), output_field=DecimalField()))['total'] or Decimal('0.00')
-
-            financing = (Decimal(liab_credits) - Decimal(liab_debits)) + (Decimal(eq_credits) - Decimal(eq_debits))
+            # Debit and credit of one account type for the month, in integer minor units
+            def month_units(account_type):
+                sums = JournalEntry.objects.filter(
+                    account_type=account_type,
+                    date__gte=m_start,
+                    date__lte=m_end
+                ).aggregate(debit=money.MinorSum('debit_amount'), credit=money.MinorSum('credit_amount'))
+                return sums['debit'], sums['credit']
+
+            income_debit, income_credit = month_units('income')
+            expense_debit, expense_credit = month_units('expense')
+            asset_debit, asset_credit = month_units('asset')
+            liability_debit, liability_credit = month_units('liability')
+            equity_debit, equity_credit = month_units('equity')
+
+            operating = amount(income_credit - expense_debit)
+            investing = amount(asset_debit - asset_credit)
+            financing = amount(liability_credit - liability_debit + equity_credit - equity_debit)
 
             cashflow_months.append(m_start.strftime('%b'))
-            cashflow_operating.append(float(operating))
-            cashflow_investing.append(float(investing))
-            cashflow_financing.append(float(financing))
+            cashflow_operating.append(operating)
+            cashflow_investing.append(investing)
+            cashflow_financing.append(financing)
 
         # Prepare polylines
         def make_polyline(data_list, chart_width=1000, chart_height=260):
             if not data_list:
                 return ''
+            data_list = [float(v) for v in data_list]
             max_val = max(abs(v) for v in data_list) or 1
             points = []
             for idx, val in enumerate(data_list):
@@ -2618,9 +2795,9 @@ class Reports(View):
         poly_investing = make_polyline(cashflow_investing)
         poly_financing = make_polyline(cashflow_financing)
 
-        operating_metric = Decimal(cashflow_operating[-1]) if cashflow_operating else Decimal('0.00')
-        investing_metric = Decimal(cashflow_investing[-1]) if cashflow_investing else Decimal('0.00')
-        financing_metric = Decimal(cashflow_financing[-1]) if cashflow_financing else Decimal('0.00')
+        operating_metric = cashflow_operating[-1] if cashflow_operating else Decimal('0.00')
+        investing_metric = cashflow_investing[-1] if cashflow_investing else Decimal('0.00')
+        financing_metric = cashflow_financing[-1] if cashflow_financing else Decimal('0.00')
 
         # Compute label X positions (no template math needed)
         label_positions = []
@@ -2670,23 +2847,409 @@ def create_invoice(request):
         files = request.FILES.getlist('files')
         new_count = 0
         repeated_count = 0
+        retry_count = 0
+        failed_count = 0
         print(files)
-        for  idx, file in enumerate(files):
-            split_invoice_str = request.POST.get(f'split_flag_{idx}', 'false')
-            split_invoice = split_invoice_str.lower() == 'true'
-            try:
-                result = upload_invoice_for_project(file,split_invoice)
-                created = result.get("created", 0)
-                duplicates = result.get("duplicates", 0)
-                new_count = new_count + created
-                repeated_count = repeated_count + duplicates
-            except Exception as e:
-                messages.warning(request, f"An error occurred while uploading the invoice")
-                print(f"Error uploading invoice: {e}")
+        for file in files:
+            # Each file becomes a persisted ingestion task, so a failure can be retried without re-uploading.
+            # Which pages form one invoice is worked out from the pages themselves.
+            upload = stage_upload_file(file, None, request.user)
+            if upload.status == 'queued':
+                _run_upload_task(upload.pk)
+                upload.refresh_from_db()
+            if upload.status == 'done':
+                new_count = new_count + upload.result.get("created", 0)
+                repeated_count = repeated_count + upload.result.get("duplicates", 0)
+            elif upload.status == 'retrying':
+                retry_count = retry_count + 1
+            else:
+                failed_count = failed_count + 1
         messages.success(request, f"Invoices uploaded. New: {new_count}, Duplicates: {repeated_count}")
+        if retry_count:
+            messages.warning(request, f"{retry_count} file(s) hit a temporary error and will be retried automatically")
+        if failed_count:
+            messages.warning(request, f"{failed_count} file(s) could not be processed and were moved to the dead-letter queue")
         return redirect('finance-invoice-scan')
     return redirect('finance-scan')
 
+# ============ Chunked invoice uploads ============
+# Parts are streamed straight into a staging file at the client's offset, so a
+# dropped connection only costs the unfinished chunk. The SHA-256 is kept
+# in memory per upload and rebuilt from the staged bytes if this process did
+# not see the earlier chunks.
+
+UPLOAD_EXTENSIONS = ('pdf', 'png', 'jpg', 'jpeg')
+UPLOAD_CHUNK_LOCK_TIMEOUT = timedelta(minutes=5)
+
+_upload_hashers = {}
+_upload_hashers_lock = threading.Lock()
+_ingestion_executor = ThreadPoolExecutor(max_workers=settings.INVOICE_INGEST_WORKERS, thread_name_prefix='invoice-ingest')
+# Per-page OCR/LLM/storage calls; CPU-bound image work runs in finance.imaging's process pool instead
+_network_executor = ThreadPoolExecutor(max_workers=settings.INVOICE_NETWORK_WORKERS, thread_name_prefix='invoice-network')
+
+
+def _staging_path(upload):
+    return os.path.join(settings.INVOICE_UPLOAD_STAGING_DIR, f"{upload.upload_id}.part")
+
+
+def _upload_state(upload):
+    return {
+        'upload_id': str(upload.upload_id),
+        'filename': upload.filename,
+        'size': upload.total_size,
+        'offset': upload.received_bytes,
+        'status': upload.status,
+        'sha256': upload.sha256,
+        'result': upload.result,
+        'error': upload.error,
+        'attempts': upload.attempts,
+        'next_attempt_at': upload.next_attempt_at.isoformat() if upload.next_attempt_at else None,
+        'chunk_size': settings.INVOICE_UPLOAD_CHUNK_SIZE,
+        'status_url': reverse('finance-invoice-upload-detail', args=[upload.upload_id]),
+        'chunk_url': reverse('finance-invoice-upload-chunk', args=[upload.upload_id]),
+        'finalize_url': reverse('finance-invoice-upload-finalize', args=[upload.upload_id]),
+    }
+
+
+def _upload_hasher(upload, offset):
+    """SHA-256 of the first `offset` staged bytes, reusing the running hash when we have it."""
+    with _upload_hashers_lock:
+        cached = _upload_hashers.pop(upload.upload_id, None)
+    if cached and cached[0] == offset:
+        return cached[1]
+
+    hasher = hashlib.sha256()
+    path = _staging_path(upload)
+    if offset and os.path.exists(path):
+        remaining = offset
+        with open(path, 'rb') as fp:
+            while remaining:
+                block = fp.read(min(1024 * 1024, remaining))
+                if not block:
+                    break
+                hasher.update(block)
+                remaining -= len(block)
+    return hasher
+
+
+def _append_upload_chunk(upload, offset, stream):
+    """Streams one part from the request into the staging file; returns bytes written."""
+    hasher = _upload_hasher(upload, offset)
+    path = _staging_path(upload)
+    limit = upload.total_size - offset
+    written = 0
+    try:
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as fp:
+            fp.seek(offset)
+            fp.truncate()  # drop bytes from a chunk that never got recorded
+            while written < limit:
+                block = stream.read(min(64 * 1024, limit - written))
+                if not block:
+                    break
+                fp.write(block)
+                hasher.update(block)
+                written += len(block)
+    finally:
+        # Keep whatever arrived, even if the client went away mid-chunk
+        with _upload_hashers_lock:
+            _upload_hashers[upload.upload_id] = (offset + written, hasher)
+        InvoiceUpload.objects.filter(pk=upload.pk).update(
+            received_bytes=offset + written,
+            chunk_started_at=None,
+            updated_at=timezone.now(),
+        )
+    return written
+
+
+def _mark_duplicate_upload(upload, digest):
+    """If the same bytes already went through ingestion, close `upload` as a duplicate of it and return that upload."""
+    previous = InvoiceUpload.objects.filter(
+        sha256=digest, status__in=['queued', 'processing', 'retrying', 'done']
+    ).exclude(pk=upload.pk).first()
+    if previous:
+        InvoiceUpload.objects.filter(pk=upload.pk).update(
+            status='done', sha256=digest,
+            result={'created': 0, 'duplicates': 1, 'duplicate_of': str(previous.upload_id)},
+            updated_at=timezone.now(),
+        )
+        delete_file(_staging_path(upload))
+    return previous
+
+
+def _split_choice(value):
+    """Optional split override from a request: True/False forces splitting or merging, None groups automatically."""
+    if value is None or str(value).strip() == '':
+        return None
+    return str(value).lower() == 'true'
+
+
+def stage_upload_file(uploaded_file, split_invoice, user=None):
+    """Persist a posted or dropped file as a queued InvoiceUpload (or a closed duplicate)."""
+    upload = InvoiceUpload.objects.create(
+        filename=os.path.basename(uploaded_file.name),
+        total_size=uploaded_file.size,
+        split_invoice=split_invoice,
+        created_by=user if getattr(user, 'is_authenticated', False) else None,
+    )
+    os.makedirs(settings.INVOICE_UPLOAD_STAGING_DIR, exist_ok=True)
+    hasher = hashlib.sha256()
+    with open(_staging_path(upload), 'wb') as fp:
+        for chunk in uploaded_file.chunks():
+            fp.write(chunk)
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+    if not _mark_duplicate_upload(upload, digest):
+        InvoiceUpload.objects.filter(pk=upload.pk).update(
+            status='queued', sha256=digest, received_bytes=upload.total_size, updated_at=timezone.now()
+        )
+    upload.refresh_from_db()
+    return upload
+
+
+# Failures worth retrying the whole upload for, once the per-call retries in finance.ratelimit gave up
+INGEST_TRANSIENT_ERRORS = ratelimit.RATE_LIMITED_ERRORS + ratelimit.TRANSIENT_ERRORS + (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    OperationalError,
+)
+
+
+class PageIngestionError(Exception):
+    """Some invoices of a multi-invoice upload failed; the others are saved and are skipped when the upload is retried."""
+
+    def __init__(self, failures):
+        self.failures = sorted(failures, key=lambda failure: failure[0])
+        super().__init__("; ".join(f"page {page}: {error}" for page, error in self.failures))
+
+
+def _is_transient(error):
+    if isinstance(error, PageIngestionError):
+        return all(_is_transient(page_error) for _, page_error in error.failures)
+    return isinstance(error, INGEST_TRANSIENT_ERRORS)
+
+
+def _retry_delay(attempts):
+    """Exponential backoff with jitter: roughly base, 2x base, 4x base, ... capped."""
+    delay = min(settings.INVOICE_INGEST_RETRY_MAX_SECONDS, settings.INVOICE_INGEST_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _schedule_upload(upload_pk, delay=0):
+    if delay:
+        timer = threading.Timer(delay, _ingestion_executor.submit, args=(process_staged_upload, upload_pk))
+        timer.daemon = True
+        timer.start()
+    else:
+        _ingestion_executor.submit(process_staged_upload, upload_pk)
+
+
+def _ingestion_failed(upload, error):
+    """Schedule a retry for transient failures; dead-letter permanent ones and exhausted retries."""
+    now = timezone.now()
+    transient = _is_transient(error)
+    if transient and upload.attempts < settings.INVOICE_INGEST_MAX_ATTEMPTS:
+        delay = _retry_delay(upload.attempts)
+        print(f"Upload {upload.upload_id} failed (attempt {upload.attempts}): {error}. Retrying in {delay:.0f}s")
+        InvoiceUpload.objects.filter(pk=upload.pk).update(
+            status='retrying', error=str(error), next_attempt_at=now + timedelta(seconds=delay), updated_at=now
+        )
+        # Timers die with the process; `manage.py process_invoice_queue` picks up whatever is overdue
+        _schedule_upload(upload.pk, delay)
+        return
+
+    print(f"Upload {upload.upload_id} moved to the dead-letter queue after {upload.attempts} attempt(s): {error}")
+    with transaction.atomic():
+        InvoiceUpload.objects.filter(pk=upload.pk).update(
+            status='dead', error=str(error), next_attempt_at=None, updated_at=now
+        )
+        InvoiceDeadLetter.objects.update_or_create(
+            upload=upload,
+            defaults={
+                'error': str(error),
+                'traceback': "".join(traceback.format_exception(error)),
+                'attempts': upload.attempts,
+                'transient': transient,
+            },
+        )
+
+
+def _run_upload_task(upload_pk):
+    """
+    One attempt at a queued upload. The staged file stays on disk until the upload is done,
+    and invoice IDs derive from the upload, so a retry only redoes what did not finish.
+    """
+    # Claim it first, so a retry timer and the queue command never run the same upload twice
+    claimed = InvoiceUpload.objects.filter(pk=upload_pk, status__in=['queued', 'retrying']).update(
+        status='processing', attempts=F('attempts') + 1, next_attempt_at=None, updated_at=timezone.now()
+    )
+    if not claimed:
+        return
+    upload = InvoiceUpload.objects.get(pk=upload_pk)
+    path = _staging_path(upload)
+    try:
+        with open(path, 'rb') as fp:
+            result = upload_invoice_for_project(
+                File(fp, name=upload.filename), upload.split_invoice, idempotency_key=upload.upload_id.hex
+            )
+    except Exception as e:
+        _ingestion_failed(upload, e)
+        return
+    InvoiceUpload.objects.filter(pk=upload_pk).update(
+        status='done', result=result, error='', updated_at=timezone.now()
+    )
+    delete_file(path)
+
+
+def process_staged_upload(upload_pk):
+    """Runs a queued upload through the invoice pipeline (ingestion worker thread)."""
+    close_old_connections()
+    try:
+        _run_upload_task(upload_pk)
+    finally:
+        close_old_connections()
+
+
+def due_uploads():
+    """Queued uploads plus retries whose backoff has passed."""
+    return InvoiceUpload.objects.filter(
+        Q(status='queued') | Q(status='retrying', next_attempt_at__lte=timezone.now())
+    )
+
+
+def requeue_dead_letters(dead_letters, schedule=True):
+    """
+    Put dead-lettered uploads back on the queue with a fresh retry budget.
+
+    With `schedule`, this process's ingestion workers pick them up; otherwise they
+    wait for `manage.py process_invoice_queue`. Returns the requeued upload pks.
+    """
+    upload_pks = list(dead_letters.values_list('upload_id', flat=True))
+    with transaction.atomic():
+        InvoiceUpload.objects.filter(pk__in=upload_pks, status='dead').update(
+            status='queued', attempts=0, error='', next_attempt_at=None, updated_at=timezone.now()
+        )
+        InvoiceDeadLetter.objects.filter(upload_id__in=upload_pks).delete()
+        if schedule:
+            for upload_pk in upload_pks:
+                transaction.on_commit(lambda upload_pk=upload_pk: _schedule_upload(upload_pk))
+    return upload_pks
+
+
+class InvoiceUploadStart(View):
+    """Open a chunked upload: JSON body {filename, size, split}"""
+    @method_decorator(login_required)
+    def post(self, request):
+        try:
+            payload = json.loads(request.body or b'{}')
+            filename = os.path.basename(str(payload.get('filename', ''))).strip()
+            size = int(payload.get('size', 0))
+        except (ValueError, TypeError):
+            return JsonResponse({'error': 'Expected JSON with filename and size'}, status=400)
+
+        if not filename or filename.lower().rsplit('.', 1)[-1] not in UPLOAD_EXTENSIONS:
+            return JsonResponse({'error': 'Only PDF, PNG and JPG invoices can be uploaded'}, status=400)
+        if size <= 0 or size > settings.INVOICE_UPLOAD_MAX_SIZE:
+            return JsonResponse({'error': f'File size must be between 1 byte and {settings.INVOICE_UPLOAD_MAX_SIZE} bytes'}, status=400)
+
+        # A retried start request with the same Idempotency-Key gets the upload it already opened
+        idempotency_key = (request.headers.get('Idempotency-Key') or str(payload.get('idempotency_key') or '')).strip()[:100] or None
+        if idempotency_key:
+            existing = InvoiceUpload.objects.filter(idempotency_key=idempotency_key).first()
+            if existing:
+                if existing.created_by_id != request.user.id:
+                    return JsonResponse({'error': 'Idempotency-Key is already in use'}, status=409)
+                return JsonResponse(_upload_state(existing))
+
+        try:
+            upload = InvoiceUpload.objects.create(
+                filename=filename,
+                total_size=size,
+                split_invoice=_split_choice(payload.get('split')),
+                idempotency_key=idempotency_key,
+                created_by=request.user,
+            )
+        except IntegrityError:
+            # Lost a race with a concurrent request carrying the same key
+            return JsonResponse(_upload_state(InvoiceUpload.objects.get(idempotency_key=idempotency_key)))
+        os.makedirs(settings.INVOICE_UPLOAD_STAGING_DIR, exist_ok=True)
+        open(_staging_path(upload), 'wb').close()
+        return JsonResponse(_upload_state(upload), status=201)
+
+
+class InvoiceUploadDetail(View):
+    """Upload progress; clients resume from the returned offset"""
+    @method_decorator(login_required)
+    def get(self, request, upload_id):
+        upload = get_object_or_404(InvoiceUpload, upload_id=upload_id, created_by=request.user)
+        return JsonResponse(_upload_state(upload))
+
+
+class InvoiceUploadChunk(View):
+    """Append one part; the Upload-Offset header must match the bytes already received"""
+    @method_decorator(login_required)
+    def put(self, request, upload_id):
+        upload = get_object_or_404(InvoiceUpload, upload_id=upload_id, created_by=request.user)
+        try:
+            offset = int(request.headers.get('Upload-Offset', request.GET.get('offset', '')))
+        except ValueError:
+            return JsonResponse({'error': 'Upload-Offset header is required'}, status=400)
+
+        # Claim the upload for this chunk; a stale claim from a dead request can be taken over
+        claimed = InvoiceUpload.objects.filter(
+            pk=upload.pk,
+            status='uploading',
+            received_bytes=offset,
+        ).filter(
+            Q(chunk_started_at__isnull=True) | Q(chunk_started_at__lt=timezone.now() - UPLOAD_CHUNK_LOCK_TIMEOUT)
+        ).update(chunk_started_at=timezone.now())
+        if not claimed:
+            upload.refresh_from_db()
+            state = _upload_state(upload)
+            state['error'] = 'Offset does not match the received bytes, or another chunk is in progress'
+            return JsonResponse(state, status=409)
+
+        _append_upload_chunk(upload, offset, request)
+        upload.refresh_from_db()
+        return JsonResponse(_upload_state(upload))
+
+
+class InvoiceUploadFinalize(View):
+    """Verify a complete upload and queue it for ingestion"""
+    @method_decorator(login_required)
+    def post(self, request, upload_id):
+        upload = get_object_or_404(InvoiceUpload, upload_id=upload_id, created_by=request.user)
+        if upload.status != 'uploading':
+            # Finalize is idempotent; a retried call just reports the current state
+            return JsonResponse(_upload_state(upload))
+        if upload.received_bytes != upload.total_size:
+            state = _upload_state(upload)
+            state['error'] = 'Upload is incomplete'
+            return JsonResponse(state, status=409)
+
+        digest = _upload_hasher(upload, upload.received_bytes).hexdigest()
+        try:
+            expected = json.loads(request.body or b'{}').get('sha256') or request.headers.get('Upload-Checksum', '')
+        except (ValueError, AttributeError):
+            expected = request.headers.get('Upload-Checksum', '')
+        if expected and expected.lower() != digest:
+            return JsonResponse({'error': 'Checksum mismatch', 'sha256': digest}, status=400)
+
+        # The same bytes already went through ingestion: don't process (or pay for) them twice
+        if not _mark_duplicate_upload(upload, digest) and InvoiceUpload.objects.filter(
+            pk=upload.pk, status='uploading'
+        ).update(status='queued', sha256=digest, updated_at=timezone.now()):
+            transaction.on_commit(lambda: _schedule_upload(upload.pk))
+
+        upload.refresh_from_db()
+        return JsonResponse(_upload_state(upload), status=202)
+
+class InvoicePipelineMetrics(View):
+    """Rate limiter queue depth, throttle time and retries for the external services"""
+
+    @method_decorator(login_required)
+    def get(self, request):
+        return JsonResponse({'rate_limits': ratelimit.metrics()})
+
 def is_qr_code_present(image_data):
     """
     Takes image data (bytes) and returns True if 'qr_code' class is detected.
@@ -2704,15 +3267,7 @@ def is_qr_code_present(image_data):
 def extract_qr_code(image_data):
     """Detects and extracts QR code content using OpenCV."""
     try:
-        nparr = np.frombuffer(image_data, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-        detector = cv2.QRCodeDetector()
-        data, bbox, _ = detector.detectAndDecode(image)
-
-        if bbox is not None and data:
-            return data  # Already decoded string
-
+        return imaging.decode_qr(image_data)  # Already decoded string
     except Exception as e:
         print(f"Error extracting QR code: {e}")
 
@@ -2764,67 +3319,55 @@ def convert_date_format(date_str):
 
 def extract_text_from_pdf(file_path):
     text = ""
-    with pdfplumber.open(file_path) as pdf:
-        for page in pdf.pages:
-            text += page.extract_text() + "\n"
+    with replay.stage('text'), pdfplumber.open(file_path) as pdf:
+        # Form feeds between pages (as pdfminer does) let the LLM text reducer spot running headers/footers
+        text = "\f".join((page.extract_text() or "") + "\n" for page in pdf.pages)
     return text
 
-def pdf_to_images(pdf_bytes):
-    """Convert PDF pages to images using PyMuPDF."""
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")  # Read PDF from memory
-    images = []
-    for page_num in range(len(doc)):
-        pix = doc[page_num].get_pixmap(matrix=fitz.Matrix(2, 2))  # Increase DPI
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        images.append(img)
-    return images
-
 def initialize_vision_client():
-    return vision.ImageAnnotatorClient()
-def get_dominant_text_angle(response):
-    angles = []
-    for page in response.full_text_annotation.pages:
-        for block in page.blocks:
-            for paragraph in block.paragraphs:
-                for word in paragraph.words:
-                    vertices = word.bounding_box.vertices
-                    if len(vertices) >= 2:
-                        dx = vertices[1].x - vertices[0].x
-                        dy = vertices[1].y - vertices[0].y
-                        angle = math.degrees(math.atan2(dy, dx))
-                        angles.append(angle)
-
-    if not angles:
-        return 0
-
-    # Normalize angles to be between -90 and +90
-    normalized_angles = [((a + 90) % 180) - 90 for a in angles]
-    median_angle = statistics.median(normalized_angles)
-    return median_angle
+    return ocr.get_client()
 def correct_image_orientation(image_path, angle_threshold=45):
-    from PIL import Image
-
-    client = initialize_vision_client()
-    response = detect_text_blocks(image_path, client)
-    angle = get_dominant_text_angle(response)
+    # Estimated locally, so Vision OCR runs once, on the upright image
+    with replay.stage('orientation'):
+        angle = imaging.estimate_text_angle(image_path)
 
     if abs(angle) > angle_threshold:
-        with Image.open(image_path) as img:
-            rotated_img = img.rotate(-90, expand=True)
-            rotated_path = "rotated_temp_image.jpg"
-            rotated_img.save(rotated_path)
-        return rotated_path
+        # Next to the source image, so pages processed in parallel never share a temp file
+        rotated_path = f"{os.path.splitext(image_path)[0]}_rotated.jpg"
+        with replay.stage('rotate'):
+            return imaging.rotate_image_file(image_path, rotated_path, -angle)
     return image_path
 def get_image_size(image_path):
     with Image.open(image_path) as img:
         return img.size
 
-def detect_text_blocks(image_path, client):
+def detect_text_blocks(image_path, client=None):
     with io.open(image_path, 'rb') as image_file:
         content = image_file.read()
-        image = vision.Image(content=content)
-    response = client.document_text_detection(image=image)
-    return response
+
+    # Send OCR a compact grayscale copy; boxes are scaled back to the original below
+    with replay.stage('ocr_prepare'):
+        content, scale_x, scale_y = imaging.prepare_for_ocr(
+            content,
+            max_side=settings.INVOICE_OCR_MAX_SIDE,
+            fmt=settings.INVOICE_OCR_FORMAT,
+            quality=settings.INVOICE_OCR_QUALITY,
+            max_bytes=settings.INVOICE_OCR_MAX_BYTES,
+        )
+
+    def annotate():
+        if client is not None:
+            return client.document_text_detection(image=vision.Image(content=content))
+        # Concurrent pages share batch_annotate_images round trips
+        return ocr.annotate(content)
+
+    with replay.stage('ocr'):
+        response = replay.call(
+            'vision', content, annotate,
+            dump=lambda r: vision.AnnotateImageResponse.to_json(r),
+            load=lambda s: vision.AnnotateImageResponse.from_json(s, ignore_unknown_fields=True),
+        )
+    return ocr.scale_response(response, scale_x, scale_y)
 
 def setup_pdf_canvas(image_width, image_height, output_pdf_path):    
     if image_width > image_height:
@@ -2841,6 +3384,8 @@ def setup_pdf_canvas(image_width, image_height, output_pdf_path):
 
 def register_font():
     print(settings.STATICFILES_DIRS)
+    if not settings.STATICFILES_DIRS:
+        return "Helvetica"
     font_path = os.path.join(settings.STATICFILES_DIRS[0], 'assets', 'fonts', 'DejaVuSans.ttf')
     if os.path.exists(font_path):
         pdfmetrics.registerFont(TTFont("ArabicFont", font_path))
@@ -2899,9 +3444,8 @@ def draw_text_blocks_on_canvas(response, canvas_obj, font_name, img_width, img_h
 
 def generate_invoice_pdf(image_path):
     corrected_image_path = correct_image_orientation(image_path)
-    client = initialize_vision_client()
     img_width, img_height = get_image_size(corrected_image_path)
-    response = detect_text_blocks(corrected_image_path, client)
+    response = detect_text_blocks(corrected_image_path)
 
     # Ensure the invoices folder exists
     folder_path = os.path.join(settings.MEDIA_ROOT, 'invoices')
@@ -2909,19 +3453,67 @@ def generate_invoice_pdf(image_path):
 
     # Generate filename if not provided
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    filename = f"invoice_{timestamp}.pdf"
+    filename = f"invoice_{timestamp}_{uuid.uuid4().hex[:8]}.pdf"
 
     output_pdf_path = os.path.join(folder_path, filename)
 
-    c, pdf_width, pdf_height, scale_x, scale_y = setup_pdf_canvas(img_width, img_height, output_pdf_path)
-    font_name = register_font()
+    with replay.stage('layout'):
+        c, pdf_width, pdf_height, scale_x, scale_y = setup_pdf_canvas(img_width, img_height, output_pdf_path)
+        font_name = register_font()
 
-    draw_text_blocks_on_canvas(response, c, font_name, img_width, img_height, scale_x, scale_y)
+        draw_text_blocks_on_canvas(response, c, font_name, img_width, img_height, scale_x, scale_y)
 
-    c.save()
+        c.save()
+    if corrected_image_path != image_path:
+        delete_file(corrected_image_path)
     return output_pdf_path
 
-def process_invoice_digital(pdf_content, image_data):
+# The fixed instructions form one constant system prompt; only the invoice text varies.
+# At about 400 tokens it is below OpenAI's 1024-token prompt caching minimum, so it
+# is billed in full on every request: keep it short.
+INVOICE_EXTRACTION_PROMPT = (
+    "You are an AI specialized in extracting structured data from invoices. "
+    "Ensure the JSON response follows this structure:"
+    "\n```json\n"
+    "{"
+    "\n  \"Invoice Number\": \"<string>\","
+    "\n  \"Invoice Date\": \"<string>\","
+    "\n  \"Supplier Name\": \"<string>\","
+    "\n  \"Supplier VAT\": \"<string>\","
+    "\n  \"Customer Name\": \"<string>\","
+    "\n  \"Customer VAT\": \"<string>\","
+    "\n  \"Amount Before VAT\": <float>,"
+    "\n  \"VAT Amount\": <float>,"
+    "\n  \"Total Amount After VAT\": <float>,"
+    "\n  \"Line Items\": ["
+    "\n    {"
+    "\n      \"Item Name\": \"<string>\","
+    "\n      \"Item Description\": \"<string>\","
+    "\n      \"Quantity\": <int>,"
+    "\n      \"Unit Price\": <float>,"
+    "\n      \"Total Price\": <float>"
+    "\n    }"
+    "\n  ]"
+    "\n}"
+    "\n```"
+    "\n\n"
+    "Extract the following details from this invoice and return them in JSON format:\n"
+    "If any value is missing or cannot be determined, return it as null (None in Python):\n\n"
+    "Match both English and Arabic keywords where available.Invoice contains English and Arabic only.\n\n"
+    "- Invoice Number (رقم الفاتورة / Raqm Al Fatoora)/Receipt Number\n"
+    "- Invoice Date (%d-%m-%Y). Start Date in Food Budget.\n"
+    "- Supplier Name (may appear in English or Arabic at the top of the invoice. If in English return in English else return exact Arabic)\n"
+    "- Supplier VAT Number (الرقم الضريبي / Raqm Al Dhareebi)\n"
+    r"- Customer\Client Name (العميل)\n-"
+    "- Customer VAT Number (الرقم الضريبي للعميل / Raqm Al Dhareebi lil-Ameel)\n"
+    "- Amount Before VAT (مبلغ قبل الضريبة) / Total Amount Before VAT (الإجمالي قبل الضريبة)\n"
+    "- VAT Amount"
+    "- Total Amount After VAT / Total Amount"
+    "Additionally, extract line items listed in the invoice. Each line item should include:\n"
+    "- Item Name\n- Item Description (if available)\n- Quantity\n- Unit Price\n- Total Price\n"
+)
+
+def process_invoice_digital(pdf_content, image_data, line_items=None):
     
     print("LLAMA")
     """
@@ -2930,62 +3522,27 @@ def process_invoice_digital(pdf_content, image_data):
     Args:
         pdf_content (str): Extracted text from the invoice PDF.
         groq_api_key (str): API key for authentication.
+        line_items (list): Line items already read from the PDF's tables; the LLM then skips them.
 
     Returns:
         dict: Extracted invoice data in a structured JSON format.
     """
 
+    original_tokens = textreduce.count_tokens(pdf_content or "")
+    pdf_content = textreduce.reduce_invoice_text(pdf_content, min_chars=settings.INVOICE_LLM_REDUCE_MIN_CHARS)
+    reduced_tokens = textreduce.count_tokens(pdf_content)
+    replay.observe('llm_text_tokens_before', original_tokens)
+    replay.observe('llm_text_tokens_after', reduced_tokens)
+    logger.debug("Invoice text reduced from %d to %d tokens", original_tokens, reduced_tokens)
+
     # Define prompt structure for JSON output
-    messages = [{
-        "role": "system",
-        "content": (
-            "You are an AI specialized in extracting structured data from invoices. "
-            "Ensure the JSON response follows this structure:"
-            "\n```json\n"
-            "{"
-            "\n  \"Invoice Number\": \"<string>\","
-            "\n  \"Invoice Date\": \"<string>\","
-            "\n  \"Supplier Name\": \"<string>\","
-            "\n  \"Supplier VAT\": \"<string>\","
-            "\n  \"Customer Name\": \"<string>\","
-            "\n  \"Customer VAT\": \"<string>\","
-            "\n  \"Amount Before VAT\": <float>,"
-            "\n  \"VAT Amount\": <float>,"
-            "\n  \"Total Amount After VAT\": <float>,"
-            "\n  \"Line Items\": ["
-            "\n    {"
-            "\n      \"Item Name\": \"<string>\","
-            "\n      \"Item Description\": \"<string>\","
-            "\n      \"Quantity\": <int>,"
-            "\n      \"Unit Price\": <float>,"
-            "\n      \"Total Price\": <float>"
-            "\n    }"
-            "\n  ]"
-            "\n}"
-            "\n```"
-        )
-    },
-
-    {
-        "role": "user",
-        "content": (
-            "Extract the following details from this invoice and return them in JSON format:\n"
-            "If any value is missing or cannot be determined, return it as null (None in Python):\n\n"
-            "Match both English and Arabic keywords where available.Invoice contains English and Arabic only.\n\n"
-            "- Invoice Number (رقم الفاتورة / Raqm Al Fatoora)/Receipt Number\n"
-            "- Invoice Date (%d-%m-%Y). Start Date in Food Budget.\n"
-            "- Supplier Name (may appear in English or Arabic at the top of the invoice. If in English return in English else return exact Arabic)\n"
-            "- Supplier VAT Number (الرقم الضريبي / Raqm Al Dhareebi)\n"
-            r"- Customer\Client Name (العميل)\n-"
-            "- Customer VAT Number (الرقم الضريبي للعميل / Raqm Al Dhareebi lil-Ameel)\n"
-            "- Amount Before VAT (مبلغ قبل الضريبة) / Total Amount Before VAT (الإجمالي قبل الضريبة)\n"
-            "- VAT Amount"
-            "- Total Amount After VAT / Total Amount"
-            "Additionally, extract line items listed in the invoice. Each line item should include:\n"
-            "- Item Name\n- Item Description (if available)\n- Quantity\n- Unit Price\n- Total Price\n"
-            f"\n\nInvoice Text:\n{pdf_content}"
-        )
-    }]
+    messages = [
+        {"role": "system", "content": INVOICE_EXTRACTION_PROMPT},
+        {"role": "user", "content": f"Invoice Text:\n{pdf_content}"},
+    ]
+    if line_items:
+        messages[1]["content"] += '\n\nLine items were already extracted separately; return "Line Items": [].'
+
     # response = client.chat.completions.create(
     #     model="gemma2-9b-it",
     #     messages=messages,
@@ -2994,15 +3551,28 @@ def process_invoice_digital(pdf_content, image_data):
     #     top_p=1,
     #     stop=None,
     # )
-    response = client_openai.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        max_tokens=800,
-        temperature=0
-    )
+    def complete():
+        # Rough estimate (4 chars per token, plus the completion cap); settled with the real usage afterwards
+        estimated_tokens = sum(len(m["content"]) for m in messages) // 4 + 800
+        response = ratelimit.call(
+            'openai',
+            lambda: client_openai.chat.completions.create(
+                model="gpt-4o",
+                messages=messages,
+                max_tokens=800,
+                temperature=0
+            ),
+            tokens=estimated_tokens,
+            usage=lambda r: r.usage.total_tokens if r.usage else None,
+        )
+        if response.usage:
+            replay.observe('llm_prompt_tokens', response.usage.prompt_tokens)
+        # Access the response content
+        return response.choices[0].message.content
 
-    # Access the response content
-    response_text = response.choices[0].message.content
+    request_key = json.dumps({"model": "gpt-4o", "messages": messages}, sort_keys=True, ensure_ascii=False)
+    with replay.stage('llm'):
+        response_text = replay.call('openai', request_key.encode('utf-8'), complete)
 
     # # Prepare API request
     # data = {
@@ -3022,11 +3592,14 @@ def process_invoice_digital(pdf_content, image_data):
     extracted_json = match.group(1).strip() if match else response_text.strip()
 
     invoice_data = json.loads(extracted_json)
+    if line_items:
+        invoice_data["Line Items"] = line_items
     print(invoice_data)
     invoice_date_str = invoice_data["Invoice Date"]
     if invoice_date_str:
         invoice_data["Invoice Date"] = convert_date_format(invoice_date_str)
-    qr_code_string = extract_qr_code(image_data)
+    with replay.stage('qr'):
+        qr_code_string = extract_qr_code(image_data)
     if qr_code_string:
         qr_data = decode_tlv_qr(qr_code_string)
         invoice_data['QR Code Present'] = True
@@ -3108,24 +3681,36 @@ def upload_to_gcs(bucket_name, source_file_path, credentials_file):
         str: Signed URL to access the uploaded file.
     """
 
-    # Initialize the GCS client with the credentials file
-    storage_client = storage.Client.from_service_account_json(credentials_file)
-
-    # Get the target bucket
-    bucket = storage_client.bucket(bucket_name)
-
     # Use the base name of the file as the blob name
     destination_blob_name = os.path.basename(source_file_path)
 
-    # Create a blob object in the bucket
-    blob = bucket.blob(destination_blob_name)
-    blob.content_disposition = f'attachment; filename="{destination_blob_name}"'
+    def upload():
+        # Initialize the GCS client with the credentials file
+        storage_client = storage.Client.from_service_account_json(credentials_file)
+
+        # Get the target bucket
+        bucket = storage_client.bucket(bucket_name)
+
+        # Create a blob object in the bucket
+        blob = bucket.blob(destination_blob_name)
+        blob.content_disposition = f'attachment; filename="{destination_blob_name}"'
+
+        # Upload the file to GCS
+        ratelimit.call('gcs', lambda: blob.upload_from_filename(source_file_path, retry=None))
 
-    # Upload the file to GCS
-    blob.upload_from_filename(source_file_path)
+        # Generate a signed URL valid for 7 days
+        return blob.generate_signed_url(expiration=timedelta(days=7))
 
-    # Generate a signed URL valid for 7 days
-    url = blob.generate_signed_url(expiration=timedelta(days=7))
+    # Fixtures are keyed on bucket and file content only: blob names carry per-run
+    # working names (the benchmark's "bench<level>-<n>-..."), so a fixture recorded at one
+    # concurrency level replays at any other; replayed URLs keep the recorded blob name
+    content_hash = hashlib.sha256()
+    with open(source_file_path, 'rb') as fp:
+        for block in iter(lambda: fp.read(1024 * 1024), b''):
+            content_hash.update(block)
+    request_key = f"{bucket_name}:{content_hash.hexdigest()}"
+    with replay.stage('storage'):
+        url = replay.call('gcs', request_key.encode('utf-8'), upload)
 
     # Log upload
     print(f"File {source_file_path} uploaded to gs://{bucket_name}/{destination_blob_name}")
@@ -3136,14 +3721,17 @@ import os
 import io
 from django.conf import settings
 
-def upload_invoice_for_project(invoice_file,split_invoice=True):
+def upload_invoice_for_project(invoice_file,split_invoice=None,idempotency_key=None):
     """
     Handles invoice uploads (PDF or image) and saves them as individual or merged invoices.
 
     Args:
         invoice_file: InMemoryUploadedFile from request.FILES
         project_id: ID of the project/company the invoice belongs to
-        split_invoice: If True, split multi-page PDFs into separate invoices
+        split_invoice: True splits a multi-page PDF into one invoice per page, False keeps
+            it as one invoice; None (default) works out which pages belong together
+        idempotency_key: Stable per upload; invoices saved by an earlier attempt with the
+            same key are not processed again. Pages that fail raise once the others are saved.
 
     Returns:
         dict: {
@@ -3155,6 +3743,12 @@ def upload_invoice_for_project(invoice_file,split_invoice=True):
     """
     file_extension = invoice_file.name.lower().split('.')[-1]
     original_name_noext = os.path.splitext(invoice_file.name)[0]
+    idempotency_key = idempotency_key or uuid.uuid4().hex
+    if file_extension != "pdf" or split_invoice is False:
+        # One invoice for the whole file; an earlier attempt may already have saved it
+        resumed = _resumed_result(_scan_invoice_id(idempotency_key, 1))
+        if resumed:
+            return resumed
     invoice_bytes = invoice_file.read()
 
     folder_name = os.path.join(settings.MEDIA_ROOT, 'invoices')
@@ -3172,6 +3766,12 @@ def upload_invoice_for_project(invoice_file,split_invoice=True):
     # 1) Non-PDFs (images)
     # ===========================
     if file_extension != "pdf":
+        fingerprint, match = _fingerprint_scan(invoice_bytes)
+        if _is_rescan(match):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            return {"created": 0, "duplicates": 1, "pages": 1, "details": [_rescan_detail(match)]}
+
         tmp_image_path = os.path.join(folder_name, f"{original_name_noext}.png")
         with open(tmp_image_path, "wb") as f:
             f.write(invoice_bytes)
@@ -3184,7 +3784,10 @@ def upload_invoice_for_project(invoice_file,split_invoice=True):
             
             local_source_path=file_path,
             extracted_data=extracted_data,
-            fallback_basename=original_name_noext
+            fallback_basename=original_name_noext,
+            fingerprints=[fingerprint],
+            invoice_id=_scan_invoice_id(idempotency_key, 1),
+            suspected_duplicate=match
         )
 
         os.remove(tmp_image_path)
@@ -3196,7 +3799,7 @@ def upload_invoice_for_project(invoice_file,split_invoice=True):
             "created": 1 if status else 0,
             "duplicates": 1 if not status else 0,
             "pages": 1,
-            "details": [{"status": status}]
+            "details": [{"status": status, **_suspected_detail(match, status)}]
         }
 
     # ===========================
@@ -3205,42 +3808,86 @@ def upload_invoice_for_project(invoice_file,split_invoice=True):
     # Determine if digital PDF
     is_digital = False
     try:
-        full_text = extract_text(file_path)
+        with replay.stage('text'):
+            full_text = extract_text(file_path)
         is_digital = bool(full_text.strip())
         print("Digital Invoice" if is_digital else "Scanned Invoice")
     except Exception as e:
         print("PDF parsing failed:", e)
 
-    # For scanned PDFs, convert to images
+    # For scanned PDFs, convert to images (PNG bytes, rendered in the image process pool)
     images = []
     if not is_digital:
         try:
-            images = pdf_to_images(invoice_bytes)
+            with replay.stage('rasterize'):
+                if split_invoice is False:
+                    merged = imaging.render_pdf_merged_png(invoice_bytes)
+                    images = [merged] if merged else []
+                else:
+                    images = imaging.render_pdf_pages_png(invoice_bytes)
         except Exception as e:
             print("Error converting PDF to images:", e)
 
     # -----------------------------
-    # 2A) Digital PDF → process directly
+    # 2A) Digital PDF → process each invoice in it directly
     # -----------------------------
     if is_digital:
-        pdf_content = extract_text_from_pdf(file_path)
-        extracted_data = process_invoice_digital(pdf_content, invoice_bytes)
+        try:
+            groups = _digital_page_groups(invoice_bytes, split_invoice)
+        except Exception as e:
+            print("Page grouping failed, treating the file as one invoice:", e)
+            groups = []
+
+        if len(groups) <= 1:
+            resumed = _resumed_result(_scan_invoice_id(idempotency_key, 1))
+            if resumed:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                return resumed
+            status = _process_digital_pdf(
+                file_path, invoice_bytes, original_name_noext, _scan_invoice_id(idempotency_key, 1)
+            )
 
-        status = _save_single_invoice_record(
-            local_source_path=file_path,
-            extracted_data=extracted_data,
-            fallback_basename=original_name_noext
-        )
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+            return {
+                "created": 1 if status else 0,
+                "duplicates": 1 if not status else 0,
+                "pages": 1,
+                "details": [{"status": status}]
+            }
+
+        failures = []
+
+        def process_digital_group(idx, pages):
+            invoice_id = _scan_invoice_id(idempotency_key, idx)
+            if Invoice.objects.filter(invoice_id=invoice_id).exists():
+                close_old_connections()
+                return {"page": pages[0], "pages": pages, "status": True, "resumed": True}
+            group_pdf = os.path.join(folder_name, f"invoice_{original_name_noext}_{_pages_tag(pages)}.pdf")
+            try:
+                group_bytes = grouping.extract_pages(invoice_bytes, pages)
+                with open(group_pdf, "wb") as fpdf:
+                    fpdf.write(group_bytes)
+                status = _process_digital_pdf(
+                    group_pdf, group_bytes, f"{original_name_noext}_{_pages_tag(pages)}", invoice_id
+                )
+                return {"page": pages[0], "pages": pages, "status": status}
+            except Exception as e:
+                print(f"Error processing pages {pages}: {e}")
+                failures.append((pages[0], e))
+                return {"page": pages[0], "pages": pages, "status": None, "error": str(e)}
+            finally:
+                if os.path.exists(group_pdf):
+                    os.remove(group_pdf)
+                close_old_connections()
+
+        results = list(_network_executor.map(process_digital_group, range(1, len(groups) + 1), groups))
 
         if os.path.exists(file_path):
             os.remove(file_path)
-
-        return {
-            "created": 1 if status else 0,
-            "duplicates": 1 if not status else 0,
-            "pages": 1,
-            "details": [{"status": status}]
-        }
+        return _grouped_result(results, failures)
 
     # -----------------------------
     # 2B) Scanned PDF → process images
@@ -3256,53 +3903,80 @@ def upload_invoice_for_project(invoice_file,split_invoice=True):
             "details": [{"status": None, "error": "PDF contains no pages"}]
         }
 
-    # ---- SPLIT MODE ----
-    if split_invoice:
-        results = []
-        for idx, img in enumerate(images, start=1):
-            page_tag = f"p{idx}"
+    # ---- PER-INVOICE GROUPS (found from the pages, or one per page when splitting) ----
+    if split_invoice is not False:
+        with replay.stage('dedup'):
+            fingerprints = list(_network_executor.map(imaging.fingerprint_page, images))
+        groups = _scanned_page_groups(fingerprints, split_invoice)
+        failures = []
+
+        def process_group(idx, pages):
+            invoice_id = _scan_invoice_id(idempotency_key, idx)
+            if Invoice.objects.filter(invoice_id=invoice_id).exists():
+                close_old_connections()
+                return {"page": pages[0], "pages": pages, "status": True, "resumed": True}
+            page_tag = _pages_tag(pages)
             page_png = os.path.join(folder_name, f"invoice_{original_name_noext}_{page_tag}.png")
-            img.save(page_png, format="PNG")
-
-            page_pdf_path = generate_invoice_pdf(page_png)
+            page_pdf_path = None
             try:
+                group_fingerprints = [fingerprints[number - 1] for number in pages]
+                matches = [_fingerprint_scan(images[number - 1], fingerprints[number - 1])[1] for number in pages]
+                # A re-scan only if every page is a confirmed match of the same stored invoice
+                if all(_is_rescan(match) for match in matches) and len({match[0].pk for match in matches}) == 1:
+                    return {"page": pages[0], "pages": pages, **_rescan_detail(max(matches, key=lambda match: match[1]))}
+                # Otherwise the closest page match, if any, is kept on the invoice for review
+                suspected = min(filter(None, matches), key=lambda match: match[1], default=None)
+
+                if len(pages) == 1:
+                    page_image_bytes = images[pages[0] - 1]
+                else:
+                    page_image_bytes = merge_images_vertically([images[number - 1] for number in pages])
+                with open(page_png, "wb") as fpng:
+                    fpng.write(page_image_bytes)
+
+                page_pdf_path = generate_invoice_pdf(page_png)
                 pdf_content = extract_text_from_pdf(page_pdf_path)
-                with open(page_png, "rb") as fpng:
-                    page_image_bytes = fpng.read()
 
                 extracted_data = process_invoice_digital(pdf_content, page_image_bytes)
 
                 status = _save_single_invoice_record(
-                
-                    local_source_path=page_png,
+                    # A file holding one invoice keeps the original upload as its source
+                    local_source_path=file_path if len(groups) == 1 else page_png,
                     extracted_data=extracted_data,
-                    fallback_basename=f"{original_name_noext}_{page_tag}"
+                    fallback_basename=original_name_noext if len(groups) == 1 else f"{original_name_noext}_{page_tag}",
+                    fingerprints=group_fingerprints,
+                    invoice_id=invoice_id,
+                    suspected_duplicate=suspected
                 )
 
-                results.append({"page": idx, "status": status})
+                return {"page": pages[0], "pages": pages, "status": status, **_suspected_detail(suspected, status)}
             except Exception as e:
-                print(f"Error processing page {idx}: {e}")
-                results.append({"page": idx, "status": None, "error": str(e)})
+                print(f"Error processing pages {pages}: {e}")
+                failures.append((pages[0], e))
+                return {"page": pages[0], "pages": pages, "status": None, "error": str(e)}
             finally:
                 if os.path.exists(page_png):
                     os.remove(page_png)
-                if os.path.exists(page_pdf_path):
+                if page_pdf_path and os.path.exists(page_pdf_path):
                     os.remove(page_pdf_path)
+                close_old_connections()
+
+        # Invoices wait on OCR/LLM/GCS, so they overlap on the network threads;
+        # their CPU-heavy steps go to the image process pool from there
+        results = list(_network_executor.map(process_group, range(1, len(groups) + 1), groups))
 
         if os.path.exists(file_path):
             os.remove(file_path)
+        return _grouped_result(results, failures)
 
-        created = sum(1 for r in results if r["status"] is True)
-        duplicates = sum(1 for r in results if r["status"] is False)
-        return {"created": created, "duplicates": duplicates, "pages": len(results), "details": results}
+    # ---- FORCED MERGE ----
+    merged_image_bytes = images[0]
 
-    # ---- MERGE MODE ----
-    image_list = []
-    for img in images:
-        buf = io.BytesIO()
-        img.save(buf, format='PNG')
-        image_list.append(buf.getvalue())
-    merged_image_bytes = merge_images_vertically(image_list)
+    fingerprint, match = _fingerprint_scan(merged_image_bytes)
+    if _is_rescan(match):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        return {"created": 0, "duplicates": 1, "pages": 1, "details": [_rescan_detail(match)]}
 
     merged_png = os.path.join(folder_name, f"invoice_{original_name_noext}_merged.png")
     with open(merged_png, "wb") as f:
@@ -3315,7 +3989,10 @@ def upload_invoice_for_project(invoice_file,split_invoice=True):
     status = _save_single_invoice_record(
         local_source_path=file_path,
         extracted_data=extracted_data,
-        fallback_basename=original_name_noext
+        fallback_basename=original_name_noext,
+        fingerprints=[fingerprint],
+        invoice_id=_scan_invoice_id(idempotency_key, 1),
+        suspected_duplicate=match
     )
 
     # Cleanup
@@ -3329,9 +4006,121 @@ def upload_invoice_for_project(invoice_file,split_invoice=True):
         "created": 1 if status else 0,
         "duplicates": 1 if not status else 0,
         "pages": 1,
-        "details": [{"status": status}]
+        "details": [{"status": status, **_suspected_detail(match, status)}]
     }
 
+def _scan_invoice_id(idempotency_key, index):
+    """Invoice ID for the `index`-th invoice of an upload; the same on every attempt, so retries cannot double-book."""
+    return f"SCAN-{idempotency_key[:32]}-{index}"
+
+def _resumed_result(invoice_id):
+    """Result for a single-invoice upload whose invoice an earlier attempt already saved, else None."""
+    if not Invoice.objects.filter(invoice_id=invoice_id).exists():
+        return None
+    print(f"Invoice {invoice_id} was saved by an earlier attempt. Skipping.")
+    return {"created": 1, "duplicates": 0, "pages": 1, "details": [{"status": True, "resumed": True}]}
+
+def _pages_tag(pages):
+    return f"p{pages[0]}" if len(pages) == 1 else f"p{pages[0]}-{pages[-1]}"
+
+def _grouped_result(results, failures):
+    """Result of an upload processed as several invoices; raises once the others are saved if any failed."""
+    if failures:
+        raise PageIngestionError(failures)
+    created = sum(1 for r in results if r["status"] is True)
+    duplicates = sum(1 for r in results if r["status"] is False)
+    return {"created": created, "duplicates": duplicates, "pages": len(results), "details": results}
+
+def _forced_groups(page_count, split_invoice):
+    if split_invoice:
+        return [[number] for number in range(1, page_count + 1)]
+    return [list(range(1, page_count + 1))] if page_count else []
+
+def _digital_page_groups(pdf_bytes, split_invoice):
+    """
+    Pages of each invoice in a digital PDF.
+
+    split_invoice=True/False forces one invoice per page / one for the file; None
+    groups the pages by their footers, invoice numbers and QR codes (finance.grouping).
+    """
+    texts = grouping.page_texts(pdf_bytes)
+    if split_invoice is not None or len(texts) <= 1:
+        return _forced_groups(len(texts), split_invoice)
+    with replay.stage('grouping'):
+        signals = [grouping.page_signals(text) for text in texts]
+        if any(signal.invoice_number is None and signal.page is None for signal in signals):
+            # QR codes need the pages rendered; only worth it when the text leaves some page unplaced
+            pages = imaging.render_pdf_pages_png(pdf_bytes)
+            payloads = list(_network_executor.map(imaging.decode_qr, pages))
+            signals = [signal._replace(qr=payload or None) for signal, payload in zip(signals, payloads)]
+        groups = grouping.group_pages(signals)
+    logger.debug("Digital PDF pages grouped into %d invoice(s): %s", len(groups), groups)
+    return groups
+
+def _scanned_page_groups(fingerprints, split_invoice):
+    """Pages of each invoice in a scanned PDF (no text layer), grouped by their QR codes unless forced."""
+    if split_invoice is not None or len(fingerprints) <= 1:
+        return _forced_groups(len(fingerprints), split_invoice)
+    with replay.stage('grouping'):
+        groups = grouping.group_pages([grouping.page_signals(qr_payload=qr) for _, qr in fingerprints])
+    logger.debug("Scanned pages grouped into %d invoice(s): %s", len(groups), groups)
+    return groups
+
+def _process_digital_pdf(pdf_path, pdf_bytes, fallback_basename, invoice_id):
+    """Extract and save one invoice from a digital (text-layer) PDF; returns the save status."""
+    pdf_content = extract_text_from_pdf(pdf_path)
+    try:
+        with replay.stage('tables'):
+            line_items = lineitems.extract_line_items(pdf_path)
+    except Exception as e:
+        print("Line item table extraction failed:", e)
+        line_items = None
+    replay.observe('line_items_local', 1 if line_items else 0)
+    extracted_data = process_invoice_digital(pdf_content, pdf_bytes, line_items=line_items)
+
+    return _save_single_invoice_record(
+        local_source_path=pdf_path,
+        extracted_data=extracted_data,
+        fallback_basename=fallback_basename,
+        invoice_id=invoice_id
+    )
+
+def _fingerprint_scan(image_data, fingerprint=None):
+    """
+    Perceptual hash and QR payload of a scanned page, plus the stored invoice it looks like.
+
+    Runs locally, before any OCR/LLM/GCS call for the page. Pass `fingerprint` if
+    it was already computed (e.g. for page grouping) to skip hashing again.
+
+    Returns:
+        tuple: ((page_hash, qr_payload), (Invoice, distance, confirmed) or None)
+    """
+    with replay.stage('dedup'):
+        if fingerprint is None:
+            fingerprint = imaging.fingerprint_page(image_data)
+        match = duplicates.find_duplicate(*fingerprint)
+    if match:
+        invoice, distance, confirmed = match
+        if confirmed:
+            print(f"Page is a re-scan of invoice {invoice.invoice_number} (hash distance {distance}, same QR code). Skipping.")
+        else:
+            print(f"Page looks like invoice {invoice.invoice_number} (hash distance {distance}). Saving it as a suspected duplicate.")
+    return fingerprint, match
+
+def _is_rescan(match):
+    """A page is skipped as a re-scan only when its QR code confirms the hash match."""
+    return bool(match and match[2])
+
+def _rescan_detail(match):
+    invoice, distance, _ = match
+    return {"status": False, "duplicate_of": invoice.invoice_number, "distance": distance}
+
+def _suspected_detail(match, status):
+    if not match or not status:
+        return {}
+    invoice, distance, _ = match
+    return {"suspected_duplicate_of": invoice.invoice_number, "distance": distance}
+
 def delete_file(file_path):
     """
     Deletes the image at the given file path.
@@ -3340,10 +4129,15 @@ def delete_file(file_path):
         os.remove(file_path)
 
 
-def _save_single_invoice_record(local_source_path, extracted_data, fallback_basename):
+def _save_single_invoice_record(local_source_path, extracted_data, fallback_basename, fingerprints=None, invoice_id=None,
+                                suspected_duplicate=None):
     """
     Normalizes fields, checks duplicates, uploads to GCS, and saves one Invoice row.
 
+    `fingerprints` are the (page_hash, qr_payload) pairs of the scanned pages, kept for re-scan detection.
+    `invoice_id` should be stable across retries of the same upload (see _scan_invoice_id).
+    `suspected_duplicate` is an unconfirmed page match from _fingerprint_scan, recorded on the invoice for review.
+
     Returns:
         True  -> invoice created
         False -> duplicate (skipped)
@@ -3375,7 +4169,9 @@ def _save_single_invoice_record(local_source_path, extracted_data, fallback_base
 
     amount_before_vat = round(amount_before_vat,2)
     # Duplicate check
-    if Invoice.objects.filter(invoice_number=invoice_number).exists():
+    with replay.stage('db'):
+        is_duplicate = Invoice.objects.filter(invoice_number=invoice_number).exists()
+    if is_duplicate:
         print(f"Invoice with number {invoice_number} already exists. Skipping creation.")
         # Do NOT delete local_source_path here; caller cleans up
         return False
@@ -3386,41 +4182,77 @@ def _save_single_invoice_record(local_source_path, extracted_data, fallback_base
         source_file_path=local_source_path,
         credentials_file=settings.GOOGLE_CLOUD_PATH
     )
-    supplier, _ = Supplier.objects.get_or_create(name=supplier_name)
-    customer, _ = Customer.objects.get_or_create(name=customer_name)
-    # Create DB record
-    invoice = Invoice(
-        invoice_number=invoice_number,
-        date=extracted_data.get("Invoice Date"),
-        supplier=supplier,
-        supplier_vat=extracted_data.get("Supplier VAT"),
-        customer=customer,
-        customer_vat=extracted_data.get("Customer VAT"),
-        amount_before_vat=amount_before_vat,
-        total_vat=vat_amount,
-        total_amount=total_after_vat,
-        qr_code_present=extracted_data.get("QR Code Present"),
-    )
-    invoice.save()
+    # List pages show this thumbnail instead of fetching the source document
+    with replay.stage('preview'):
+        preview_key = previews.store_preview(local_source_path)
+    with replay.stage('db'):
+        supplier, _ = Supplier.objects.get_or_create(name=supplier_name)
+        customer, _ = Customer.objects.get_or_create(name=customer_name)
+        # Create DB record
+        invoice = Invoice(
+            invoice_id=invoice_id or f"SCAN-{uuid.uuid4().hex}",
+            invoice_number=invoice_number,
+            date=extracted_data.get("Invoice Date"),
+            supplier=supplier,
+            supplier_vat=extracted_data.get("Supplier VAT"),
+            customer=customer,
+            customer_vat=extracted_data.get("Customer VAT"),
+            amount_before_vat=amount_before_vat,
+            total_vat=vat_amount,
+            total_amount=total_after_vat,
+            qr_code_present=extracted_data.get("QR Code Present"),
+            preview_key=preview_key,
+        )
+        if suspected_duplicate:
+            invoice.duplicate_of, invoice.duplicate_distance, _ = suspected_duplicate
+        with transaction.atomic():
+            invoice.save()
+            InvoiceLineItem.objects.bulk_create(_invoice_line_items(invoice, extracted_data.get("Line Items")))
+            InvoicePageHash.objects.bulk_create(duplicates.page_hash_rows(invoice, fingerprints))
     print(f"Invoice with number {invoice_number} created successfully.")
     return True
 
+def _to_decimal(value, places):
+    if value is None or value == "":
+        return None
+    try:
+        return Decimal(str(value).replace(",", "")).quantize(Decimal(1).scaleb(-places))
+    except (InvalidOperation, ValueError):
+        return None
+
+def _invoice_line_items(invoice, items):
+    """Unsaved InvoiceLineItem rows for an extracted "Line Items" list; lines without a name or amount are skipped."""
+    rows = []
+    for item in items or []:
+        if not isinstance(item, dict):
+            continue
+        description = (item.get("Item Description") or "").strip()
+        name = (item.get("Item Name") or description).strip()
+        quantity = _to_decimal(item.get("Quantity"), 3)
+        unit_price = _to_decimal(item.get("Unit Price"), 2)
+        total_price = _to_decimal(item.get("Total Price"), 2)
+        if total_price is None and quantity is not None and unit_price is not None:
+            total_price = (quantity * unit_price).quantize(Decimal("0.01"))
+        if not name or total_price is None:
+            continue
+        rows.append(InvoiceLineItem(
+            invoice=invoice,
+            company=invoice.company,
+            supplier=invoice.supplier,
+            date=invoice.date,
+            line_number=len(rows) + 1,
+            item_name=name[:255],
+            item_description=description if description != name else "",
+            quantity=quantity if quantity is not None else Decimal(1),
+            unit_price=unit_price if unit_price is not None else total_price,
+            total_price=total_price,
+        ))
+    return rows
+
 def merge_images_vertically(image_list):
     """Merges multiple invoice images into a single image."""
-    images = [Image.open(io.BytesIO(img)) for img in image_list]
-    max_width = max(img.width for img in images)
-    total_height = sum(img.height for img in images)
-    merged_image = Image.new("RGB", (max_width, total_height), "white")
-
-    y_offset = 0
-    for img in images:
-        img = img.resize((max_width, int(img.height * (max_width / img.width)))) if img.width < max_width else img
-        merged_image.paste(img, (0, y_offset))
-        y_offset += img.height  
-
-    img_byte_array = io.BytesIO()
-    merged_image.save(img_byte_array, format="PNG")
-    return img_byte_array.getvalue()
+    with replay.stage('merge'):
+        return imaging.merge_images_vertically(image_list)
 
 class BankAccounts(View):
     """List all Bank Accounts"""
@@ -3437,10 +4269,13 @@ class BankAccounts(View):
                 name__icontains=search_query
             )
 
+        page = pagination.paginate(request, bank_accounts)
+
         context = {
-            'bank_accounts': bank_accounts,
+            'bank_accounts': page.object_list,
+            'page': page,
             'search_query': search_query,
-            'total_count': BankAccount.objects.count(),
+            'total_count': counters.count(BankAccount),
         }
         return render(request, 'finance/bank_accounts.html', context)
     
@@ -3539,10 +4374,13 @@ class BankAccountTypes(View):
                 account_type__icontains=search_query
             )
 
+        page = pagination.paginate(request, bank_account_types)
+
         context = {
-            'bank_account_types': bank_account_types,
+            'bank_account_types': page.object_list,
+            'page': page,
             'search_query': search_query,
-            'total_count': BankAccountType.objects.count(),
+            'total_count': counters.count(BankAccountType),
         }
         return render(request, 'finance/bank_account_types.html', context)
     
@@ -3642,10 +4480,13 @@ class BankAccountSubTypes(View):
                 account_type__icontains=search_query
             )
 
+        page = pagination.paginate(request, bank_account_subtypes)
+
         context = {
-            'bank_account_subtypes': bank_account_subtypes,
+            'bank_account_subtypes': page.object_list,
+            'page': page,
             'search_query': search_query,
-            'total_count': BankAccountSubtype.objects.count(),
+            'total_count': counters.count(BankAccountSubtype),
         }
         return render(request, 'finance/bank_account_subtypes.html', context)
 
@@ -3744,10 +4585,13 @@ class BankGuarantees(View):
                 type__icontains=search_query
             )
 
+        page = pagination.paginate(request, bank_guarantees)
+
         context = {
-            'bank_guarantees': bank_guarantees,
+            'bank_guarantees': page.object_list,
+            'page': page,
             'search_query': search_query,
-            'total_count': BankGuarantee.objects.count(),
+            'total_count': counters.count(BankGuarantee),
         }
         return render(request, 'finance/bank_guarantees.html', context)
     
@@ -3845,10 +4689,13 @@ class UnreconcilePayments(View):
                 type__icontains=search_query
             )
 
+        page = pagination.paginate(request, unreconcile_payments)
+
         context = {
-            'unreconcile_payments': unreconcile_payments,
+            'unreconcile_payments': page.object_list,
+            'page': page,
             'search_query': search_query,
-            'total_count': UnreconcilePayment.objects.count(),
+            'total_count': counters.count(UnreconcilePayment),
         }
         return render(request, 'finance/unreconcile_payments.html', context)
 
@@ -3946,10 +4793,13 @@ class ProcessPaymentReconciliationList(View):
                 party__icontains=search_query
             )
 
+        page = pagination.paginate(request, reconciliations)
+
         context = {
-            'reconciliations': reconciliations,
+            'reconciliations': page.object_list,
+            'page': page,
             'search_query': search_query,
-            'total_count': ProcessPaymentReconciliation.objects.count(),
+            'total_count': counters.count(ProcessPaymentReconciliation),
         }
         return render(
             request,
@@ -4060,10 +4910,13 @@ class DunningList(View):
                 customer__name__icontains=search_query
             )
 
+        page = pagination.paginate(request, dunnings)
+
         context = {
-            'dunnings': dunnings,
+            'dunnings': page.object_list,
+            'page': page,
             'search_query': search_query,
-            'total_count': Dunning.objects.count(),
+            'total_count': counters.count(Dunning),
         }
         return render(
             request,
@@ -4166,10 +5019,13 @@ class DunningTypeList(View):
                 dunning_type__icontains=search_query
             )
 
+        page = pagination.paginate(request, dunning_types)
+
         context = {
-            'dunning_types': dunning_types,
+            'dunning_types': page.object_list,
+            'page': page,
             'search_query': search_query,
-            'total_count': DunningType.objects.count(),
+            'total_count': counters.count(DunningType),
         }
         return render(
             request,
@@ -0,0 +1,128 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+# Detects invoice files dropped into watched directories by scanners and mail
+# gateways. On Linux the kernel's inotify reports a file once the writer closes
+# it (or once it is renamed into place), called through libc so no extra
+# package is needed. Elsewhere, or if inotify is unavailable, directories are
+# rescanned and a file counts as complete once its size and mtime stop changing.
+# Only the top level of each directory is watched; the daemon keeps its own
+# processing/done/failed folders underneath.
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+
+def list_files(directory, extensions, settle_seconds=0):
+    """Regular files at the top of `directory` with a matching extension, untouched for `settle_seconds`."""
+    now = time.time()
+    paths = []
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return paths
+    for entry in entries:
+        if entry.name.startswith('.') or not entry.name.lower().endswith(extensions):
+            continue
+        try:
+            if entry.is_file() and now - entry.stat().st_mtime >= settle_seconds:
+                paths.append(entry.path)
+        except FileNotFoundError:
+            continue  # moved away while we looked
+    return sorted(paths)
+
+
+class InotifyWatcher:
+    """Reports files that were closed after writing, or moved in, in the watched directories."""
+
+    def __init__(self, directories, extensions):
+        self.directories = list(directories)
+        self.extensions = extensions
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches = {}
+        for directory in self.directories:
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                self.close()
+                raise OSError(errno, f"inotify_add_watch failed for {directory}")
+            self._watches[wd] = directory
+
+    def poll(self, timeout):
+        """Paths ready for ingestion, waiting up to `timeout` seconds for the first one."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self._fd, 64 * 1024)
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b'\0')
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                # The kernel dropped events; fall back to a full listing
+                return [path for directory in self.directories for path in list_files(directory, self.extensions)]
+            name = os.fsdecode(name)
+            if wd in self._watches and name and not name.startswith('.') and name.lower().endswith(self.extensions):
+                paths.append(os.path.join(self._watches[wd], name))
+        return paths
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher:
+    """Rescans the directories every poll; a file is ready once it looks the same on two scans `settle_seconds` apart."""
+
+    def __init__(self, directories, extensions, settle_seconds=2.0):
+        self.directories = list(directories)
+        self.extensions = extensions
+        self.settle_seconds = settle_seconds
+        self._observed = {}  # path -> (size, mtime) at the previous scan
+        self._reported = set()
+
+    def poll(self, timeout):
+        time.sleep(max(timeout, self.settle_seconds))
+        current = {}
+        for directory in self.directories:
+            for path in list_files(directory, self.extensions):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                current[path] = (stat.st_size, stat.st_mtime)
+
+        ready = [
+            path for path, signature in current.items()
+            if self._observed.get(path) == signature and path not in self._reported
+        ]
+        self._reported = (self._reported & current.keys()) | set(ready)
+        self._observed = current
+        return sorted(ready)
+
+    def close(self):
+        pass
+
+
+def make_watcher(directories, extensions, use_inotify=True, settle_seconds=2.0):
+    """inotify where the platform has it, otherwise polling."""
+    if use_inotify and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(directories, extensions)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({e}); polling instead")
+    return PollingWatcher(directories, extensions, settle_seconds)